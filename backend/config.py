@@ -12,7 +12,10 @@ class Settings:
         self.DATA_DIR = self.ROOT_DIR / "data"
         self.UPLOAD_DIR = self.DATA_DIR / "uploads"
         self.VAULT_DIR = self.DATA_DIR / "vault_storage" 
+        self.VAULT_THUMB_DIR = self.VAULT_DIR / ".thumbs"
+        self.UPLOAD_STAGING_DIR = self.UPLOAD_DIR / ".staging"
         self.THUMBNAIL_DIR = self.DATA_DIR / "thumbnails"
+        self.RENDITION_DIR = self.DATA_DIR / "renditions"
         self.UPDATE_DIR = self.ROOT_DIR / "update_stage"
         
         self.DATABASE_URL = f"sqlite:///{self.DATA_DIR}/homehub.db"
@@ -21,12 +24,57 @@ class Settings:
         self.ALGORITHM = "HS256"
         self.ACCESS_TOKEN_EXPIRE_MINUTES = 30
         
+        # Расшифрованные превью сейфа держим в памяти не больше этого объёма
+        self.VAULT_THUMB_CACHE_BYTES = 64 * 1024 * 1024
+        
+        # Кэш уменьшенных копий (рендишенов) на диске
+        self.RENDITION_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+        self.RENDITION_SIZES = {"thumb": 256, "preview": 1024, "full": 2048, "original": None}
+        
+        # Отдельный пул для тяжёлой работы с изображениями и шифрованием
+        self.MEDIA_WORKERS = max(2, os.cpu_count() or 2)
+        self.MEDIA_QUEUE_LIMIT = 64
+        self.MEDIA_RETRY_AFTER_SEC = 1
+        
+        # Снимки строк media в памяти для контента, превью и просмотрщика
+        self.MEDIA_CACHE_MAX_ENTRIES = 50000
+        self.MEDIA_CACHE_MAX_ORDERINGS = 8
+        
+        # Пакетная выдача превью для сетки: не больше стольких id за запрос
+        self.THUMB_BATCH_MAX = 500
+        self.THUMB_BATCH_READERS = 8
+        # Сколько недостающих превью рендерить прямо в запросе; остальные — фоновой задачей
+        self.THUMB_BATCH_INLINE = 4
+        
+        # Возобновляемая загрузка крупных файлов
+        self.UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+        
+        # Фоновые задачи: параллельные файловые операции внутри одной задачи
+        self.JOB_FILE_WORKERS = max(2, min(4, os.cpu_count() or 2))
+        self.JOB_POLL_INTERVAL_SEC = 2.0
+        
+        # Анимированные WebP-превью видео (создаются по запросу в пуле воркеров)
+        self.VIDEO_PREVIEW_ENABLED = True
+        self.VIDEO_PREVIEW_FRAMES = 8
+        self.VIDEO_PREVIEW_SIZE = 320
+        self.VIDEO_PREVIEW_FRAME_MS = 300
+        
+        # Миграции схемы: заполнение данных пачками, сверх бюджета старта — в фоне
+        self.MIGRATION_BATCH_SIZE = 5000
+        self.MIGRATION_STARTUP_BUDGET_SEC = 3.0
+        
+        # Наблюдение за папкой загрузок
+        self.WATCH_ENABLED = True
+        self.WATCH_DEBOUNCE_SEC = 1.0
+        self.WATCH_POLL_INTERVAL_SEC = 5.0
+        self.WATCH_BATCH_SIZE = 200
+        
         self.VERSION = "1.4.0"
         self.GITHUB_REPO_OWNER = "BrowenSiz"
         self.GITHUB_REPO_NAME = "HomeHub"
 
     def init_directories(self):
-        for path in [self.DATA_DIR, self.UPLOAD_DIR, self.VAULT_DIR, self.THUMBNAIL_DIR]:
+        for path in [self.DATA_DIR, self.UPLOAD_DIR, self.VAULT_DIR, self.VAULT_THUMB_DIR, self.UPLOAD_STAGING_DIR, self.THUMBNAIL_DIR, self.RENDITION_DIR]:
             path.mkdir(parents=True, exist_ok=True)
 
 settings = Settings()
\ No newline at end of file
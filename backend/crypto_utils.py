@@ -1,8 +1,11 @@
+import io
 import os
+import struct
 from pathlib import Path
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from passlib.context import CryptContext
 
@@ -49,51 +52,200 @@ def decrypt_data(encrypted_data: bytes, key: bytes) -> bytes:
     except Exception:
         return None
 
-# --- ПОТОКОВОЕ ШИФРОВАНИЕ ФАЙЛОВ (AES-CTR) ---
-
-def encrypt_file(source_path: Path, dest_path: Path, key: bytes):
-    iv = os.urandom(16)
-    cipher = Cipher(algorithms.AES(key), modes.CTR(iv))
-    encryptor = cipher.encryptor()
-
-    with open(source_path, "rb") as f_in, open(dest_path, "wb") as f_out:
-        f_out.write(iv) # Сохраняем IV в начале файла
+# --- ПОТОКОВОЕ ШИФРОВАНИЕ ФАЙЛОВ ---
+#
+# Формат v3: заголовок + независимые блоки AES-GCM фиксированного размера.
+#   [magic 8][chunk_size 4][plain_size 8][owner 8][salt 32] затем блоки (данные + тег 16 байт).
+# Каждый файл шифруется своим ключом HKDF(мастер-ключ, salt), поэтому nonce блока — просто
+# его номер: у разных файлов разные ключи, и пары (ключ, nonce) не повторяются при любом
+# размере библиотеки. owner — id записи media, для которой файл записан (0 — неизвестно).
+# Заголовок идёт как AAD, поэтому блоки нельзя переставить или отрезать, а owner подменить.
+# Смещение блока вычисляется по номеру, что позволяет расшифровывать произвольный
+# диапазон байт (HTTP Range).
+#
+# Формат v2 — то же, но общий мастер-ключ и 4 случайных байта префикса nonce на файл
+# (риск совпадения nonce на больших библиотеках); v1 — сплошной AES-CTR с IV в начале.
+# Оба читаются для совместимости, /vault/migrate переписывает их в v3.
+
+VAULT_MAGIC = b"HHVAULT\x03"
+VAULT_MAGIC_V2 = b"HHVAULT\x02"
+VAULT_CHUNK_SIZE = 256 * 1024
+VAULT_TAG_SIZE = 16
+VAULT_HEADER = struct.Struct(">8sIQQ32s")
+VAULT_HEADER_V2 = struct.Struct(">8sIQ4s")
+FILE_KEY_INFO = b"homehub vault file v3"
+
+class VaultHeader:
+    def __init__(self, raw: bytes, chunk_size: int, plain_size: int, prefix: bytes, salt: bytes = None, owner: int = 0):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.plain_size = plain_size
+        self.prefix = prefix
+        self.salt = salt
+        self.owner = owner
+
+    def cipher(self, key: bytes) -> AESGCM:
+        return AESGCM(key if self.salt is None else _file_key(key, self.salt))
+
+def _file_key(key: bytes, salt: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=FILE_KEY_INFO).derive(key)
+
+def _chunk_nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(8, "big")
+
+def _read_header(f_in):
+    magic = f_in.read(len(VAULT_MAGIC))
+    if magic == VAULT_MAGIC:
+        rest = f_in.read(VAULT_HEADER.size - len(magic))
+        if len(rest) < VAULT_HEADER.size - len(magic):
+            return None
+        raw = magic + rest
+        _, chunk_size, plain_size, owner, salt = VAULT_HEADER.unpack(raw)
+        return VaultHeader(raw, chunk_size, plain_size, bytes(4), salt, owner)
+    if magic == VAULT_MAGIC_V2:
+        rest = f_in.read(VAULT_HEADER_V2.size - len(magic))
+        if len(rest) < VAULT_HEADER_V2.size - len(magic):
+            return None
+        raw = magic + rest
+        _, chunk_size, plain_size, prefix = VAULT_HEADER_V2.unpack(raw)
+        return VaultHeader(raw, chunk_size, plain_size, prefix)
+    return None
+
+def read_vault_header(path: Path):
+    """Заголовок v2/v3 без расшифровки (None для v1 или чужого файла)."""
+    with open(path, "rb") as f_in:
+        return _read_header(f_in)
+
+def is_chunked_vault_file(path: Path) -> bool:
+    return read_vault_header(path) is not None
+
+def is_current_vault_file(path: Path) -> bool:
+    header = read_vault_header(path)
+    return header is not None and header.salt is not None
+
+def get_plain_size(path: Path) -> int:
+    """Размер расшифрованного содержимого без расшифровки."""
+    header = read_vault_header(path)
+    if header:
+        return header.plain_size
+    return max(path.stat().st_size - 16, 0)
+
+def _rechunk(stream, size: int):
+    buffer = bytearray()
+    for piece in stream:
+        buffer.extend(piece)
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+def _write_chunked(stream, plain_size: int, f_out, key: bytes, progress=None, owner: int = 0):
+    raw = VAULT_HEADER.pack(VAULT_MAGIC, VAULT_CHUNK_SIZE, plain_size, owner, os.urandom(32))
+    header = _read_header(io.BytesIO(raw))
+    aesgcm = header.cipher(key)
+    f_out.write(raw)
+
+    written = 0
+    for index, chunk in enumerate(_rechunk(stream, VAULT_CHUNK_SIZE)):
+        f_out.write(aesgcm.encrypt(_chunk_nonce(header.prefix, index), chunk, raw))
+        written += len(chunk)
+        if progress: progress(len(chunk))
+    if written != plain_size:
+        raise ValueError("Source size changed during encryption")
+
+def _read_file_chunks(path: Path):
+    with open(path, "rb") as f_in:
         while chunk := f_in.read(CHUNK_SIZE):
-            f_out.write(encryptor.update(chunk))
-        f_out.write(encryptor.finalize())
-
-def decrypt_file_to_disk(encrypted_path: Path, dest_path: Path, key: bytes):
-    with open(encrypted_path, "rb") as f_in:
-        iv = f_in.read(16)
-        cipher = Cipher(algorithms.AES(key), modes.CTR(iv))
-        decryptor = cipher.decryptor()
-
-        with open(dest_path, "wb") as f_out:
-            while chunk := f_in.read(CHUNK_SIZE):
-                f_out.write(decryptor.update(chunk))
-            f_out.write(decryptor.finalize())
+            yield chunk
+
+def encrypt_file(source_path: Path, dest_path: Path, key: bytes, progress=None, owner: int = 0):
+    """progress(n) вызывается после каждого зашифрованного куска; исключение из него прерывает запись."""
+    plain_size = source_path.stat().st_size
+    with open(dest_path, "wb") as f_out:
+        _write_chunked(_read_file_chunks(source_path), plain_size, f_out, key, progress, owner)
+
+def _decrypt_chunked_range(f_in, header: VaultHeader, key: bytes, start: int, end: int):
+    chunk_size = header.chunk_size
+    aesgcm = header.cipher(key)
+    first = start // chunk_size
+    last = end // chunk_size
+
+    f_in.seek(len(header.raw) + first * (chunk_size + VAULT_TAG_SIZE))
+    for index in range(first, last + 1):
+        encrypted = f_in.read(chunk_size + VAULT_TAG_SIZE)
+        chunk = aesgcm.decrypt(_chunk_nonce(header.prefix, index), encrypted, header.raw)
+        chunk_start = index * chunk_size
+        lo = max(start - chunk_start, 0)
+        hi = min(end - chunk_start + 1, len(chunk))
+        yield chunk[lo:hi]
+
+def _decrypt_ctr_range(f_in, key: bytes, start: int, end: int):
+    iv = f_in.read(16)
+    if len(iv) < 16:
+        return
 
-def decrypt_file_generator(source_path: Path, key: bytes):
+    # CTR позволяет начать с любого блока: сдвигаем счётчик на номер блока
+    block, skip = divmod(start, 16)
+    counter = ((int.from_bytes(iv, "big") + block) % (1 << 128)).to_bytes(16, "big")
+    decryptor = Cipher(algorithms.AES(key), modes.CTR(counter)).decryptor()
+
+    f_in.seek(16 + block * 16)
+    remaining = end - block * 16 + 1
+    while remaining > 0:
+        chunk = f_in.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        data = decryptor.update(chunk)
+        if skip:
+            data = data[skip:]
+            skip = 0
+        yield data
+
+def decrypt_file_generator(source_path: Path, key: bytes, start: int = 0, end: int = None):
+    """Отдаёт расшифрованные байты [start, end] включительно (по умолчанию — весь файл)."""
     if not source_path.exists():
         return
 
     with open(source_path, "rb") as f_in:
-        iv = f_in.read(16)
-        if len(iv) < 16:
+        header = _read_header(f_in)
+        if header:
+            plain_size = header.plain_size
+        else:
+            f_in.seek(0)
+            plain_size = max(source_path.stat().st_size - 16, 0)
+
+        if end is None or end >= plain_size:
+            end = plain_size - 1
+        if start > end:
             return
 
-        cipher = Cipher(algorithms.AES(key), modes.CTR(iv))
-        decryptor = cipher.decryptor()
+        if header:
+            yield from _decrypt_chunked_range(f_in, header, key, start, end)
+        else:
+            yield from _decrypt_ctr_range(f_in, key, start, end)
 
-        while chunk := f_in.read(CHUNK_SIZE):
-            yield decryptor.update(chunk)
-        
-        yield decryptor.finalize()
+def decrypt_file_to_disk(encrypted_path: Path, dest_path: Path, key: bytes, progress=None):
+    with open(dest_path, "wb") as f_out:
+        for chunk in decrypt_file_generator(encrypted_path, key):
+            f_out.write(chunk)
+            if progress: progress(len(chunk))
 
 def decrypt_file_to_memory(source_path: Path, key: bytes) -> bytes:
-    with open(source_path, "rb") as f_in:
-        iv = f_in.read(16)
-        cipher = Cipher(algorithms.AES(key), modes.CTR(iv))
-        decryptor = cipher.decryptor()
-        encrypted_data = f_in.read()
-        return decryptor.update(encrypted_data) + decryptor.finalize()
\ No newline at end of file
+    return b"".join(decrypt_file_generator(source_path, key))
+
+def migrate_legacy_file(path: Path, key: bytes, owner: int = 0) -> bool:
+    """Переписывает файл формата v1/v2 в формат v3. Возвращает True, если файл был перезаписан."""
+    if is_current_vault_file(path):
+        return False
+
+    plain_size = get_plain_size(path)
+    tmp_path = path.with_name(path.name + ".migrating")
+    try:
+        with open(tmp_path, "wb") as f_out:
+            _write_chunked(decrypt_file_generator(path, key), plain_size, f_out, key, owner=owner)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists(): os.unlink(tmp_path)
+    return True
@@ -1,14 +1,50 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..config import settings
 
-engine = create_engine(
-    settings.DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+# WAL: читатели не ждут писателя (скан не замораживает ленту), synchronous=NORMAL
+# в WAL не теряет целостность, а при сбое питания теряется максимум последняя транзакция.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64 * 1024,           # в КиБ: 64 МиБ страничного кэша на соединение
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 10000,              # мс ожидания блокировки вместо мгновенного "database is locked"
+}
+
+def _apply_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+def make_engine(url: str, read_only: bool = False, pool_size: int = 5):
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size,
+        max_overflow=pool_size * 2,
+    )
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        _apply_pragmas(dbapi_connection, read_only)
+
+    return engine
+
+# Писатель один на уровне SQLite, поэтому пул небольшой; читателей столько, сколько
+# потоков могут одновременно отдавать ленту, превью и поиск.
+engine = make_engine(settings.DATABASE_URL, pool_size=5)
+read_engine = make_engine(settings.DATABASE_URL, read_only=True, pool_size=settings.MEDIA_WORKERS + 4)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
 
@@ -17,4 +53,17 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    """Сессия только для чтения: для списков, поиска и статистики."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def optimize():
+    """Обновляет статистику планировщика там, где она устарела (дёшево, можно на каждом старте)."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
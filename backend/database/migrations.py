@@ -0,0 +1,193 @@
+import time
+import threading
+from datetime import datetime
+from sqlalchemy import text
+from ..config import settings
+from .database import Base
+from . import models  # noqa: F401 — таблицы должны быть в Base.metadata
+
+# create_all создаёт только отсутствующие таблицы: новые колонки и индексы в уже
+# существующих базах появляются только через миграции. Каждая миграция идемпотентна
+# (проверяет, что уже есть), поэтому на свежей базе после create_all это пустые шаги.
+VERSIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at DATETIME NOT NULL,
+    duration_ms INTEGER NOT NULL
+)
+"""
+
+class Migration:
+    """schema — быстрые DDL-шаги в одной транзакции; backfill — заполнение данных пачками.
+
+    backfill(conn, last_id, batch_size) обрабатывает следующую пачку строк с id > last_id
+    и возвращает новый last_id или None, когда строк больше нет.
+    """
+
+    def __init__(self, version: int, name: str, schema=None, backfill=None):
+        self.version = version
+        self.name = name
+        self.schema = schema
+        self.backfill = backfill
+
+def _columns(conn, table: str):
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+def _add_column(conn, table: str, name: str, default=None):
+    # ADD COLUMN с константным DEFAULT в SQLite не переписывает таблицу
+    if name in _columns(conn, table):
+        return
+    column = Base.metadata.tables[table].c[name]
+    ddl = f"ALTER TABLE {table} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    conn.exec_driver_sql(ddl)
+
+def _create_index(conn, table: str, name: str):
+    index = next(i for i in Base.metadata.tables[table].indexes if i.name == name)
+    index.create(conn, checkfirst=True)
+
+def _next_upper_id(conn, table: str, last_id: int, batch_size: int):
+    return conn.exec_driver_sql(
+        f"SELECT max(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+        (last_id, batch_size),
+    ).scalar()
+
+# --- Миграции ---
+
+def _media_columns(conn):
+    _add_column(conn, "media", "content_hash")
+    _add_column(conn, "media", "phash")
+    _add_column(conn, "media", "taken_at")
+    _add_column(conn, "media", "is_missing", default=0)
+    _create_index(conn, "media", "ix_media_content_hash")
+
+def _backfill_taken_at(conn, last_id: int, batch_size: int):
+    # Дата съёмки из уже извлечённого EXIF, иначе — mtime файла (так её берёт сканер);
+    # дата добавления — только если файла нет на диске
+    upper = _next_upper_id(conn, "media", last_id, batch_size)
+    if upper is None:
+        return None
+    rows = conn.exec_driver_sql(
+        "SELECT media.id, media.original_path, media.is_encrypted, media.created_at, mm.taken_at "
+        "FROM media LEFT JOIN media_metadata mm ON mm.media_id = media.id "
+        "WHERE media.id > ? AND media.id <= ? AND media.taken_at IS NULL",
+        (last_id, upper),
+    ).all()
+    updates = []
+    for media_id, original_path, is_encrypted, created_at, exif_taken_at in rows:
+        taken_at = exif_taken_at
+        if taken_at is None and not is_encrypted and original_path:
+            try:
+                taken_at = datetime.fromtimestamp((settings.UPLOAD_DIR / original_path).stat().st_mtime)
+            except OSError:
+                pass
+        updates.append({"taken_at": taken_at or created_at, "id": media_id})
+    if updates:
+        conn.execute(text("UPDATE media SET taken_at = :taken_at WHERE id = :id"), updates)
+    return upper
+
+def _feed_indexes(conn):
+    _create_index(conn, "media", "ix_media_encrypted_taken")
+    _create_index(conn, "media", "ix_media_album_encrypted_taken")
+
+def _video_metadata(conn):
+    for name in ("duration", "video_codec", "fps"):
+        _add_column(conn, "media_metadata", name)
+
+def _job_item_size(conn):
+    _add_column(conn, "job_items", "size", default=0)
+    _create_index(conn, "job_items", "ix_job_items_job_status")
+
+MIGRATIONS = [
+    Migration(1, "media: content_hash, phash, taken_at, is_missing", _media_columns, _backfill_taken_at),
+    Migration(2, "media: feed indexes on (is_encrypted, taken_at)", _feed_indexes),
+    Migration(3, "media_metadata: video columns", _video_metadata),
+    Migration(4, "job_items: size", _job_item_size),
+]
+
+# --- Запуск ---
+
+def _applied(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(VERSIONS_TABLE)
+        return {row[0] for row in conn.exec_driver_sql("SELECT version FROM schema_migrations")}
+
+def _record(engine, migration: Migration, duration: float):
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT OR REPLACE INTO schema_migrations (version, name, applied_at, duration_ms) "
+                 "VALUES (:version, :name, :applied_at, :duration_ms)"),
+            {"version": migration.version, "name": migration.name,
+             "applied_at": datetime.utcnow(), "duration_ms": int(duration * 1000)},
+        )
+    print(f"--- [DB] Миграция {migration.version} ({migration.name}): {duration * 1000:.0f} мс")
+
+def _run_backfill(engine, migration: Migration, state: dict, deadline=None) -> bool:
+    """Пачки в отдельных транзакциях: читатели (WAL) и писатели не ждут всю миграцию.
+    False — вышло время до deadline, продолжение с state["last_id"]."""
+    if migration.backfill is None:
+        return True
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        started = time.monotonic()
+        with engine.begin() as conn:
+            last_id = migration.backfill(conn, state["last_id"], settings.MIGRATION_BATCH_SIZE)
+        state["elapsed"] += time.monotonic() - started
+        if last_id is None:
+            return True
+        state["last_id"] = last_id
+
+def _finish_in_background(engine, pending):
+    # Сервер уже отвечает: снимки строк, прочитанные до заполнения, устарели
+    from ..services import media_cache
+    for migration, state in pending:
+        try:
+            _run_backfill(engine, migration, state)
+            _record(engine, migration, state["elapsed"])
+        except Exception as e:
+            # Версия не записана: шаг повторится при следующем запуске
+            print(f"--- [DB] Миграция {migration.version} прервана: {e}")
+            return
+        finally:
+            media_cache.cache.invalidate()
+
+def run(engine, budget_sec: float = None):
+    """Применяет недостающие миграции. DDL выполняется сразу; заполнение данных — пока
+    не истечёт бюджет старта, остаток дорабатывает фоновый поток."""
+    budget_sec = settings.MIGRATION_STARTUP_BUDGET_SEC if budget_sec is None else budget_sec
+    applied = _applied(engine)
+    todo = [m for m in MIGRATIONS if m.version not in applied]
+    if not todo:
+        return None
+
+    # Схема нужна приложению целиком до первого запроса
+    states = {}
+    for migration in todo:
+        started = time.monotonic()
+        if migration.schema:
+            with engine.begin() as conn:
+                migration.schema(conn)
+        # В длительность идёт только собственная работа миграции, без ожидания в очереди
+        states[migration.version] = {"elapsed": time.monotonic() - started, "last_id": 0}
+
+    deadline = time.monotonic() + budget_sec
+    pending = []
+    for migration in todo:
+        state = states[migration.version]
+        if pending or not _run_backfill(engine, migration, state, deadline):
+            pending.append((migration, state))
+            continue
+        _record(engine, migration, state["elapsed"])
+
+    if not pending:
+        return None
+    print(f"--- [DB] Заполнение данных продолжится в фоне: {len(pending)} миграц.")
+    thread = threading.Thread(target=_finish_in_background, args=(engine, pending), name="migrations", daemon=True)
+    thread.start()
+    return thread
+
+def history(db):
+    return db.execute(text("SELECT version, name, applied_at, duration_ms FROM schema_migrations ORDER BY version")).all()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, LargeBinary, Index, Float
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -35,18 +35,127 @@ class Album(Base):
 
 class Media(Base):
     __tablename__ = "media"
+    __table_args__ = (
+        # Лента и альбомы упорядочены по дате съёмки, пагинация по ключу (taken_at, id)
+        Index("ix_media_encrypted_taken", "is_encrypted", "taken_at", "id"),
+        Index("ix_media_album_encrypted_taken", "album_id", "is_encrypted", "taken_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
     original_path = Column(String, unique=True, index=True)
     file_size = Column(Integer)
+    # BLAKE2b содержимого: находим повторную загрузку того же файла
+    content_hash = Column(String, nullable=True, index=True)
     media_type = Column(String)
     thumbnail_path = Column(String, nullable=True)
+    # Перцептивный dHash (64 бита, знаковое целое) для поиска похожих снимков
+    phash = Column(Integer, nullable=True)
     
     is_encrypted = Column(Boolean, default=False)
     encrypted_filename = Column(String, nullable=True)
     
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Дата съёмки (EXIF DateTimeOriginal или mtime файла), заполняется при загрузке
+    taken_at = Column(DateTime, default=datetime.utcnow)
     album_id = Column(Integer, ForeignKey("albums.id"), nullable=True)
+    is_missing = Column(Boolean, default=False)
 
-    album = relationship("Album", back_populates="media_items")
\ No newline at end of file
+    album = relationship("Album", back_populates="media_items")
+    file_index = relationship("FileIndex", back_populates="media", uselist=False, cascade="all, delete-orphan")
+    media_meta = relationship("MediaMetadata", back_populates="media", uselist=False, cascade="all, delete-orphan")
+
+class FileIndex(Base):
+    """Отпечаток файла на диске для инкрементального сканирования."""
+    __tablename__ = "file_index"
+
+    id = Column(Integer, primary_key=True, index=True)
+    media_id = Column(Integer, ForeignKey("media.id"), unique=True, index=True)
+    path = Column(String, unique=True, index=True)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    inode = Column(Integer, index=True)
+
+    media = relationship("Media", back_populates="file_index")
+
+class MediaMetadata(Base):
+    """Метаданные, извлечённые один раз при загрузке или сканировании."""
+    __tablename__ = "media_metadata"
+
+    media_id = Column(Integer, ForeignKey("media.id"), primary_key=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    taken_at = Column(DateTime, nullable=True)
+
+    camera_make = Column(String, nullable=True)
+    camera_model = Column(String, nullable=True)
+    lens = Column(String, nullable=True)
+    software = Column(String, nullable=True)
+    iso = Column(String, nullable=True)
+    exposure = Column(String, nullable=True)
+    f_number = Column(String, nullable=True)
+    focal_length = Column(String, nullable=True)
+
+    gps_lat = Column(Float, nullable=True)
+    gps_lng = Column(Float, nullable=True)
+
+    # Для видео: из заголовков контейнера
+    duration = Column(Float, nullable=True)
+    video_codec = Column(String, nullable=True)
+    fps = Column(Float, nullable=True)
+
+    extracted_at = Column(DateTime, default=datetime.utcnow)
+
+    media = relationship("Media", back_populates="media_meta")
+
+class UploadSession(Base):
+    """Возобновляемая загрузка: куски пишутся по смещению в файл в UPLOAD_DIR/.staging."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True)
+    filename = Column(String)
+    total_size = Column(Integer)
+    # JSON-список полученных полуинтервалов [[start, end], ...]
+    received_ranges = Column(String, default="[]")
+    received_bytes = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class Job(Base):
+    """Долгая фоновая операция (шифрование, скан, удаление...), переживает перезапуск."""
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, index=True)
+    # queued, running, completed, failed, cancelled
+    status = Column(String, default="queued", index=True)
+    # JSON с параметрами задачи (режим скана, force и т.п.)
+    params = Column(String, default="{}")
+    # JSON с итогом для задач без элементов (например, отчёт сканера)
+    result = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+
+    items_total = Column(Integer, default=0)
+    items_done = Column(Integer, default=0)
+    items_failed = Column(Integer, default=0)
+    bytes_total = Column(Integer, default=0)
+    bytes_done = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class JobItem(Base):
+    """Элемент задачи: по ним задача продолжается после перезапуска с того же места."""
+    __tablename__ = "job_items"
+    __table_args__ = (
+        Index("ix_job_items_job_status", "job_id", "status", "media_id"),
+    )
+
+    job_id = Column(String, ForeignKey("jobs.id"), primary_key=True)
+    media_id = Column(Integer, primary_key=True)
+    # pending, done, failed, skipped
+    status = Column(String, default="pending")
+    size = Column(Integer, default=0)
+    error = Column(String, nullable=True)
@@ -13,17 +13,25 @@ import uvicorn
 import webview
 
 from .config import settings
-from .routers import auth, albums, media, system
-from .services import updater 
-from .database import database
+from .routers import auth, albums, media, system, uploads, jobs
+from .services import updater, watcher, workers, search, jobs as job_service
+from .database import database, migrations
 
-try:
-    updater.cleanup_old_versions()
-except:
-    pass
+def init_storage():
+    """
+    Подготовка данных перед запуском сервера. Не выполняется при импорте: воркеры
+    ProcessPool на Windows (spawn) заново импортируют модули и повторяли бы миграции.
+    """
+    try:
+        updater.cleanup_old_versions()
+    except:
+        pass
 
-settings.init_directories()
-database.Base.metadata.create_all(bind=database.engine)
+    settings.init_directories()
+    database.Base.metadata.create_all(bind=database.engine)
+    migrations.run(database.engine)
+    search.init_index(database.engine)
+    database.optimize()
 
 app = FastAPI(title="HomeHub", version=settings.VERSION)
 
@@ -35,6 +43,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(workers.WorkerPoolBusy)
+async def worker_pool_busy_handler(request, exc: workers.WorkerPoolBusy):
+    return JSONResponse({"detail": "Server busy"}, status_code=503, headers={"Retry-After": str(exc.retry_after)})
+
 @app.get("/api/health")
 def health_check():
     return {"status": "ok", "version": settings.VERSION}
@@ -42,10 +54,12 @@ def health_check():
 app.include_router(auth.router)
 app.include_router(albums.router)
 app.include_router(media.router)
+app.include_router(uploads.router)
+app.include_router(jobs.router)
 app.include_router(system.router)
 
-settings.THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
-app.mount("/thumbnails", StaticFiles(directory=settings.THUMBNAIL_DIR), name="thumbnails")
+# Каталог создаёт init_storage, поэтому при импорте его наличие не проверяем
+app.mount("/thumbnails", StaticFiles(directory=settings.THUMBNAIL_DIR, check_dir=False), name="thumbnails")
 
 # Static Files
 is_frozen = getattr(sys, 'frozen', False)
@@ -80,6 +94,10 @@ else:
         return {"message": "HomeHub Backend Running", "mode": "Headless"}
 
 def start_server():
+    init_storage()
+    watcher.start_watcher()
+    # Продолжаем задачи, прерванные прошлым запуском
+    job_service.manager.start()
     uvicorn.run(app, host="127.0.0.1", port=8000, log_level="error")
 
 def check_server_port(host, port):
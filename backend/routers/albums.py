@@ -1,43 +1,60 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, and_
 from sqlalchemy.orm import Session
 from typing import List
 from ..database import database, models
 from .. import schemas
+from ..services import media_cache
 
 router = APIRouter(prefix="/api/albums", tags=["albums"])
 
 @router.get("/", response_model=List[schemas.AlbumSummary])
-def read_albums(db: Session = Depends(database.get_db)):
-    albums = db.query(models.Album).all()
-    
-    result = []
-    for album in albums:
-        media_count = db.query(models.Media).filter(
-            models.Media.album_id == album.id,
-            models.Media.is_encrypted == False
-        ).count()
-        
-        cover = db.query(models.Media).filter(
-            models.Media.album_id == album.id,
-            models.Media.is_encrypted == False,
-            models.Media.thumbnail_path != None
-        ).order_by(models.Media.created_at.desc()).first()
+def read_albums(db: Session = Depends(database.get_read_db)):
+    # Количество и обложка для всех альбомов одним запросом (GROUP BY + оконная функция)
+    counts = db.query(
+        models.Media.album_id.label("album_id"),
+        func.count(models.Media.id).label("media_count")
+    ).filter(
+        models.Media.album_id != None,
+        models.Media.is_encrypted == False
+    ).group_by(models.Media.album_id).subquery()
+
+    covers = db.query(
+        models.Media.album_id.label("album_id"),
+        models.Media.thumbnail_path.label("thumbnail_path"),
+        func.row_number().over(
+            partition_by=models.Media.album_id,
+            order_by=(models.Media.taken_at.desc(), models.Media.id.desc())
+        ).label("rn")
+    ).filter(
+        models.Media.album_id != None,
+        models.Media.is_encrypted == False,
+        models.Media.thumbnail_path != None
+    ).subquery()
+
+    rows = db.query(
+        models.Album,
+        func.coalesce(counts.c.media_count, 0),
+        covers.c.thumbnail_path
+    ).outerjoin(counts, counts.c.album_id == models.Album.id)\
+     .outerjoin(covers, and_(covers.c.album_id == models.Album.id, covers.c.rn == 1))\
+     .all()
 
-        album_data = schemas.AlbumSummary(
+    return [
+        schemas.AlbumSummary(
             id=album.id,
             name=album.name,
             description=album.description,
             created_at=album.created_at,
             is_encrypted=album.is_encrypted,
             media_count=media_count,
-            cover_photo=cover.thumbnail_path if cover else None
+            cover_photo=cover_photo
         )
-        result.append(album_data)
-        
-    return result
+        for album, media_count, cover_photo in rows
+    ]
 
 @router.get("/{album_id}", response_model=schemas.AlbumDetail)
-def read_album_details(album_id: int, db: Session = Depends(database.get_db)):
+def read_album_details(album_id: int, db: Session = Depends(database.get_read_db)):
     album = db.query(models.Album).filter(models.Album.id == album_id).first()
     if not album:
         raise HTTPException(status_code=404, detail="Альбом не найден")
@@ -45,7 +62,7 @@ def read_album_details(album_id: int, db: Session = Depends(database.get_db)):
     media_items = db.query(models.Media).filter(
         models.Media.album_id == album.id,
         models.Media.is_encrypted == False
-    ).order_by(models.Media.created_at.desc()).all()
+    ).order_by(models.Media.taken_at.desc(), models.Media.id.desc()).all()
 
     album.media_items = media_items
     # media_count и cover заполнятся автоматически или можно пропустить для detail
@@ -70,4 +87,5 @@ def delete_album(album_id: int, db: Session = Depends(database.get_db)):
     
     db.delete(album)
     db.commit()
+    media_cache.cache.invalidate()
     return {"status": "success", "message": "Альбом удален, фото сохранены в библиотеке"}
\ No newline at end of file
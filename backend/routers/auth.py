@@ -4,6 +4,7 @@ from ..database import database, models
 from .. import schemas, crypto_utils
 from ..runtime import vault_state
 from ..config import settings
+from ..services import vault_thumbs
 import os
 import shutil
 
@@ -22,7 +23,7 @@ def secure_wipe_cache():
         print(f"Cache wipe error: {e}")
 
 @router.get("/status")
-def get_auth_status(db: Session = Depends(database.get_db)):
+def get_auth_status(db: Session = Depends(database.get_read_db)):
     config = db.query(models.SystemConfig).first()
     is_open = vault_state.get_key() is not None
     return {
@@ -31,7 +32,7 @@ def get_auth_status(db: Session = Depends(database.get_db)):
     }
 
 @router.get("/stats", response_model=schemas.SystemStats)
-def get_system_stats(db: Session = Depends(database.get_db)):
+def get_system_stats(db: Session = Depends(database.get_read_db)):
     config = db.query(models.SystemConfig).first()
     total_files = db.query(models.Media).count()
     
@@ -124,5 +125,6 @@ def change_pin(data: schemas.ChangePinRequest, db: Session = Depends(database.ge
 @router.post("/lock")
 def lock_vault():
     vault_state.clear()
+    vault_thumbs.store.wipe_memory()
     secure_wipe_cache()
     return {"status": "locked"}
\ No newline at end of file
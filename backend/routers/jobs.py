@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from ..database import database, models
+from .. import schemas
+from ..services import jobs
+from ..runtime import vault_state
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+RECENT_JOBS_LIMIT = 50
+
+def get_job(db: Session, job_id: str):
+    job = db.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def submit_job(db: Session, kind: str, ids=None, params: dict = None):
+    """Общая постановка задачи для этого роутера и фоновых режимов /api/media/bulk/*."""
+    if kind in jobs.KEY_KINDS and vault_state.get_key() is None:
+        raise HTTPException(status_code=403, detail="Vault is locked")
+    try:
+        job = jobs.manager.submit(db, kind, ids, params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return jobs.manager.snapshot(job)
+
+@router.get("/")
+def list_jobs(db: Session = Depends(database.get_read_db)):
+    rows = db.query(models.Job).order_by(models.Job.created_at.desc()).limit(RECENT_JOBS_LIMIT).all()
+    return [jobs.manager.snapshot(job) for job in rows]
+
+@router.post("/", status_code=202)
+def create_job(data: schemas.JobCreate, db: Session = Depends(database.get_db)):
+    return submit_job(db, data.kind, data.ids, data.params)
+
+@router.get("/{job_id}")
+def get_job_status(job_id: str, db: Session = Depends(database.get_read_db)):
+    return jobs.manager.snapshot(get_job(db, job_id))
+
+@router.get("/{job_id}/items")
+def get_job_problems(job_id: str, db: Session = Depends(database.get_read_db)):
+    """Элементы, которые не удалось обработать или пришлось пропустить, с причиной."""
+    get_job(db, job_id)
+    return [{"id": row.media_id, "status": row.status, "error": row.error}
+            for row in jobs.failed_items(db, job_id)]
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str, db: Session = Depends(database.get_db)):
+    job = jobs.manager.cancel(db, get_job(db, job_id))
+    return jobs.manager.snapshot(job)
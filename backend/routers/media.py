@@ -1,210 +1,339 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File, Request
+from fastapi.responses import StreamingResponse, Response
+from sqlalchemy import tuple_, func, type_coerce, Integer
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional, Any
 import os
-import shutil
-import mimetypes
 import tempfile
-import io
-import time
+import base64
 from pathlib import Path
 from datetime import datetime
-from PIL import Image, ExifTags
 from ..database import database, models
 from .. import schemas, crypto_utils
-from ..services import scanner, thumbnail
+from ..services import scanner, thumbnail, vault_thumbs, renditions, workers, metadata, ingest, duplicates, video, search, bulk, http_cache, thumb_batch, media_cache
 from ..config import settings
+from . import jobs as jobs_router
 from ..runtime import vault_state
 
 router = APIRouter(prefix="/api/media", tags=["media"])
 
-def _convert_to_degrees(value):
-    try:
-        d = float(value[0])
-        m = float(value[1])
-        s = float(value[2])
-        return d + (m / 60.0) + (s / 3600.0)
-    except Exception:
-        return None
-
-def _get_gps_info(exif):
-    if not exif or 'GPSInfo' not in exif:
-        return None
-    
-    gps_tags = exif['GPSInfo']
-    lat = gps_tags.get(2)
-    lat_ref = gps_tags.get(1)
-    lon = gps_tags.get(4)
-    lon_ref = gps_tags.get(3)
-
-    if lat and lon and lat_ref and lon_ref:
-        lat_dec = _convert_to_degrees(lat)
-        lon_dec = _convert_to_degrees(lon)
-        
-        if lat_dec is not None and lon_dec is not None:
-            if lat_ref != 'N': lat_dec = -lat_dec
-            if lon_ref != 'E': lon_dec = -lon_dec
-            return {"lat": lat_dec, "lng": lon_dec}
-    
-    return None
-
 def get_media_item(db: Session, media_id: int):
-    media = db.query(models.Media).options(joinedload(models.Media.album)).filter(models.Media.id == media_id).first()
+    """Снимок строки из media_cache (без ORM-объекта); после записи в media нужен media_cache.cache.invalidate."""
+    media = media_cache.cache.get(db, media_id)
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
     return media
 
 @router.get("/", response_model=List[schemas.Media])
-def get_media(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+def get_media(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_read_db)):
     return db.query(models.Media).options(joinedload(models.Media.album))\
              .filter(models.Media.is_encrypted == False)\
-             .order_by(models.Media.created_at.desc()).offset(skip).limit(limit).all()
+             .order_by(models.Media.taken_at.desc(), models.Media.id.desc()).offset(skip).limit(limit).all()
 
 @router.get("/vault", response_model=List[schemas.Media])
-def get_vault_media(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+def get_vault_media(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_read_db)):
     if vault_state.get_key() is None:
         raise HTTPException(status_code=403, detail="Vault is locked")
     return db.query(models.Media).options(joinedload(models.Media.album))\
              .filter(models.Media.is_encrypted == True)\
-             .order_by(models.Media.created_at.desc()).offset(skip).limit(limit).all()
+             .order_by(models.Media.taken_at.desc(), models.Media.id.desc()).offset(skip).limit(limit).all()
+
+MAX_PAGE_SIZE = 1000
+
+def _encode_cursor(taken_at: Optional[datetime], media_id: int) -> str:
+    # Пустая дата — курсор внутри хвоста ленты из строк с taken_at = NULL
+    raw = f"{taken_at.isoformat() if taken_at else ''}|{media_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        taken_str, id_str = base64.urlsafe_b64decode(padded).decode().split("|", 1)
+        return (datetime.fromisoformat(taken_str) if taken_str else None), int(id_str)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _keyset_page(db: Session, is_encrypted: bool, cursor: Optional[str], limit: int, filters: dict = None):
+    """Страница ленты по ключу (taken_at, id): цена не зависит от глубины прокрутки.
+    Строки с taken_at = NULL в SQLite при DESC идут последними и сравнение кортежей
+    их не видит, поэтому хвост из них дочитывается отдельным запросом по id."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.query(
+        models.Media.id, models.Media.filename, models.Media.media_type, models.Media.thumbnail_path,
+        models.Media.created_at, models.Media.taken_at, models.Media.is_encrypted, models.Media.album_id
+    )
+    if filters and filters.get("match_ids") is not None:
+        # Совпадений поиска немного: «+ 0» не даёт SQLite пойти по индексу ленты
+        # и проверять каждую строку — он достаёт их по id и сортирует
+        query = query.filter(type_coerce(models.Media.is_encrypted, Integer) + 0 == int(is_encrypted))
+    else:
+        query = query.filter(models.Media.is_encrypted == is_encrypted)
+    if filters:
+        query = search.apply_filters(query, **filters)
+
+    order = (models.Media.taken_at.desc(), models.Media.id.desc())
+    if not cursor:
+        rows = query.order_by(*order).limit(limit + 1).all()
+    else:
+        taken_at, media_id = _decode_cursor(cursor)
+        if taken_at is None:
+            rows = query.filter(models.Media.taken_at == None, models.Media.id < media_id)\
+                        .order_by(*order).limit(limit + 1).all()
+        else:
+            rows = query.filter(tuple_(models.Media.taken_at, models.Media.id) < tuple_(taken_at, media_id))\
+                        .order_by(*order).limit(limit + 1).all()
+            if len(rows) <= limit:
+                rows += query.filter(models.Media.taken_at == None)\
+                             .order_by(*order).limit(limit + 1 - len(rows)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].taken_at, rows[-1].id)
+    return {"items": rows, "next_cursor": next_cursor}
+
+@router.get("/page", response_model=schemas.MediaPage)
+def get_media_page(cursor: Optional[str] = None, limit: int = 200, db: Session = Depends(database.get_read_db)):
+    return _keyset_page(db, False, cursor, limit)
+
+@router.get("/vault/page", response_model=schemas.MediaPage)
+def get_vault_media_page(cursor: Optional[str] = None, limit: int = 200, db: Session = Depends(database.get_read_db)):
+    if vault_state.get_key() is None:
+        raise HTTPException(status_code=403, detail="Vault is locked")
+    return _keyset_page(db, True, cursor, limit)
+
+@router.get("/timeline", response_model=schemas.Timeline)
+def get_timeline(vault: bool = False, db: Session = Depends(database.get_read_db)):
+    """Количество файлов по дням и месяцам одним агрегирующим запросом (для шкалы прокрутки)."""
+    if vault and vault_state.get_key() is None:
+        raise HTTPException(status_code=403, detail="Vault is locked")
+
+    day = func.strftime("%Y-%m-%d", models.Media.taken_at)
+    rows = db.query(day.label("day"), func.count(models.Media.id))\
+             .filter(models.Media.is_encrypted == vault, models.Media.taken_at != None)\
+             .group_by(day).order_by(day.desc()).all()
+
+    months = {}
+    for day_str, count in rows:
+        months[day_str[:7]] = months.get(day_str[:7], 0) + count
+
+    return {
+        "total": sum(count for _, count in rows),
+        "days": [{"period": day_str, "count": count} for day_str, count in rows],
+        "months": [{"period": month, "count": count} for month, count in months.items()],
+    }
+
+@router.get("/search", response_model=schemas.SearchResult)
+def search_media(q: Optional[str] = None,
+                 media_type: Optional[str] = None,
+                 date_from: Optional[datetime] = None,
+                 date_to: Optional[datetime] = None,
+                 album_id: Optional[int] = None,
+                 camera: Optional[str] = None,
+                 has_gps: Optional[bool] = None,
+                 facets: bool = False,
+                 vault: bool = False,
+                 cursor: Optional[str] = None,
+                 limit: int = 200,
+                 db: Session = Depends(database.get_read_db)):
+    """Поиск по имени, альбому и EXIF (FTS5) с фильтрами; порядок и курсор — как у /page."""
+    if vault and vault_state.get_key() is None:
+        raise HTTPException(status_code=403, detail="Vault is locked")
+    if media_type is not None and media_type not in search.MEDIA_TYPE_PREFIXES:
+        raise HTTPException(status_code=400, detail="Invalid media_type")
+
+    match = search.build_match(q)
+    filters = {
+        "match": match, "match_ids": search.selective_ids(db, match), "media_type": media_type, "date_from": date_from,
+        "date_to": date_to, "album_id": album_id, "camera": camera, "has_gps": has_gps,
+    }
+    page = _keyset_page(db, vault, cursor, limit, filters)
+    if facets:
+        page["facets"] = search.facet_counts(db, vault, **filters)
+    return page
+
+@router.post("/search/reindex")
+def reindex_search(background_tasks: BackgroundTasks):
+    background_tasks.add_task(_run_search_reindex)
+    return {"status": "reindex_started"}
+
+def _run_search_reindex():
+    db = database.SessionLocal()
+    try:
+        search.rebuild_index(db)
+    finally:
+        db.close()
+
+# Предел multi-index hashing в duplicates: дальше поиск перестаёт быть быстрым на 100k+
+MAX_DUPLICATE_DISTANCE = duplicates.MAX_DISTANCE
+
+@router.get("/duplicates", response_model=schemas.DuplicateReport)
+async def find_duplicates(distance: int = 4, db: Session = Depends(database.get_read_db)):
+    if distance < 0 or distance > MAX_DUPLICATE_DISTANCE:
+        raise HTTPException(status_code=400, detail="Invalid distance")
+    return await workers.pool.run(_find_duplicates, distance, db)
+
+def _find_duplicates(distance: int, db: Session):
+    ids, hashes = duplicates.load_hashes(db)
+    clusters = duplicates.find_clusters(ids, hashes, distance)
+
+    cluster_ids = [mid for cluster in clusters for mid in cluster]
+    rows = {}
+    for i in range(0, len(cluster_ids), 500):
+        chunk = cluster_ids[i:i + 500]
+        rows.update((row.id, row) for row in db.query(
+            models.Media.id, models.Media.filename, models.Media.media_type, models.Media.thumbnail_path,
+            models.Media.created_at, models.Media.taken_at, models.Media.is_encrypted, models.Media.album_id
+        ).filter(models.Media.id.in_(chunk)))
+
+    return {
+        "distance": distance,
+        "scanned": len(ids),
+        "clusters": [{"ids": cluster, "items": [rows[mid] for mid in cluster if mid in rows]} for cluster in clusters],
+    }
+
+@router.post("/duplicates/backfill")
+def backfill_duplicate_hashes(background_tasks: BackgroundTasks):
+    background_tasks.add_task(_run_phash_backfill)
+    return {"status": "backfill_started"}
+
+def _run_phash_backfill():
+    db = database.SessionLocal()
+    try:
+        duplicates.backfill_phashes(db)
+    finally:
+        db.close()
 
 @router.post("/upload")
 def upload_files(files: List[UploadFile] = File(...), db: Session = Depends(database.get_db)):
-    settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
     count = 0
     new_ids = []
+    duplicate_ids = []
     
     for file in files:
+        temp_path = None
         try:
-            file_path = settings.UPLOAD_DIR / file.filename
-            if file_path.exists():
-                name = file_path.stem
-                ext = file_path.suffix
-                file_path = settings.UPLOAD_DIR / f"{name}_{int(time.time())}{ext}"
-
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if not mime_type: mime_type = "application/octet-stream"
-            
-            ext = file_path.suffix.lower()
-            if ext in ['.heic', '.heif']: mime_type = "image/heic"
-            if ext in ['.cr2', '.nef', '.dng']: mime_type = f"image/x-{ext.lstrip('.')}"
-
-            stat = os.stat(file_path)
-            new_media = models.Media(
-                filename=file_path.name,
-                original_path=file_path.name,
-                media_type=mime_type,
-                file_size=stat.st_size,
-                is_encrypted=False
-            )
-            db.add(new_media)
-            db.flush()
-            new_ids.append(new_media.id)
-            count += 1
-        except Exception:
+            temp_path, content_hash, _ = ingest.stream_to_staging(file.file)
+            media, is_duplicate = ingest.ingest_file(db, temp_path, file.filename, content_hash)
+            ingest.commit_ingest(db, media, is_duplicate)
+        except Exception as e:
+            db.rollback()
+            if temp_path and temp_path.exists(): os.unlink(temp_path)
+            print(f"Upload error for {file.filename}: {e}")
             continue
-    db.commit()
-    return {"status": "success", "count": count, "ids": new_ids}
+
+        new_ids.append(media.id)
+        if is_duplicate:
+            duplicate_ids.append(media.id)
+        else:
+            count += 1
+    if new_ids:
+        media_cache.cache.invalidate(new_ids)
+    return {"status": "success", "count": count, "ids": new_ids, "duplicates": duplicate_ids}
 
 @router.post("/scan")
-def trigger_scan(background_tasks: BackgroundTasks, db: Session = Depends(database.get_db)):
-    background_tasks.add_task(scanner.scan_storage, db)
-    return {"status": "scanning_started"}
+def trigger_scan(mode: str = "incremental", db: Session = Depends(database.get_db)):
+    if mode not in ("incremental", "sequential", "parallel"):
+        raise HTTPException(status_code=400, detail="Unknown scan mode")
+    # Скан идёт задачей: у неё своя сессия БД и прогресс в /api/jobs/{id}
+    job = jobs_router.submit_job(db, "scan", params={"mode": mode})
+    return {"status": "scanning_started", "mode": mode, "job_id": job["id"]}
 
 @router.get("/{media_id}/details")
-def get_media_details(media_id: int, db: Session = Depends(database.get_db)):
-    media = db.query(models.Media).filter(models.Media.id == media_id).first()
+async def get_media_details(media_id: int, db: Session = Depends(database.get_db)):
+    return await workers.pool.run(_media_details, media_id, db)
+
+def _media_details(media_id: int, db: Session):
+    media = db.query(models.Media).options(joinedload(models.Media.media_meta))\
+              .filter(models.Media.id == media_id).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
     key = vault_state.get_key()
-    
-    if media.is_encrypted:
-        if key is None: raise HTTPException(status_code=403, detail="Vault locked")
-        file_path = settings.VAULT_DIR / Path(media.original_path).name
-    else:
-        file_path = settings.UPLOAD_DIR / media.original_path
-
-    if not file_path.exists():
-        return {"error": "File not found on disk"}
-
-    stat = file_path.stat()
-    real_timestamp = stat.st_mtime
-
-    details = {
-        "filename": media.filename,
-        "size": stat.st_size,
-        "mime": media.media_type,
-        "width": 0,
-        "height": 0,
-        "exif": {}
-    }
-
-    temp_path = None
-    target_path = file_path
-
+    if media.is_encrypted and key is None:
+        raise HTTPException(status_code=403, detail="Vault locked")
+
+    meta = media.media_meta
+    if meta is None:
+        # Строки ещё нет (файл до появления индекса): извлекаем один раз и сохраняем
+        data = metadata.extract_for_media(media, key)
+        if data is None:
+            return {"error": "File not found on disk"}
+        meta = metadata.store_metadata(db, media.id, data)
+        if data.get("taken_at"):
+            media.taken_at = data["taken_at"]
+        db.commit()
+        media_cache.cache.invalidate([media.id])
+
+    return metadata.build_details(media, meta)
+
+@router.post("/metadata/backfill")
+def backfill_metadata(background_tasks: BackgroundTasks):
+    background_tasks.add_task(_run_metadata_backfill, vault_state.get_key())
+    return {"status": "backfill_started"}
+
+def _run_metadata_backfill(key: Optional[bytes]):
+    db = database.SessionLocal()
     try:
-        if media.is_encrypted:
-            fd, temp_name = tempfile.mkstemp()
-            os.close(fd)
-            temp_path = Path(temp_name)
-            crypto_utils.decrypt_file_to_disk(file_path, temp_path, key)
-            target_path = temp_path
-
-        if media.media_type.startswith("image/"):
-            try:
-                with Image.open(target_path) as img:
-                    details["width"] = img.width
-                    details["height"] = img.height
-                    
-                    exif_raw = img._getexif()
-                    if exif_raw:
-                        date_str = exif_raw.get(36867) or exif_raw.get(306)
-                        if date_str:
-                            try:
-                                dt = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-                                real_timestamp = dt.timestamp()
-                            except ValueError: pass
-
-                        interesting_tags = {
-                            'Make': 'make',
-                            'Model': 'model',
-                            'ISOSpeedRatings': 'iso',
-                            'ExposureTime': 'exposure',
-                            'FNumber': 'f_number',
-                            'FocalLength': 'focal_length',
-                            'LensModel': 'lens',
-                            'Software': 'software'
-                        }
-
-                        for tag_id, value in exif_raw.items():
-                            tag_name = ExifTags.TAGS.get(tag_id)
-                            if tag_name in interesting_tags:
-                                if isinstance(value, str):
-                                    value = value.replace('\x00', '').strip()
-                                details["exif"][interesting_tags[tag_name]] = str(value)
-                            
-                            if tag_name == 'GPSInfo':
-                                gps_data = _get_gps_info({ 'GPSInfo': value })
-                                if gps_data:
-                                    details["exif"]["gps"] = gps_data
-
-            except Exception:
-                pass
-
+        metadata.backfill_metadata(db, key)
     finally:
-        if temp_path and temp_path.exists():
-            os.unlink(temp_path)
+        db.close()
+
+def _vault_range_response(request: Request, file_path: Path, key: bytes, media_type: str):
+    """Отдаёт файл сейфа с поддержкой Range: расшифровываются только затронутые блоки.
+    Блоки читаются и расшифровываются в пуле media-worker, а не в пуле потоков Starlette."""
+    size = crypto_utils.get_plain_size(file_path)
+    byte_range = http_cache.parse_range(request.headers.get("range"), size)
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": http_cache.NO_STORE}
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(workers.pool.stream(crypto_utils.decrypt_file_generator(file_path, key)),
+                                 media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(workers.pool.stream(crypto_utils.decrypt_file_generator(file_path, key, start, end)),
+                             status_code=206, media_type=media_type, headers=headers)
+
+def _migrate_vault_files(key: bytes):
+    # id владельца пишется в заголовок v3: по нему bulk узнаёт свой файл после сбоя
+    db = database.SessionLocal()
+    try:
+        owners = {Path(row.original_path).name: row.id for row in
+                  db.query(models.Media.id, models.Media.original_path).filter(models.Media.is_encrypted == True)}
+    finally:
+        db.close()
 
-    details["created"] = real_timestamp
-    return details
+    migrated = 0
+    for path in settings.VAULT_DIR.iterdir():
+        if not path.is_file() or path.name.startswith('.'):
+            continue
+        try:
+            if crypto_utils.migrate_legacy_file(path, key, owners.get(path.name, 0)):
+                migrated += 1
+        except Exception as e:
+            print(f"--- [Vault] Ошибка миграции {path.name}: {e}")
+    print(f"--- [Vault] Переведено в формат v3: {migrated}")
+
+@router.post("/vault/migrate")
+def migrate_vault(background_tasks: BackgroundTasks):
+    key = vault_state.get_key()
+    if key is None: raise HTTPException(status_code=403, detail="Vault locked")
+    background_tasks.add_task(_migrate_vault_files, key)
+    return {"status": "migration_started"}
 
 @router.get("/{media_id}/content")
-def get_media_content(media_id: int, db: Session = Depends(database.get_db)):
+async def get_media_content(media_id: int, request: Request, size: Optional[str] = None, format: str = "jpeg",
+                            v: Optional[str] = None, db: Session = Depends(database.get_db)):
+    return await workers.pool.run(_media_content, media_id, request, size, format, v, db)
+
+def _media_content(media_id: int, request: Request, size: Optional[str], format: str, v: Optional[str], db: Session):
+    if size is not None and size not in settings.RENDITION_SIZES:
+        raise HTTPException(status_code=400, detail="Unknown size")
+    if format not in renditions.available_formats():
+        raise HTTPException(status_code=400, detail="Unsupported format")
+
     media = get_media_item(db, media_id)
     key = vault_state.get_key()
 
@@ -220,28 +349,62 @@ def get_media_content(media_id: int, db: Session = Depends(database.get_db)):
     WEB_NATIVE = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/svg+xml'}
     needs_conversion = media.media_type.startswith('image/') and media.media_type not in WEB_NATIVE
     
-    if needs_conversion:
-        if media.is_encrypted:
-            try:
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    temp_path = Path(tmp.name)
-                crypto_utils.decrypt_file_to_disk(file_path, temp_path, key)
-                jpeg_bytes = thumbnail.convert_image_to_jpeg_bytes(temp_path)
-                if temp_path.exists(): os.unlink(temp_path)
-                if jpeg_bytes: return StreamingResponse(io.BytesIO(jpeg_bytes), media_type="image/jpeg")
-            except Exception:
-                if 'temp_path' in locals() and temp_path.exists(): os.unlink(temp_path)
-        else:
-            jpeg_bytes = thumbnail.convert_image_to_jpeg_bytes(file_path)
-            if jpeg_bytes: return StreamingResponse(io.BytesIO(jpeg_bytes), media_type="image/jpeg")
+    if needs_conversion and media.is_encrypted:
+        try:
+            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                temp_path = Path(tmp.name)
+            crypto_utils.decrypt_file_to_disk(file_path, temp_path, key)
+            jpeg_bytes = thumbnail.convert_image_to_jpeg_bytes(temp_path)
+            if temp_path.exists(): os.unlink(temp_path)
+            if jpeg_bytes: return http_cache.private_response(jpeg_bytes, "image/jpeg")
+        except Exception:
+            if 'temp_path' in locals() and temp_path.exists(): os.unlink(temp_path)
+
+    # Незашифрованные изображения: конвертация и уменьшение один раз, дальше из кэша
+    if media.media_type.startswith('image/') and not media.is_encrypted and (needs_conversion or size):
+        try:
+            rendition_path, rendition_mime = renditions.cache.get_or_create(media.id, file_path, size or "original", format)
+        except Exception as e:
+            print(f"Rendition error for {media.id}: {e}")
+            rendition_path = None
+        # ETag рендишена — отпечаток исходника (он же в имени файла кэша), поэтому ?v= одинаков для всех размеров
+        if rendition_path: return http_cache.file_response(request, rendition_path, rendition_mime, v, etag_source=file_path)
 
     if media.is_encrypted:
-        return StreamingResponse(crypto_utils.decrypt_file_generator(file_path, key), media_type=media.media_type)
+        return _vault_range_response(request, file_path, key, media.media_type)
     else:
-        return FileResponse(file_path, media_type=media.media_type)
+        return http_cache.file_response(request, file_path, media.media_type, v, ranges=True)
+
+@router.get("/thumbnails/batch")
+async def get_thumbnail_batch(ids: str, request: Request, db: Session = Depends(database.get_db)):
+    """Превью для сетки одним ответом: ids=1,2,3. Формат упаковки — в services/thumb_batch.py."""
+    return await workers.pool.run(_thumbnail_batch, ids, request, db)
+
+def _thumbnail_batch(ids: str, request: Request, db: Session):
+    try:
+        media_ids = thumb_batch.parse_ids(ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = vault_state.get_key()
+    rows, paths, pending = thumb_batch.locate(db, media_ids, key)
+    etag = thumb_batch.etag(media_ids, rows, paths, pending)
+    if etag is None:
+        headers = {"Cache-Control": http_cache.NO_STORE}
+    else:
+        headers = {"ETag": etag, "Cache-Control": http_cache.REVALIDATE}
+        if http_cache.is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    results = thumb_batch.collect(media_ids, rows, paths, pending, key)
+    return Response(content=thumb_batch.pack(results), media_type=thumb_batch.MEDIA_TYPE, headers=headers)
 
 @router.get("/{media_id}/thumbnail")
-def get_media_thumbnail(media_id: int, db: Session = Depends(database.get_db)):
+async def get_media_thumbnail(media_id: int, request: Request, v: Optional[str] = None,
+                              db: Session = Depends(database.get_db)):
+    return await workers.pool.run(_media_thumbnail, media_id, request, v, db)
+
+def _media_thumbnail(media_id: int, request: Request, v: Optional[str], db: Session):
     media = get_media_item(db, media_id)
     
     if media.is_encrypted:
@@ -252,99 +415,98 @@ def get_media_thumbnail(media_id: int, db: Session = Depends(database.get_db)):
         if not vault_path.exists(): raise HTTPException(status_code=404)
 
         try:
-            with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                temp_path = Path(tmp.name)
-            crypto_utils.decrypt_file_to_disk(vault_path, temp_path, key)
-            thumb_bytes = thumbnail.generate_memory_thumbnail(temp_path, media.media_type)
-            if temp_path.exists(): os.unlink(temp_path)
-            if thumb_bytes: return StreamingResponse(io.BytesIO(thumb_bytes), media_type="image/jpeg")
-            else: raise HTTPException(status_code=404)
+            thumb_bytes = vault_thumbs.store.get_or_create(media.id, vault_path, media.media_type, key)
         except Exception:
-            if 'temp_path' in locals() and temp_path.exists(): os.unlink(temp_path)
             raise HTTPException(status_code=500)
+        if not thumb_bytes: raise HTTPException(status_code=404)
+        return http_cache.private_response(thumb_bytes, "image/jpeg")
 
     thumb_path_str = media.thumbnail_path or f"thumb_{media.id}.jpg"
     thumb_path = settings.THUMBNAIL_DIR / thumb_path_str
     
     if not thumb_path.exists():
-        new_name = thumbnail.generate_thumbnail(media)
-        if new_name: return FileResponse(settings.THUMBNAIL_DIR / new_name, media_type="image/jpeg")
+        new_name, phash = thumbnail.generate_thumbnail_with_hash(media)
+        if not new_name: raise HTTPException(status_code=404)
+        db.query(models.Media).filter(models.Media.id == media.id)\
+          .update({models.Media.thumbnail_path: new_name, models.Media.phash: phash}, synchronize_session=False)
+        db.commit()
+        media_cache.cache.invalidate([media.id], orderings=False)
+        return http_cache.file_response(request, settings.THUMBNAIL_DIR / new_name, "image/jpeg", v)
+    return http_cache.file_response(request, thumb_path, "image/jpeg", v)
+
+@router.get("/{media_id}/neighbors")
+def get_media_neighbors(media_id: int, album_id: Optional[int] = None, db: Session = Depends(database.get_read_db)):
+    """Соседи для просмотрщика в порядке ленты (prev — новее, next — старше); из кэша, без SQL."""
+    media = get_media_item(db, media_id)
+    if media.is_encrypted and vault_state.get_key() is None:
+        raise HTTPException(status_code=403, detail="Vault locked")
+    prev_id, next_id = media_cache.cache.neighbors(db, media, album_id)
+    return {"id": media.id, "prev": prev_id, "next": next_id}
+
+@router.get("/{media_id}/preview")
+async def get_video_preview(media_id: int, request: Request, v: Optional[str] = None,
+                            db: Session = Depends(database.get_read_db)):
+    return await workers.pool.run(_video_preview, media_id, request, v, db)
+
+def _video_preview(media_id: int, request: Request, v: Optional[str], db: Session):
+    """Анимированное WebP-превью видео; в сейфе не создаётся, чтобы не оставлять открытых кадров."""
+    media = get_media_item(db, media_id)
+    if not settings.VIDEO_PREVIEW_ENABLED or media.is_encrypted:
         raise HTTPException(status_code=404)
-    return FileResponse(thumb_path, media_type="image/jpeg")
+    if not (media.media_type and media.media_type.startswith("video/")):
+        raise HTTPException(status_code=404)
+
+    source = settings.UPLOAD_DIR / media.original_path
+    if not source.exists(): raise HTTPException(status_code=404)
+    path = video.generate_preview(media.id, source)
+    if path is None: raise HTTPException(status_code=404)
+    return http_cache.file_response(request, path, "image/webp", v)
 
 @router.post("/bulk/encrypt")
-def bulk_encrypt(ids: List[int], db: Session = Depends(database.get_db)):
+def bulk_encrypt(ids: List[int], background: bool = False, db: Session = Depends(database.get_db)):
     key = vault_state.get_key()
     if key is None: raise HTTPException(status_code=403)
-    count = 0
-    for mid in ids:
-        media = db.query(models.Media).filter(models.Media.id == mid).first()
-        if media and not media.is_encrypted:
-            source = settings.UPLOAD_DIR / media.original_path
-            dest = settings.VAULT_DIR / source.name
-            if source.exists():
-                try:
-                    crypto_utils.encrypt_file(source, dest, key)
-                    if dest.exists() and dest.stat().st_size > 0:
-                        os.remove(source)
-                        if media.thumbnail_path:
-                            thumb = settings.THUMBNAIL_DIR / media.thumbnail_path
-                            if thumb.exists(): os.remove(thumb)
-                        media.is_encrypted = True
-                        media.original_path = source.name
-                        count += 1
-                    else:
-                        if dest.exists(): os.remove(dest)
-                except Exception:
-                    if dest.exists(): os.remove(dest)
-    db.commit()
-    return {"status": "encrypted", "count": count}
+    if background:
+        return jobs_router.submit_job(db, "encrypt", ids)
+    results = bulk.encrypt(db, ids, key)
+    media_cache.cache.invalidate(ids)
+    return {"status": "encrypted", "count": bulk.summarize(results), "results": results}
 
 @router.post("/bulk/decrypt")
-def bulk_decrypt(ids: List[int], db: Session = Depends(database.get_db)):
+def bulk_decrypt(ids: List[int], background: bool = False, db: Session = Depends(database.get_db)):
     key = vault_state.get_key()
     if key is None: raise HTTPException(status_code=403)
-    count = 0
-    for mid in ids:
-        media = db.query(models.Media).filter(models.Media.id == mid).first()
-        if media and media.is_encrypted:
-            source = settings.VAULT_DIR / Path(media.original_path).name
-            dest = settings.UPLOAD_DIR / source.name
-            if source.exists():
-                try:
-                    crypto_utils.decrypt_file_to_disk(source, dest, key)
-                    if dest.exists() and dest.stat().st_size > 0:
-                        os.remove(source)
-                        media.is_encrypted = False
-                        media.original_path = source.name
-                        count += 1
-                    else:
-                        if dest.exists(): os.remove(dest)
-                except Exception:
-                    if dest.exists(): os.remove(dest)
-    db.commit()
-    return {"status": "decrypted", "count": count}
+    if background:
+        return jobs_router.submit_job(db, "decrypt", ids)
+    results = bulk.decrypt(db, ids, key)
+    media_cache.cache.invalidate(ids)
+    return {"status": "decrypted", "count": bulk.summarize(results), "results": results}
 
 @router.post("/bulk/delete")
-def bulk_delete(ids: List[int], db: Session = Depends(database.get_db)):
-    for mid in ids:
-        media = db.query(models.Media).filter(models.Media.id == mid).first()
-        if media:
-            try:
-                path = (settings.VAULT_DIR / Path(media.original_path).name) if media.is_encrypted else (settings.UPLOAD_DIR / media.original_path)
-                if path.exists(): os.remove(path)
-                if media.thumbnail_path:
-                    thumb = settings.THUMBNAIL_DIR / media.thumbnail_path
-                    if thumb.exists(): os.remove(thumb)
-            except Exception: pass
-            db.delete(media)
-    db.commit()
-    return {"status": "deleted"}
+def bulk_delete(ids: List[int], background: bool = False, db: Session = Depends(database.get_db)):
+    if background:
+        return jobs_router.submit_job(db, "delete", ids)
+    results = bulk.delete(db, ids)
+    media_cache.cache.invalidate(ids)
+    return {"status": "deleted", "count": bulk.summarize(results), "results": results}
+
+@router.post("/bulk/thumbnails")
+def bulk_thumbnails(ids: List[int], force: bool = False, background: bool = False, db: Session = Depends(database.get_db)):
+    if background:
+        return jobs_router.submit_job(db, "rethumb", ids, {"force": force})
+    rendered = scanner.render_thumbnails(db, ids, force=force)
+    media_cache.cache.invalidate(ids, orderings=False)
+    items = [{"id": mid, "thumbnail_path": rendered.get(mid)} for mid in ids if mid in rendered]
+    return {
+        "status": "rendered",
+        "count": sum(1 for item in items if item["thumbnail_path"]),
+        "items": items,
+    }
 
 @router.put("/bulk/album/{album_id}")
 def set_album_for_media(album_id: int, ids: List[int], db: Session = Depends(database.get_db)):
-    for mid in ids:
-        media = db.query(models.Media).filter(models.Media.id == mid).first()
-        if media: media.album_id = album_id
-    db.commit()
-    return {"status": "updated"}
\ No newline at end of file
+    if not db.query(models.Album.id).filter(models.Album.id == album_id).first():
+        raise HTTPException(status_code=404, detail="Album not found")
+    results = bulk.set_album(db, ids, album_id)
+    media_cache.cache.invalidate(ids)
+    return {"status": "updated", "count": bulk.summarize(results), "results": results}
\ No newline at end of file
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
 from sqlalchemy.orm import Session
-from ..database import database, models
-from ..services import updater
+from ..database import database, models, migrations
+from ..services import updater, workers, media_cache
 from ..config import settings
 import threading
 import time
@@ -15,8 +15,23 @@ router = APIRouter(prefix="/api/system", tags=["system"])
 def get_version():
     return {"version": settings.VERSION}
 
+@router.get("/workers")
+def get_worker_metrics():
+    return workers.pool.metrics()
+
+@router.get("/cache")
+def get_cache_metrics():
+    return media_cache.cache.metrics()
+
+@router.get("/migrations")
+def get_migrations(db: Session = Depends(database.get_read_db)):
+    return [
+        {"version": row.version, "name": row.name, "applied_at": row.applied_at, "duration_ms": row.duration_ms}
+        for row in migrations.history(db)
+    ]
+
 @router.get("/stats")
-def get_system_stats(db: Session = Depends(database.get_db)):
+def get_system_stats(db: Session = Depends(database.get_read_db)):
     try:
         total, used, free = shutil.disk_usage(settings.DATA_DIR)
     except:
@@ -0,0 +1,151 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from datetime import datetime
+import os
+import json
+import uuid
+import threading
+from ..database import database, models
+from .. import schemas
+from ..services import ingest, media_cache, workers
+from ..config import settings
+
+router = APIRouter(prefix="/api/uploads", tags=["uploads"])
+
+# Куски одной загрузки могут приходить параллельно — учёт диапазонов под блокировкой
+ranges_lock = threading.Lock()
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+def _staging_file(upload_id: str):
+    return settings.UPLOAD_STAGING_DIR / f"{upload_id}.part"
+
+def _merge_ranges(ranges, start: int, end: int):
+    merged = []
+    for r_start, r_end in sorted(ranges + [[start, end]]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return merged
+
+def _contiguous_offset(ranges) -> int:
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+def _get_session(db: Session, upload_id: str):
+    session = db.query(models.UploadSession).filter(models.UploadSession.id == upload_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def _status(session: models.UploadSession):
+    ranges = json.loads(session.received_ranges or "[]")
+    return {
+        "id": session.id,
+        "filename": session.filename,
+        "size": session.total_size,
+        "offset": _contiguous_offset(ranges),
+        "received_bytes": session.received_bytes,
+        "received_ranges": ranges,
+        "chunk_size": settings.UPLOAD_CHUNK_SIZE,
+    }
+
+@router.post("/", response_model=schemas.UploadSessionStatus)
+def create_upload(data: schemas.UploadSessionCreate, db: Session = Depends(database.get_db)):
+    if data.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid size")
+
+    settings.UPLOAD_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    session = models.UploadSession(id=uuid.uuid4().hex, filename=os.path.basename(data.filename), total_size=data.size)
+
+    # Файл сразу нужного размера: куски пишутся прямо по своим смещениям
+    with open(_staging_file(session.id), "wb") as f_out:
+        f_out.truncate(data.size)
+
+    db.add(session)
+    db.commit()
+    return _status(session)
+
+@router.get("/{upload_id}", response_model=schemas.UploadSessionStatus)
+def get_upload(upload_id: str, response: Response, db: Session = Depends(database.get_read_db)):
+    session = _get_session(db, upload_id)
+    status = _status(session)
+    response.headers["Upload-Offset"] = str(status["offset"])
+    return status
+
+@router.patch("/{upload_id}", response_model=schemas.UploadSessionStatus)
+async def upload_chunk(upload_id: str, request: Request, db: Session = Depends(database.get_db)):
+    session = await run_in_threadpool(_get_session, db, upload_id)
+    try:
+        offset = int(request.headers.get("upload-offset", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset header required")
+    if offset < 0 or offset > session.total_size:
+        raise HTTPException(status_code=400, detail="Invalid offset")
+
+    path = _staging_file(upload_id)
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Staging file lost")
+
+    f_out = await run_in_threadpool(open, path, "r+b")
+    written = 0
+    try:
+        await run_in_threadpool(f_out.seek, offset)
+        buffer = bytearray()
+        async for piece in request.stream():
+            if offset + written + len(buffer) + len(piece) > session.total_size:
+                raise HTTPException(status_code=400, detail="Chunk exceeds declared size")
+            buffer.extend(piece)
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await run_in_threadpool(f_out.write, bytes(buffer))
+                written += len(buffer)
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(f_out.write, bytes(buffer))
+            written += len(buffer)
+    finally:
+        await run_in_threadpool(f_out.close)
+
+    return await run_in_threadpool(_record_chunk, db, upload_id, offset, written)
+
+def _record_chunk(db: Session, upload_id: str, offset: int, length: int):
+    with ranges_lock:
+        session = _get_session(db, upload_id)
+        db.refresh(session)
+        if length:
+            ranges = _merge_ranges(json.loads(session.received_ranges or "[]"), offset, offset + length)
+            session.received_ranges = json.dumps(ranges)
+            session.received_bytes = sum(end - start for start, end in ranges)
+            session.updated_at = datetime.utcnow()
+            db.commit()
+        return _status(session)
+
+@router.post("/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, db: Session = Depends(database.get_db)):
+    """Хэш, EXIF и превью — в пуле медиа-воркеров: при переполнении 503 с Retry-After."""
+    return await workers.pool.run(_finalize_upload, upload_id, db)
+
+def _finalize_upload(upload_id: str, db: Session):
+    session = _get_session(db, upload_id)
+    if session.received_bytes != session.total_size:
+        raise HTTPException(status_code=409, detail="Upload is incomplete")
+
+    path = _staging_file(upload_id)
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Staging file lost")
+
+    content_hash = ingest.hash_file(path)
+    media, is_duplicate = ingest.ingest_file(db, path, session.filename, content_hash, with_thumbnail=True)
+    db.delete(session)
+    ingest.commit_ingest(db, media, is_duplicate)
+    media_cache.cache.invalidate([media.id])
+    return {"status": "success", "id": media.id, "duplicate": is_duplicate}
+
+@router.delete("/{upload_id}")
+def abort_upload(upload_id: str, db: Session = Depends(database.get_db)):
+    session = _get_session(db, upload_id)
+    path = _staging_file(upload_id)
+    if path.exists(): os.unlink(path)
+    db.delete(session)
+    db.commit()
+    return {"status": "aborted"}
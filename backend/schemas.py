@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 
 class MediaBase(BaseModel):
     filename: str
@@ -22,13 +22,59 @@ class Media(MediaBase):
     original_path: Optional[str]
     thumbnail_path: Optional[str]
     created_at: datetime
+    taken_at: Optional[datetime] = None
     is_encrypted: bool
     album_id: Optional[int]
+    is_missing: Optional[bool] = False
     album: Optional[AlbumRef] = None
 
     class Config:
         from_attributes = True
 
+class MediaListItem(MediaBase):
+    """Облегчённая запись для ленты: без связи с альбомом."""
+    id: int
+    thumbnail_path: Optional[str]
+    created_at: datetime
+    # NULL, пока фоновая миграция не заполнила дату у старых строк
+    taken_at: Optional[datetime]
+    is_encrypted: bool
+    album_id: Optional[int]
+
+    class Config:
+        from_attributes = True
+
+class MediaPage(BaseModel):
+    items: List[MediaListItem]
+    next_cursor: Optional[str] = None
+
+class SearchFacets(BaseModel):
+    media_type: Dict[str, int]
+    albums: Dict[int, int]
+    cameras: Dict[str, int]
+    has_gps: int
+
+class SearchResult(MediaPage):
+    facets: Optional[SearchFacets] = None
+
+class DuplicateCluster(BaseModel):
+    ids: List[int]
+    items: List[MediaListItem]
+
+class DuplicateReport(BaseModel):
+    distance: int
+    scanned: int
+    clusters: List[DuplicateCluster]
+
+class TimelineBucket(BaseModel):
+    period: str
+    count: int
+
+class Timeline(BaseModel):
+    total: int
+    days: List[TimelineBucket]
+    months: List[TimelineBucket]
+
 class AlbumSummary(AlbumBase):
     id: int
     created_at: datetime
@@ -52,6 +98,24 @@ class MediaCreate(MediaBase):
     original_path: str
     file_size: int
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+
+class UploadSessionStatus(BaseModel):
+    id: str
+    filename: str
+    size: int
+    offset: int
+    received_bytes: int
+    received_ranges: List[List[int]]
+    chunk_size: int
+
+class JobCreate(BaseModel):
+    kind: str
+    ids: Optional[List[int]] = None
+    params: Optional[Dict[str, Any]] = None
+
 class SetupRequest(BaseModel):
     master_password: str
     pin: str
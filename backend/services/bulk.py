@@ -0,0 +1,239 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import models
+from .. import crypto_utils
+from . import vault_thumbs, renditions, video, scanner
+
+# Не больше стольких параметров в одном IN (старые сборки SQLite ограничены 999)
+IN_BATCH_SIZE = 900
+
+def chunked(items, size: int = IN_BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def load_rows(db: Session, ids, *columns):
+    """Строки media по списку id пачками IN: {id: row}. Без ORM-объектов — только нужные колонки."""
+    columns = columns or (models.Media.id, models.Media.original_path, models.Media.thumbnail_path,
+                          models.Media.is_encrypted)
+    rows = {}
+    for chunk in chunked(list(dict.fromkeys(ids))):
+        for row in db.query(*columns).filter(models.Media.id.in_(chunk)):
+            rows[row.id] = row
+    return rows
+
+def _drop_file_index(db: Session, ids):
+    for chunk in chunked(ids):
+        db.query(models.FileIndex).filter(models.FileIndex.media_id.in_(chunk)).delete(synchronize_session=False)
+
+def _result(media_id: int, status: str, error: str = None):
+    result = {"id": media_id, "status": status}
+    if error:
+        result["error"] = error
+    return result
+
+def _remove(path: Path):
+    if path.exists(): os.remove(path)
+
+def set_album(db: Session, ids, album_id):
+    """Один UPDATE ... WHERE id IN на пачку; album_id=None убирает из альбома."""
+    found = load_rows(db, ids, models.Media.id)
+    for chunk in chunked(list(found)):
+        db.query(models.Media).filter(models.Media.id.in_(chunk))\
+          .update({models.Media.album_id: album_id}, synchronize_session=False)
+    db.commit()
+    return [_result(mid, "ok" if mid in found else "not_found") for mid in ids]
+
+def delete(db: Session, ids):
+    rows = load_rows(db, ids)
+    results = {}
+
+    # Сначала файлы: каждый элемент отдельно, ошибка одного не останавливает остальные
+    for media_id, row in rows.items():
+        try:
+            if row.is_encrypted:
+                _remove(settings.VAULT_DIR / Path(row.original_path).name)
+                vault_thumbs.store.remove(media_id)
+            else:
+                _remove(settings.UPLOAD_DIR / row.original_path)
+            if row.thumbnail_path:
+                _remove(settings.THUMBNAIL_DIR / row.thumbnail_path)
+            renditions.cache.remove_media(media_id)
+            video.remove_preview(media_id)
+            results[media_id] = _result(media_id, "ok")
+        except Exception as e:
+            # Как и раньше, запись удаляется даже если файл убрать не удалось
+            results[media_id] = _result(media_id, "ok", f"file cleanup failed: {e}")
+
+    # Затем база: зависимые строки и сами записи пачками
+    found = list(rows)
+    _drop_file_index(db, found)
+    for chunk in chunked(found):
+        db.query(models.Media).filter(models.Media.id.in_(chunk)).delete(synchronize_session=False)
+        db.query(models.MediaMetadata).filter(models.MediaMetadata.media_id.in_(chunk)).delete(synchronize_session=False)
+    db.commit()
+    return [results.get(mid) or _result(mid, "not_found") for mid in ids]
+
+# Незавершённый перенос между папками: VAULT_DIR/.moves/<id> хранит направление и имя файла назначения.
+# Пишется до начала записи, удаляется после commit. По нему (а не по совпадению имён)
+# повторный запуск узнаёт свой файл, если исходник уже удалён, а строка в базе ещё старая.
+def _marker(media_id: int) -> Path:
+    return settings.VAULT_DIR / ".moves" / str(media_id)
+
+def _read_marker(media_id: int, kind: str):
+    try:
+        marked_kind, _, name = _marker(media_id).read_text().strip().partition(":")
+    except OSError:
+        return None
+    return name if marked_kind == kind and name else None
+
+def _write_marker(media_id: int, kind: str, name: str):
+    path = _marker(media_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(f"{kind}:{name}")
+    os.replace(tmp_path, path)
+
+def _clear_marker(media_id: int):
+    try:
+        os.remove(_marker(media_id))
+    except OSError:
+        pass
+
+def _reserve_name(directory: Path, name: str, media_id: int) -> Path:
+    """Свободное имя в папке (O_EXCL): файл другой записи с тем же именем не перезаписывается."""
+    stem, ext = Path(name).stem, Path(name).suffix
+    candidates = [name, f"{stem}_{media_id}{ext}"]
+    candidates.extend(f"{stem}_{media_id}_{i}{ext}" for i in range(1, 1000))
+    for candidate in candidates:
+        dest = directory / candidate
+        try:
+            fd = os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return dest
+    raise FileExistsError(f"No free name for {name}")
+
+def _owned_vault_file(path: Path, media_id: int) -> bool:
+    try:
+        header = crypto_utils.read_vault_header(path)
+    except OSError:
+        return False
+    return header is not None and header.owner == media_id
+
+def _encrypt_one(media_id: int, row, key: bytes, progress=None):
+    """Шифрует один файл. Возвращает (результат, изменения строки или None)."""
+    if row.is_encrypted:
+        # Перенос уже записан в базу: метка, если осталась, устарела
+        _clear_marker(media_id)
+        return _result(media_id, "skipped"), None
+    source = settings.UPLOAD_DIR / row.original_path
+    pending = _read_marker(media_id, "encrypt")
+
+    if not source.exists():
+        # Прерванный прошлый запуск: исходник удаляется только после полной записи,
+        # а свой файл сейфа узнаём по метке переноса и id владельца в заголовке
+        dest = settings.VAULT_DIR / pending if pending else None
+        if not (dest and dest.exists() and _owned_vault_file(dest, media_id)):
+            return _result(media_id, "error", "source file missing"), None
+    else:
+        if pending and _owned_vault_file(settings.VAULT_DIR / pending, media_id):
+            _remove(settings.VAULT_DIR / pending)
+        dest = None
+        try:
+            dest = _reserve_name(settings.VAULT_DIR, source.name, media_id)
+            _write_marker(media_id, "encrypt", dest.name)
+            crypto_utils.encrypt_file(source, dest, key, progress, owner=media_id)
+            if not (dest.exists() and dest.stat().st_size > 0):
+                _remove(dest)
+                return _result(media_id, "error", "empty output"), None
+            os.remove(source)
+        except Exception as e:
+            if dest is not None: _remove(dest)
+            _clear_marker(media_id)
+            return _result(media_id, "error", str(e)), None
+
+    thumb = settings.THUMBNAIL_DIR / (row.thumbnail_path or f"thumb_{media_id}.jpg")
+    try:
+        if thumb.exists():
+            # Готовое превью переносим в сейф зашифрованным, чтобы не рендерить заново
+            vault_thumbs.store.put(media_id, thumb.read_bytes(), key)
+            os.remove(thumb)
+        renditions.cache.remove_media(media_id)
+        video.remove_preview(media_id)
+    except Exception as e:
+        print(f"--- [Bulk] Не удалось убрать превью {media_id}: {e}")
+
+    return _result(media_id, "ok"), {"id": media_id, "is_encrypted": True, "original_path": dest.name,
+                                     "is_missing": False}
+
+def _decrypt_one(media_id: int, row, key: bytes, progress=None):
+    if not row.is_encrypted:
+        _clear_marker(media_id)
+        return _result(media_id, "skipped"), None
+    source = settings.VAULT_DIR / Path(row.original_path).name
+    pending = _read_marker(media_id, "decrypt")
+
+    if not source.exists():
+        # Файл сейфа удаляется только после полной расшифровки в файл из метки переноса
+        dest = settings.UPLOAD_DIR / pending if pending else None
+        if not (dest and dest.exists()):
+            return _result(media_id, "error", "vault file missing"), None
+    else:
+        if pending:
+            # Недописанный результат прошлого запуска
+            _remove(settings.UPLOAD_DIR / pending)
+        dest = None
+        try:
+            dest = _reserve_name(settings.UPLOAD_DIR, source.name, media_id)
+            _write_marker(media_id, "decrypt", dest.name)
+            crypto_utils.decrypt_file_to_disk(source, dest, key, progress)
+            if not (dest.exists() and dest.stat().st_size > 0):
+                _remove(dest)
+                return _result(media_id, "error", "empty output"), None
+            os.remove(source)
+        except Exception as e:
+            if dest is not None: _remove(dest)
+            _clear_marker(media_id)
+            return _result(media_id, "error", str(e)), None
+
+    vault_thumbs.store.remove(media_id)
+    return _result(media_id, "ok"), {"id": media_id, "is_encrypted": False, "original_path": dest.name,
+                                     "is_missing": False}
+
+def _run_moves(db: Session, ids, key: bytes, handler, workers: int, progress):
+    """Файловая часть — параллельно по элементам, запись в базу — одним executemany.
+    Под блокировкой сканера: иначе наблюдатель между удалением исходника и commit пометит
+    строку пропавшей или заведёт вторую строку на расшифрованный файл."""
+    with scanner.scan_lock:
+        rows = load_rows(db, ids)
+        items = list(rows.items())
+        if workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk-file") as executor:
+                outcomes = list(executor.map(lambda item: handler(item[0], item[1], key, progress), items))
+        else:
+            outcomes = [handler(media_id, row, key, progress) for media_id, row in items]
+
+        updates = [update for _, update in outcomes if update]
+        if updates:
+            db.bulk_update_mappings(models.Media, updates)
+            # Путь сменился: строка индекса сканера устарела
+            _drop_file_index(db, [u["id"] for u in updates])
+        db.commit()
+    for update in updates:
+        _clear_marker(update["id"])
+
+    results = {result["id"]: result for result, _ in outcomes}
+    return [results.get(mid) or _result(mid, "not_found") for mid in ids]
+
+def encrypt(db: Session, ids, key: bytes, workers: int = 1, progress=None):
+    return _run_moves(db, ids, key, _encrypt_one, workers, progress)
+
+def decrypt(db: Session, ids, key: bytes, workers: int = 1, progress=None):
+    return _run_moves(db, ids, key, _decrypt_one, workers, progress)
+
+def summarize(results) -> int:
+    return sum(1 for r in results if r["status"] == "ok")
@@ -0,0 +1,177 @@
+from itertools import combinations
+import numpy as np
+from sqlalchemy.orm import Session
+from ..database import models
+from .thumbnail import phash_from_file
+from ..config import settings
+
+HASH_BITS = 64
+_bitwise_count = getattr(np, "bitwise_count", None)
+# Multi-index hashing: 4 подстроки по 16 бит. На 100k хэшей корзина 16-битного ключа —
+# единицы строк, так что кандидатов мало при любом расстоянии до MAX_DISTANCE
+SEGMENT_BITS = 16
+SEGMENTS = HASH_BITS // SEGMENT_BITS
+# Дальше радиус в подстроке растёт до 3 (697 проб на подстроку) — это уже не «быстро»
+MAX_DISTANCE = 8
+# Кандидатов на одну векторную проверку: ограничивает память на вырожденных корзинах
+PAIR_CHUNK = 1 << 22
+BACKFILL_BATCH_SIZE = 500
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Число единичных бит в каждом uint64 (для numpy < 2.0 — SWAR-арифметикой)."""
+    if _bitwise_count is not None:
+        return _bitwise_count(values)
+    v = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    v = (v & np.uint64(0x3333333333333333)) + ((v >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    v = (v + (v >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((v * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.uint8)
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def _find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            x = parent[x]
+        return x
+
+    def roots(self, x: np.ndarray) -> np.ndarray:
+        parent = self.parent
+        while True:
+            up = parent[x]
+            if np.array_equal(up, x):
+                return x
+            x = up
+
+    def union_pairs(self, left: np.ndarray, right: np.ndarray):
+        """Объединяет пары векторно: в вырожденной группе (тысячи почти одинаковых
+        хэшей) пар квадратично много, и цикл по ним в Python стал бы узким местом."""
+        if not len(left):
+            return
+        left, right = self.roots(left), self.roots(right)
+        keep = left != right
+        if not keep.any():
+            return
+        left, right = left[keep], right[keep]
+        if len(left) <= 64:
+            # Обычный случай — пар немного, цикл дешевле подготовки массивов
+            for a, b in zip(left.tolist(), right.tolist()):
+                ra, rb = self._find(a), self._find(b)
+                if ra != rb:
+                    self.parent[max(ra, rb)] = min(ra, rb)
+            return
+        nodes, inverse = np.unique(np.concatenate([left, right]), return_inverse=True)
+        a, b = inverse[:len(left)], inverse[len(left):]
+        # Минимальная метка по рёбрам плюс перескок по указателям: метка сходится
+        # к наименьшему корню компоненты за несколько проходов
+        label = np.arange(len(nodes))
+        while True:
+            low = np.minimum(label[a], label[b])
+            merged = label.copy()
+            np.minimum.at(merged, a, low)
+            np.minimum.at(merged, b, low)
+            merged = merged[merged]
+            if np.array_equal(merged, label):
+                break
+            label = merged
+        self.parent[nodes] = nodes[label]
+
+def _probe_masks(radius: int) -> np.ndarray:
+    """Все 16-битные маски с не более чем radius единицами."""
+    masks = [0]
+    for count in range(1, radius + 1):
+        masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(SEGMENT_BITS), count))
+    return np.array(masks, dtype=np.int64)
+
+def _candidates(order: np.ndarray, bucket_starts: np.ndarray, probes: np.ndarray):
+    """Пары (i, j), где ключ j равен пробе i. Корзины ключей — прямой таблицей на 2^16
+    элементов вместо бинарного поиска. Отдаёт кусками не больше PAIR_CHUNK пар."""
+    left = bucket_starts[probes]
+    counts = bucket_starts[probes + 1] - left
+    ends = np.cumsum(counts)
+    total = int(ends[-1]) if len(ends) else 0
+    start = 0
+    while start < len(probes) and total:
+        done = int(ends[start - 1]) if start else 0
+        stop = max(int(np.searchsorted(ends, done + PAIR_CHUNK, side="right")), start + 1)
+        chunk_counts = counts[start:stop]
+        size = int(chunk_counts.sum())
+        if size:
+            src = np.repeat(np.arange(start, stop), chunk_counts)
+            offsets = np.arange(size) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            yield src, order[np.repeat(left[start:stop], chunk_counts) + offsets]
+        start = stop
+
+def find_clusters(ids, hashes, distance: int):
+    """
+    Группирует хэши с расстоянием Хэмминга <= distance (транзитивно), distance <= MAX_DISTANCE.
+    Multi-index hashing: хэш режется на SEGMENTS подстрок, и по принципу Дирихле у любой пары
+    в пределах distance хотя бы одна подстрока отличается не больше чем на distance // SEGMENTS
+    бит. Для каждой подстроки перебираются маски этого радиуса, кандидаты находятся бинарным
+    поиском по отсортированным ключам и проверяются векторным popcount — всё без циклов по строкам.
+    """
+    if distance > MAX_DISTANCE:
+        raise ValueError(f"distance must be <= {MAX_DISTANCE}")
+    if len(ids) < 2:
+        return []
+    ids = np.asarray(ids)
+    # Одинаковые хэши (пустые кадры, копии) сравниваются один раз, а не попарно
+    unique, inverse = np.unique(np.asarray(hashes, dtype=np.int64), return_inverse=True)
+    hashes = unique.view(np.uint64)
+    uf = _UnionFind(len(hashes))
+
+    masks = _probe_masks(distance // SEGMENTS)
+    for segment in range(SEGMENTS):
+        keys = ((hashes >> np.uint64(segment * SEGMENT_BITS)) & np.uint64((1 << SEGMENT_BITS) - 1)).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        bucket_starts = np.zeros((1 << SEGMENT_BITS) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=1 << SEGMENT_BITS), out=bucket_starts[1:])
+        for mask in masks:
+            probes = keys ^ mask
+            # Ненулевая маска находит пару с обеих сторон — пробуем только от меньшего ключа
+            rows = np.flatnonzero(keys < probes) if mask else np.arange(len(keys))
+            for src, dst in _candidates(order, bucket_starts, probes[rows]):
+                src = rows[src]
+                if not mask:
+                    keep = src < dst
+                    src, dst = src[keep], dst[keep]
+                close = popcount(hashes[src] ^ hashes[dst]) <= distance
+                uf.union_pairs(src[close], dst[close])
+
+    roots = uf.roots(np.arange(len(hashes)))[inverse]
+    # Одиночки отбрасываем векторно — в Python собираем только настоящие группы
+    grouped = np.flatnonzero(np.bincount(roots)[roots] > 1)
+    clusters = {}
+    for index, root in zip(grouped.tolist(), roots[grouped].tolist()):
+        clusters.setdefault(root, []).append(int(ids[index]))
+    return sorted(clusters.values(), key=len, reverse=True)
+
+def load_hashes(db: Session, is_encrypted: bool = False):
+    rows = db.query(models.Media.id, models.Media.phash)\
+             .filter(models.Media.phash != None, models.Media.is_encrypted == is_encrypted).all()
+    return [r.id for r in rows], [r.phash for r in rows]
+
+def backfill_phashes(db: Session):
+    """Считает phash по уже готовым превью для строк, где его ещё нет."""
+    done = 0
+    last_id = 0
+    while True:
+        batch = db.query(models.Media.id, models.Media.thumbnail_path)\
+                  .filter(models.Media.phash == None, models.Media.thumbnail_path != None,
+                          models.Media.is_encrypted == False, models.Media.id > last_id)\
+                  .order_by(models.Media.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        updates = []
+        for row in batch:
+            phash = phash_from_file(settings.THUMBNAIL_DIR / row.thumbnail_path)
+            if phash is not None:
+                updates.append({"id": row.id, "phash": phash})
+        if updates:
+            db.bulk_update_mappings(models.Media, updates)
+            db.commit()
+        done += len(updates)
+    print(f"--- [Duplicates] Хэши посчитаны для {done} файлов")
+    return done
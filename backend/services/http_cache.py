@@ -0,0 +1,123 @@
+import os
+import anyio
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+# Ответ без версии в URL: браузер хранит копию, но перед использованием сверяет ETag (дёшево, 304)
+REVALIDATE = "private, no-cache"
+# В URL есть ?v= с текущим отпечатком: содержимое по этому адресу больше не меняется
+IMMUTABLE = "private, max-age=31536000, immutable"
+# Данные сейфа не должны оседать в дисковом кэше webview
+NO_STORE = "no-store"
+
+RANGE_CHUNK_SIZE = 1024 * 1024
+
+def fingerprint(st: os.stat_result) -> str:
+    """Отпечаток файла (как у кэша рендишенов): меняется вместе с содержимым."""
+    return f"{st.st_mtime_ns:x}{st.st_size:x}"
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Сравнение по If-None-Match слабое: W/"x" совпадает с "x"
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float] = None) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(range_header: Optional[str], size: int):
+    """Разбирает одиночный диапазон "bytes=start-end". Возвращает (start, end) или None."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[6:].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # Суффикс: последние N байт
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+class FileRangeResponse(FileResponse):
+    """Часть файла для ответа 206: читается только запрошенный диапазон, крупными кусками."""
+
+    def __init__(self, path, start: int, end: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def file_response(request: Request, path: Path, media_type: str, version: Optional[str] = None,
+                  ranges: bool = False, etag_source: Optional[Path] = None):
+    """
+    Файл с ETag/Last-Modified и ответом 304 на повторный запрос.
+    version — значение ?v= из URL: если это текущий отпечаток, ответ кэшируется навсегда.
+    ranges=True — поддержка Range (оригиналы видео и аудио для перемотки).
+    etag_source — файл, от которого производный (рендишен) получает отпечаток.
+    """
+    st = path.stat()
+    source_st = etag_source.stat() if etag_source is not None else st
+    etag_value = fingerprint(source_st)
+    etag = f'"{etag_value}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(source_st.st_mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE if version == etag_value else REVALIDATE,
+    }
+    if ranges:
+        headers["Accept-Ranges"] = "bytes"
+
+    if is_not_modified(request, etag, source_st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if ranges:
+        if_range = request.headers.get("if-range")
+        byte_range = None
+        # If-Range с устаревшим ETag: клиенту нужен весь новый файл, а не кусок
+        if if_range is None or if_range.strip() == etag:
+            byte_range = parse_range(request.headers.get("range"), st.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return FileRangeResponse(path, start, end, media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
+def private_response(content: bytes, media_type: str):
+    """Расшифрованные данные сейфа: без кэширования на стороне клиента."""
+    return Response(content=content, media_type=media_type, headers={"Cache-Control": NO_STORE})
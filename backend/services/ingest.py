@@ -0,0 +1,158 @@
+import os
+import uuid
+import hashlib
+import mimetypes
+from pathlib import Path
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import models
+from . import metadata, thumbnail
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=32)
+
+def staging_path() -> Path:
+    # Точка в начале имени: сканер и наблюдатель такие файлы пропускают
+    return settings.UPLOAD_DIR / f".upload-{uuid.uuid4().hex}.part"
+
+def stream_to_staging(source):
+    """
+    Копирует поток во временный файл кусками фиксированного размера,
+    попутно считая хэш. Возвращает (путь, хэш, размер).
+    """
+    settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = staging_path()
+    hasher = new_hasher()
+    size = 0
+    try:
+        with open(temp_path, "wb") as buffer:
+            while chunk := source.read(COPY_CHUNK_SIZE):
+                hasher.update(chunk)
+                buffer.write(chunk)
+                size += len(chunk)
+    except Exception:
+        if temp_path.exists(): os.unlink(temp_path)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
+def hash_file(path: Path) -> str:
+    hasher = new_hasher()
+    with open(path, "rb") as f_in:
+        while chunk := f_in.read(COPY_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def guess_mime_type(path: Path) -> str:
+    mime_type, _ = mimetypes.guess_type(path)
+    if not mime_type: mime_type = "application/octet-stream"
+    
+    ext = path.suffix.lower()
+    if ext in ['.heic', '.heif']: mime_type = "image/heic"
+    if ext in ['.cr2', '.nef', '.dng']: mime_type = f"image/x-{ext.lstrip('.')}"
+    return mime_type
+
+def _reserve(dest: Path) -> bool:
+    try:
+        fd = os.open(dest, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+def _place_file(temp_path: Path, filename: str, content_hash: str) -> Path:
+    """
+    Атомарно переносит файл в папку загрузок под свободным именем.
+    Имя резервируется через O_EXCL, поэтому два одинаковых имени не перезапишут друг друга.
+    """
+    name = Path(filename).name or "file"
+    stem, ext = Path(name).stem, Path(name).suffix
+    candidates = [name, f"{stem}_{content_hash[:8]}{ext}"]
+    candidates.extend(f"{stem}_{content_hash[:8]}_{i}{ext}" for i in range(1, 1000))
+
+    for candidate in candidates:
+        dest = settings.UPLOAD_DIR / candidate
+        if _reserve(dest):
+            os.replace(temp_path, dest)
+            return dest
+    raise FileExistsError(f"No free name for {name}")
+
+def find_duplicate(db: Session, content_hash: str):
+    """Открытый файл с тем же содержимым, который действительно есть на диске."""
+    return db.query(models.Media).filter(models.Media.content_hash == content_hash,
+                                         models.Media.is_missing == False,
+                                         models.Media.is_encrypted == False).first()
+
+def find_missing(db: Session, content_hash: str):
+    """Запись, чей файл пропал с диска: повторная загрузка возвращает его на место."""
+    return db.query(models.Media).filter(models.Media.content_hash == content_hash,
+                                         models.Media.is_missing == True,
+                                         models.Media.is_encrypted == False).first()
+
+def _restore_file(db: Session, temp_path: Path, media: models.Media, content_hash: str) -> Path:
+    dest = settings.UPLOAD_DIR / media.original_path
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if _reserve(dest):
+        os.replace(temp_path, dest)
+        return dest
+    # Старое место занято другим файлом — кладём под новым именем
+    dest = _place_file(temp_path, media.filename or dest.name, content_hash)
+    media.original_path = media.filename = dest.name
+    # Отпечаток сканера указывал на старый путь — иначе скан снова пометил бы запись пропавшей
+    db.query(models.FileIndex).filter(models.FileIndex.media_id == media.id).delete(synchronize_session=False)
+    return dest
+
+def ingest_file(db: Session, temp_path: Path, filename: str, content_hash: str, with_thumbnail: bool = False):
+    """
+    Регистрирует загруженный файл. Если такое содержимое уже есть в библиотеке,
+    временный файл удаляется и возвращается существующая запись; если есть запись
+    с пропавшим файлом — файл возвращается на её место.
+    Возвращает (media, is_duplicate). Commit — через commit_ingest.
+    """
+    existing = find_duplicate(db, content_hash)
+    if existing is not None:
+        os.unlink(temp_path)
+        return existing, True
+
+    missing = find_missing(db, content_hash)
+    if missing is not None:
+        file_path = _restore_file(db, temp_path, missing, content_hash)
+        missing.is_missing = False
+        missing.file_size = file_path.stat().st_size
+        return missing, False
+
+    file_path = _place_file(temp_path, filename, content_hash)
+    try:
+        mime_type = guess_mime_type(file_path)
+        stat = os.stat(file_path)
+        meta = metadata.extract_metadata(file_path, mime_type, stat.st_mtime)
+
+        new_media = models.Media(
+            filename=file_path.name,
+            original_path=file_path.name,
+            media_type=mime_type,
+            file_size=stat.st_size,
+            content_hash=content_hash,
+            taken_at=meta["taken_at"],
+            is_encrypted=False
+        )
+        db.add(new_media)
+        db.flush()
+        metadata.store_metadata(db, new_media.id, meta)
+        if with_thumbnail:
+            new_media.thumbnail_path, new_media.phash = thumbnail.generate_thumbnail_with_hash(new_media)
+    except Exception:
+        if file_path.exists(): os.unlink(file_path)
+        raise
+    return new_media, False
+
+def commit_ingest(db: Session, media: models.Media, is_duplicate: bool):
+    """Commit после ingest_file: если он не прошёл, размещённый файл не остаётся сиротой."""
+    placed = None if is_duplicate else settings.UPLOAD_DIR / media.original_path
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        if placed is not None and placed.exists(): os.unlink(placed)
+        raise
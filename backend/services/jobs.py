@@ -0,0 +1,305 @@
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import database, models
+from ..runtime import vault_state
+from . import bulk, scanner, media_cache
+
+ITEM_KINDS = {"encrypt", "decrypt", "delete", "rethumb"}
+JOB_KINDS = ITEM_KINDS | {"scan"}
+# Этим задачам нужен ключ сейфа: без него они ждут разблокировки в очереди
+KEY_KINDS = {"encrypt", "decrypt"}
+FINISHED_STATUSES = {"completed", "failed", "cancelled"}
+
+# Элементов за один проход: шифрование — небольшими порциями, чтобы чаще сохранять прогресс
+CHUNK_SIZES = {"encrypt": 2, "decrypt": 2, "delete": 500, "rethumb": 100}
+# Результат bulk.* -> статус элемента задачи
+ITEM_STATUSES = {"ok": "done", "skipped": "skipped", "not_found": "skipped", "error": "failed"}
+
+class JobCancelled(Exception):
+    pass
+
+class JobPaused(Exception):
+    """Сейф заблокирован посреди задачи: она вернётся в очередь и продолжится после входа."""
+
+class _LiveProgress:
+    """Счётчики выполняющейся задачи, которые ещё не записаны в базу."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.inflight_bytes = 0
+        self.cancelled = False
+        self.started = time.monotonic()
+        self.bytes_at_start = None
+
+    def add_bytes(self, count: int):
+        # Вызывается из файловых воркеров после каждого куска: здесь же быстрая отмена
+        if self.cancelled:
+            raise JobCancelled()
+        with self.lock:
+            self.inflight_bytes += count
+
+    def reset_inflight(self):
+        with self.lock:
+            self.inflight_bytes = 0
+
+class JobManager:
+    """Очередь задач в таблице jobs и поток, выполняющий их по одной; файлы внутри задачи — параллельно."""
+
+    def __init__(self, file_workers: int, poll_interval: float):
+        self.file_workers = file_workers
+        self.poll_interval = poll_interval
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.live = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self._requeue_interrupted()
+            self.thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self.thread.start()
+
+    def _requeue_interrupted(self):
+        # Задачи, прерванные выключением, продолжаются с невыполненных элементов
+        db = database.SessionLocal()
+        try:
+            count = db.query(models.Job).filter(models.Job.status == "running")\
+                      .update({models.Job.status: "queued"}, synchronize_session=False)
+            db.commit()
+            if count:
+                print(f"--- [Jobs] Возобновление прерванных задач: {count}")
+        finally:
+            db.close()
+
+    # --- API ---
+
+    def submit(self, db: Session, kind: str, ids=None, params: dict = None):
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job = models.Job(id=uuid.uuid4().hex, kind=kind, status="queued", params=json.dumps(params or {}))
+        db.add(job)
+
+        if kind in ITEM_KINDS:
+            if not ids and kind == "rethumb":
+                ids = [row.id for row in db.query(models.Media.id).filter(models.Media.is_encrypted == False)]
+            rows = bulk.load_rows(db, ids or [], models.Media.id, models.Media.file_size)
+            items = [{"job_id": job.id, "media_id": media_id, "status": "pending", "size": row.file_size or 0}
+                     for media_id, row in rows.items()]
+            job.items_total = len(items)
+            job.bytes_total = sum(item["size"] for item in items)
+            db.flush()
+            db.bulk_insert_mappings(models.JobItem, items)
+
+        db.commit()
+        self.start()
+        self.wake.set()
+        return job
+
+    def cancel(self, db: Session, job: models.Job):
+        if job.status in FINISHED_STATUSES:
+            return job
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.cancel_requested = True
+            live = self.live
+            if live is not None and live.job_id == job.id:
+                live.cancelled = True
+        db.commit()
+        return job
+
+    def snapshot(self, job: models.Job) -> dict:
+        bytes_done = job.bytes_done or 0
+        elapsed = None
+        throughput = None
+        eta = None
+
+        live = self.live
+        if job.status == "running" and live is not None and live.job_id == job.id:
+            with live.lock:
+                bytes_done += live.inflight_bytes
+            elapsed = time.monotonic() - live.started
+            processed = bytes_done - (live.bytes_at_start or 0)
+            if elapsed > 0 and processed > 0:
+                throughput = processed / elapsed
+                remaining = max((job.bytes_total or 0) - bytes_done, 0)
+                eta = round(remaining / throughput, 1)
+        elif job.started_at and job.finished_at:
+            elapsed = (job.finished_at - job.started_at).total_seconds()
+            if elapsed > 0:
+                throughput = bytes_done / elapsed
+
+        return {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "params": json.loads(job.params or "{}"),
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+            "cancel_requested": bool(job.cancel_requested),
+            "items_total": job.items_total or 0,
+            "items_done": job.items_done or 0,
+            "items_failed": job.items_failed or 0,
+            "bytes_total": job.bytes_total or 0,
+            "bytes_done": min(bytes_done, job.bytes_total or bytes_done),
+            "throughput_bytes_per_sec": round(throughput, 1) if throughput else None,
+            "eta_sec": eta,
+            "elapsed_sec": round(elapsed, 1) if elapsed is not None else None,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+    # --- Выполнение ---
+
+    def _run(self):
+        while True:
+            job_id = self._next_job_id()
+            if job_id is None:
+                self.wake.wait(self.poll_interval)
+                self.wake.clear()
+                continue
+            self._execute(job_id)
+
+    def _next_job_id(self):
+        db = database.SessionLocal()
+        try:
+            query = db.query(models.Job.id).filter(models.Job.status == "queued")
+            if vault_state.get_key() is None:
+                query = query.filter(models.Job.kind.notin_(KEY_KINDS))
+            row = query.order_by(models.Job.created_at, models.Job.id).first()
+            return row.id if row else None
+        finally:
+            db.close()
+
+    def _execute(self, job_id: str):
+        db = database.SessionLocal()
+        live = _LiveProgress(job_id)
+        try:
+            job = db.get(models.Job, job_id)
+            if job is None or job.status != "queued":
+                return
+            job.status = "running"
+            job.started_at = job.started_at or datetime.utcnow()
+            live.bytes_at_start = job.bytes_done or 0
+            live.cancelled = bool(job.cancel_requested)
+            self.live = live
+            db.commit()
+
+            try:
+                if job.kind == "scan":
+                    self._run_scan(db, job)
+                else:
+                    self._run_items(db, job, live)
+                job.status = "completed"
+            except JobCancelled:
+                db.rollback()
+                job.status = "cancelled"
+            except JobPaused:
+                db.rollback()
+                job.status = "queued"
+            except Exception as e:
+                db.rollback()
+                print(f"--- [Jobs] Задача {job.kind} {job.id} завершилась ошибкой: {e}")
+                job.status = "failed"
+                job.error = str(e)
+
+            if job.status != "queued":
+                job.finished_at = datetime.utcnow()
+            db.commit()
+        finally:
+            self.live = None
+            db.close()
+
+    def _run_scan(self, db: Session, job: models.Job):
+        if job.cancel_requested:
+            raise JobCancelled()
+        mode = json.loads(job.params or "{}").get("mode", "incremental")
+        try:
+            report = scanner.scan_storage(db, mode)
+        finally:
+            media_cache.cache.invalidate()
+        job.result = json.dumps(report, default=str)
+        job.items_total = job.items_done = report.get("files", 0)
+        job.items_failed = report.get("errors", 0)
+
+    def _run_items(self, db: Session, job: models.Job, live: _LiveProgress):
+        params = json.loads(job.params or "{}")
+        chunk_size = CHUNK_SIZES[job.kind]
+        if job.kind in KEY_KINDS:
+            chunk_size *= self.file_workers
+
+        while True:
+            if live.cancelled:
+                raise JobCancelled()
+            pending = db.query(models.JobItem.media_id, models.JobItem.size)\
+                        .filter(models.JobItem.job_id == job.id, models.JobItem.status == "pending")\
+                        .order_by(models.JobItem.media_id).limit(chunk_size).all()
+            if not pending:
+                break
+
+            ids = [row.media_id for row in pending]
+            sizes = {row.media_id: row.size or 0 for row in pending}
+            try:
+                results = self._handle(db, job.kind, ids, params, live)
+            finally:
+                # Часть файлов могла смениться даже при отмене посреди пачки
+                media_cache.cache.invalidate(ids, orderings=job.kind != "rethumb")
+            self._record(db, job, results, sizes, live)
+
+    def _handle(self, db: Session, kind: str, ids, params: dict, live: _LiveProgress):
+        if kind in KEY_KINDS:
+            key = vault_state.get_key()
+            if key is None:
+                raise JobPaused()
+            handler = bulk.encrypt if kind == "encrypt" else bulk.decrypt
+            return handler(db, ids, key, workers=self.file_workers, progress=live.add_bytes)
+        if kind == "delete":
+            return bulk.delete(db, ids)
+        rendered = scanner.render_thumbnails(db, ids, force=params.get("force", True))
+        return [{"id": mid, "status": "ok" if rendered.get(mid) else "error"} if mid in rendered
+                else {"id": mid, "status": "skipped"} for mid in ids]
+
+    def _record(self, db: Session, job: models.Job, results, sizes: dict, live: _LiveProgress):
+        by_status = {}
+        errors = []
+        for result in results:
+            status = ITEM_STATUSES.get(result["status"], "failed")
+            if status == "failed" and live.cancelled:
+                # Файл прервали отменой — он остаётся невыполненным, а не ошибочным
+                continue
+            by_status.setdefault(status, []).append(result["id"])
+            if result.get("error"):
+                errors.append({"job_id": job.id, "media_id": result["id"], "error": result["error"]})
+
+        for status, ids in by_status.items():
+            for chunk in bulk.chunked(ids):
+                db.query(models.JobItem)\
+                  .filter(models.JobItem.job_id == job.id, models.JobItem.media_id.in_(chunk))\
+                  .update({models.JobItem.status: status}, synchronize_session=False)
+        if errors:
+            db.bulk_update_mappings(models.JobItem, errors)
+
+        finished = [mid for ids in by_status.values() for mid in ids]
+        job.items_done = (job.items_done or 0) + len(finished) - len(by_status.get("failed", []))
+        job.items_failed = (job.items_failed or 0) + len(by_status.get("failed", []))
+        job.bytes_done = (job.bytes_done or 0) + sum(sizes.get(mid, 0) for mid in finished)
+        db.commit()
+        live.reset_inflight()
+
+def failed_items(db: Session, job_id: str, limit: int = 1000):
+    return db.query(models.JobItem.media_id, models.JobItem.status, models.JobItem.error)\
+             .filter(models.JobItem.job_id == job_id, models.JobItem.status.in_(("failed", "skipped")))\
+             .order_by(models.JobItem.media_id).limit(limit).all()
+
+manager = JobManager(settings.JOB_FILE_WORKERS, settings.JOB_POLL_INTERVAL_SEC)
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import models
+
+class MediaSnapshot:
+    """Неизменяемый снимок строки media для горячих путей (контент, превью, просмотрщик)."""
+    __slots__ = ("id", "filename", "original_path", "media_type", "thumbnail_path",
+                 "is_encrypted", "album_id", "taken_at", "file_size")
+
+    COLUMNS = (models.Media.id, models.Media.filename, models.Media.original_path, models.Media.media_type,
+               models.Media.thumbnail_path, models.Media.is_encrypted, models.Media.album_id,
+               models.Media.taken_at, models.Media.file_size)
+
+    def __init__(self, row):
+        for name, value in zip(self.__slots__, row):
+            setattr(self, name, value)
+
+def _order_key(taken_at, media_id):
+    # Порядок ленты: taken_at DESC, id DESC; NULL в SQLite при DESC идёт последним
+    return (taken_at or datetime.min, media_id)
+
+class _Ordering:
+    """Все id одной ленты (открытая/сейф, альбом) по возрастанию ключа — для соседей без SQL."""
+    __slots__ = ("keys", "positions")
+
+    def __init__(self, rows):
+        self.keys = sorted(_order_key(row.taken_at, row.id) for row in rows)
+        self.positions = {key[1]: i for i, key in enumerate(self.keys)}
+
+    def neighbors(self, media_id: int):
+        i = self.positions.get(media_id)
+        if i is None:
+            return None, None
+        # В ленте новые сверху: "предыдущий" — более новый, то есть следующий по возрастанию
+        newer = self.keys[i + 1][1] if i + 1 < len(self.keys) else None
+        older = self.keys[i - 1][1] if i > 0 else None
+        return newer, older
+
+class MediaRowCache:
+    """
+    LRU снимков строк media по id плюс упорядоченные ленты для навигации просмотрщика.
+    Любая запись в media должна вызывать invalidate: точечно по id или целиком.
+    """
+
+    def __init__(self, max_entries: int, max_orderings: int):
+        self.max_entries = max_entries
+        self.max_orderings = max_orderings
+        self.rows = OrderedDict()
+        self.orderings = OrderedDict()
+        self.lock = threading.Lock()
+        # Загрузка, начатая до инвалидации, не должна положить в кэш устаревшую строку
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, db: Session, media_id: int):
+        with self.lock:
+            snapshot = self.rows.get(media_id)
+            if snapshot is not None:
+                self.rows.move_to_end(media_id)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            generation = self.generation
+
+        row = db.query(*MediaSnapshot.COLUMNS).filter(models.Media.id == media_id).first()
+        if row is None:
+            return None
+        snapshot = MediaSnapshot(row)
+        with self.lock:
+            if generation == self.generation:
+                self.rows[media_id] = snapshot
+                while len(self.rows) > self.max_entries:
+                    self.rows.popitem(last=False)
+        return snapshot
+
+    def neighbors(self, db: Session, snapshot: MediaSnapshot, album_id: int = None):
+        """(более новый id, более старый id) в ленте снимка или в альбоме."""
+        key = (bool(snapshot.is_encrypted), album_id)
+        with self.lock:
+            ordering = self.orderings.get(key)
+            if ordering is not None:
+                self.orderings.move_to_end(key)
+                self.hits += 1
+                return ordering.neighbors(snapshot.id)
+            self.misses += 1
+            generation = self.generation
+
+        query = db.query(models.Media.id, models.Media.taken_at)\
+                  .filter(models.Media.is_encrypted == key[0])
+        if album_id is not None:
+            query = query.filter(models.Media.album_id == album_id)
+        ordering = _Ordering(query.all())
+        with self.lock:
+            if generation == self.generation:
+                self.orderings[key] = ordering
+                while len(self.orderings) > self.max_orderings:
+                    self.orderings.popitem(last=False)
+        return ordering.neighbors(snapshot.id)
+
+    def invalidate(self, ids=None, orderings: bool = True):
+        """ids=None — сбросить всё (скан, удаление альбома). Ленты по умолчанию сбрасываются:
+        новая, удалённая или перенесённая строка меняет соседей. orderings=False — для
+        изменений, не трогающих taken_at, альбом и сейф (превью, phash)."""
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            if orderings:
+                self.orderings.clear()
+            if ids is None:
+                self.rows.clear()
+                return
+            for media_id in ids:
+                self.rows.pop(media_id, None)
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.rows),
+                "max_entries": self.max_entries,
+                "orderings": len(self.orderings),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+            }
+
+cache = MediaRowCache(settings.MEDIA_CACHE_MAX_ENTRIES, settings.MEDIA_CACHE_MAX_ORDERINGS)
@@ -0,0 +1,242 @@
+import io
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from PIL import Image, ExifTags
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import models
+from .. import crypto_utils
+from . import video, media_cache
+
+# Сколько байт расшифровывать из сейфа, чтобы прочитать заголовок и EXIF
+VAULT_HEADER_BYTES = 1024 * 1024
+BACKFILL_BATCH_SIZE = 200
+
+EXIF_FIELDS = {
+    'Make': 'camera_make',
+    'Model': 'camera_model',
+    'ISOSpeedRatings': 'iso',
+    'ExposureTime': 'exposure',
+    'FNumber': 'f_number',
+    'FocalLength': 'focal_length',
+    'LensModel': 'lens',
+    'Software': 'software'
+}
+
+# Поля строки -> ключи ответа /details (исторический формат фронтенда)
+DETAILS_EXIF_KEYS = {
+    'camera_make': 'make',
+    'camera_model': 'model',
+    'iso': 'iso',
+    'exposure': 'exposure',
+    'f_number': 'f_number',
+    'focal_length': 'focal_length',
+    'lens': 'lens',
+    'software': 'software'
+}
+
+def _convert_to_degrees(value):
+    try:
+        d = float(value[0])
+        m = float(value[1])
+        s = float(value[2])
+        return d + (m / 60.0) + (s / 3600.0)
+    except Exception:
+        return None
+
+def _get_gps_info(exif):
+    if not exif or 'GPSInfo' not in exif:
+        return None
+    
+    gps_tags = exif['GPSInfo']
+    lat = gps_tags.get(2)
+    lat_ref = gps_tags.get(1)
+    lon = gps_tags.get(4)
+    lon_ref = gps_tags.get(3)
+
+    if lat and lon and lat_ref and lon_ref:
+        lat_dec = _convert_to_degrees(lat)
+        lon_dec = _convert_to_degrees(lon)
+        
+        if lat_dec is not None and lon_dec is not None:
+            if lat_ref != 'N': lat_dec = -lat_dec
+            if lon_ref != 'E': lon_dec = -lon_dec
+            return {"lat": lat_dec, "lng": lon_dec}
+    
+    return None
+
+def _read_image_metadata(source, data: dict):
+    with Image.open(source) as img:
+        data["width"] = img.width
+        data["height"] = img.height
+
+        exif_raw = img._getexif() if hasattr(img, "_getexif") else None
+        if not exif_raw:
+            return
+
+        date_str = exif_raw.get(36867) or exif_raw.get(306)
+        if date_str:
+            try:
+                data["taken_at"] = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
+            except (ValueError, TypeError): pass
+
+        for tag_id, value in exif_raw.items():
+            tag_name = ExifTags.TAGS.get(tag_id)
+            if tag_name in EXIF_FIELDS:
+                if isinstance(value, str):
+                    value = value.replace('\x00', '').strip()
+                data[EXIF_FIELDS[tag_name]] = str(value)
+
+            if tag_name == 'GPSInfo':
+                gps_data = _get_gps_info({ 'GPSInfo': value })
+                if gps_data:
+                    data["gps_lat"] = gps_data["lat"]
+                    data["gps_lng"] = gps_data["lng"]
+
+def extract_metadata(file_path: Path, media_type: str, mtime: float = None) -> dict:
+    """Читает размеры, дату съёмки, камеру, объектив, экспозицию и GPS. Без полного декодирования."""
+    if mtime is None:
+        mtime = file_path.stat().st_mtime
+    data = {"taken_at": datetime.fromtimestamp(mtime)}
+
+    if media_type and media_type.startswith("image/"):
+        try:
+            _read_image_metadata(file_path, data)
+        except Exception:
+            pass
+    elif media_type and media_type.startswith("video/"):
+        try:
+            data.update((k, v) for k, v in video.probe(file_path).items() if v is not None)
+        except Exception:
+            pass
+    return data
+
+def extract_vault_metadata(vault_path: Path, media_type: str, key: bytes) -> dict:
+    """То же для файла сейфа: сначала пробуем только начало файла, целиком — лишь при неудаче."""
+    mtime = vault_path.stat().st_mtime
+    data = {"taken_at": datetime.fromtimestamp(mtime)}
+    if media_type and media_type.startswith("image/"):
+        head = b"".join(crypto_utils.decrypt_file_generator(vault_path, key, 0, VAULT_HEADER_BYTES - 1))
+        try:
+            _read_image_metadata(io.BytesIO(head), data)
+            return data
+        except Exception:
+            pass
+    elif not (media_type and media_type.startswith("video/")):
+        return data
+
+    fd, temp_name = tempfile.mkstemp()
+    os.close(fd)
+    temp_path = Path(temp_name)
+    try:
+        crypto_utils.decrypt_file_to_disk(vault_path, temp_path, key)
+        return extract_metadata(temp_path, media_type, mtime)
+    finally:
+        if temp_path.exists(): os.unlink(temp_path)
+
+def store_metadata(db: Session, media_id: int, data: dict):
+    """Создаёт или обновляет строку media_metadata (без commit)."""
+    row = db.get(models.MediaMetadata, media_id)
+    if row is None:
+        row = models.MediaMetadata(media_id=media_id)
+        db.add(row)
+    for column in models.MediaMetadata.__table__.columns.keys():
+        if column in ("media_id", "extracted_at"):
+            continue
+        setattr(row, column, data.get(column))
+    row.extracted_at = datetime.utcnow()
+    return row
+
+def store_metadata_bulk(db: Session, items):
+    """items: [(media_id, data)]. Заменяет строки пачкой."""
+    items = [(media_id, data) for media_id, data in items if data is not None]
+    if not items:
+        return
+    ids = [media_id for media_id, _ in items]
+    db.query(models.MediaMetadata).filter(models.MediaMetadata.media_id.in_(ids)).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(models.MediaMetadata, [
+        dict(data, media_id=media_id, extracted_at=now) for media_id, data in items
+    ])
+
+def extract_for_media(media, key: bytes = None):
+    if media.is_encrypted:
+        if key is None:
+            return None
+        path = settings.VAULT_DIR / Path(media.original_path).name
+        if not path.exists():
+            return None
+        return extract_vault_metadata(path, media.media_type, key)
+
+    path = settings.UPLOAD_DIR / media.original_path
+    if not path.exists():
+        return None
+    return extract_metadata(path, media.media_type)
+
+def build_details(media, meta) -> dict:
+    """Ответ /details из сохранённых данных — файл при этом не открывается."""
+    details = {
+        "filename": media.filename,
+        "size": media.file_size,
+        "mime": media.media_type,
+        "width": meta.width or 0,
+        "height": meta.height or 0,
+        "exif": {}
+    }
+    for column, key in DETAILS_EXIF_KEYS.items():
+        value = getattr(meta, column)
+        if value is not None:
+            details["exif"][key] = value
+    if meta.gps_lat is not None and meta.gps_lng is not None:
+        details["exif"]["gps"] = {"lat": meta.gps_lat, "lng": meta.gps_lng}
+    details["created"] = meta.taken_at.timestamp() if meta.taken_at else None
+    if meta.duration is not None or meta.video_codec:
+        details["video"] = {"duration": meta.duration, "codec": meta.video_codec, "fps": meta.fps}
+    return details
+
+def backfill_metadata(db: Session, key: bytes = None):
+    """Заполняет media_metadata для уже существующих файлов пачками."""
+    print("--- [Metadata] Заполнение метаданных для существующих файлов ---")
+    done = 0
+    failed_ids = set()
+    last_id = 0
+
+    while True:
+        # Строки без метаданных и видео, извлечённые до появления длительности/кодека
+        query = db.query(models.Media)\
+                  .outerjoin(models.MediaMetadata, models.MediaMetadata.media_id == models.Media.id)\
+                  .filter(or_(models.MediaMetadata.media_id == None,
+                              and_(models.Media.media_type.like("video/%"), models.MediaMetadata.duration == None)),
+                          models.Media.id > last_id)
+        if key is None:
+            query = query.filter(models.Media.is_encrypted == False)
+        batch = query.order_by(models.Media.id).limit(BACKFILL_BATCH_SIZE).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        items = []
+        for media in batch:
+            try:
+                data = extract_for_media(media, key)
+            except Exception as e:
+                print(f"--- [Metadata] Ошибка для {media.id}: {e}")
+                data = None
+            if data is None:
+                failed_ids.add(media.id)
+            else:
+                items.append((media.id, data))
+
+        store_metadata_bulk(db, items)
+        # Лента сортируется по media.taken_at: без этого строка осталась бы с датой-заглушкой
+        db.bulk_update_mappings(models.Media, [{"id": media_id, "taken_at": data["taken_at"]}
+                                               for media_id, data in items if data.get("taken_at")])
+        db.commit()
+        media_cache.cache.invalidate([media_id for media_id, _ in items])
+        done += len(items)
+
+    print(f"--- [Metadata] Готово. Обработано: {done}, Пропущено: {len(failed_ids)} ---")
+    return done
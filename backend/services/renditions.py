@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from PIL import Image, ImageOps, features
+from ..config import settings
+from .thumbnail import _load_image_robust, atomic_save
+from .singleflight import flights
+
+FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg", {"quality": 88}),
+    "webp": ("WEBP", "webp", "image/webp", {"quality": 85, "method": 4}),
+    "avif": ("AVIF", "avif", "image/avif", {"quality": 70}),
+}
+
+def available_formats():
+    result = ["jpeg"]
+    if features.check("webp"): result.append("webp")
+    if features.check("avif"): result.append("avif")
+    return result
+
+def source_fingerprint(source_path: Path) -> str:
+    st = source_path.stat()
+    return f"{st.st_mtime_ns:x}{st.st_size:x}"
+
+class RenditionCache:
+    """
+    Дисковый кэш рендишенов с ключом (id медиа, размер, отпечаток исходника).
+    Общий объём ограничен RENDITION_CACHE_MAX_BYTES, при превышении удаляются
+    давно не использованные файлы (LRU). Порядок доступа переживает перезапуск через mtime.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = None
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def _load_entries(self):
+        if self.entries is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                files.append((st.st_mtime, entry.name, st.st_size))
+        files.sort()
+        self.entries = OrderedDict((name, size) for _, name, size in files)
+        self.total_bytes = sum(self.entries.values())
+
+    def _touch(self, name: str):
+        self.entries.move_to_end(name)
+        try:
+            os.utime(self.root / name)
+        except OSError:
+            pass
+
+    def _add(self, name: str, size: int):
+        old = self.entries.pop(name, None)
+        if old is not None:
+            self.total_bytes -= old
+        self.entries[name] = size
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            evicted, evicted_size = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            try:
+                os.remove(self.root / evicted)
+            except OSError:
+                pass
+
+    def _drop_stale(self, prefix: str, keep_prefix: str = None):
+        for name in [n for n in self.entries if n.startswith(prefix) and not (keep_prefix and n.startswith(keep_prefix))]:
+            self.total_bytes -= self.entries.pop(name)
+            try:
+                os.remove(self.root / name)
+            except OSError:
+                pass
+
+    def get_or_create(self, media_id: int, source_path: Path, size_class: str, fmt: str = "jpeg"):
+        """Возвращает (путь, mime) готового рендишена, создавая его при первом обращении."""
+        max_side = settings.RENDITION_SIZES[size_class]
+        pil_format, ext, mime, save_options = FORMATS[fmt]
+        prefix = f"r{media_id}_{size_class}_"
+        fingerprint = source_fingerprint(source_path)
+        name = f"{prefix}{fingerprint}.{ext}"
+        path = self.root / name
+
+        with self.lock:
+            self._load_entries()
+            if name in self.entries and path.exists():
+                self._touch(name)
+                return path, mime
+
+        return flights.do(("rendition", name), self._render, source_path, path, prefix, fingerprint,
+                          max_side, pil_format, mime, save_options)
+
+    def _render(self, source_path: Path, path: Path, prefix: str, fingerprint: str,
+                max_side, pil_format: str, mime: str, save_options: dict):
+        if path.exists():
+            with self.lock:
+                self._add(path.name, path.stat().st_size)
+            return path, mime
+
+        img = _load_image_robust(source_path, max_side)
+        if img is None:
+            return None, None
+        try: img = ImageOps.exif_transpose(img)
+        except Exception: pass
+        if img.mode != "RGB": img = img.convert("RGB")
+        if max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        atomic_save(img, path, pil_format, **save_options)
+
+        with self.lock:
+            # Рендишены от прежней версии исходника больше не нужны
+            self._drop_stale(prefix, f"{prefix}{fingerprint}.")
+            self._add(path.name, path.stat().st_size)
+        return path, mime
+
+    def remove_media(self, media_id: int):
+        prefix = f"r{media_id}_"
+        with self.lock:
+            self._load_entries()
+            self._drop_stale(prefix)
+
+cache = RenditionCache(settings.RENDITION_DIR, settings.RENDITION_CACHE_MAX_BYTES)
@@ -1,9 +1,15 @@
 import os
+import time
+import threading
+import functools
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from sqlalchemy.orm import Session
 from ..config import settings
 from ..database import models
-from .thumbnail import generate_thumbnail
+from .thumbnail import generate_thumbnail, run_thumbnail_job, ThumbnailJob
+from . import metadata, video
 
 IMAGE_EXTENSIONS = {
     '.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tiff', '.tif',
@@ -12,16 +18,25 @@ IMAGE_EXTENSIONS = {
 }
 VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v'}
 
-def scan_storage(db: Session):
-    print("--- [Scanner] Запуск процесса сканирования ---")
-    
-    if not settings.UPLOAD_DIR.exists():
-        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+INSERT_BATCH_SIZE = 500
+RESULT_BATCH_SIZE = 200
+# Меньше этого числа задач пул процессов не поднимаем — дешевле сделать на месте
+POOL_MIN_JOBS = 8
 
+# Наблюдатель, задача /scan и скан при старте работают в разных потоках: без очереди
+# два скана вставляют один и тот же новый файл и второй падает на unique(original_path).
+# Его же берёт bulk на время переноса файлов между папкой загрузок и сейфом.
+scan_lock = threading.RLock()
+
+def _serialized(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with scan_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+def _collect_files(root_dir: Path):
     found_files = []
-    
-    root_dir = settings.UPLOAD_DIR
-    
     for root, _, files in os.walk(root_dir):
         for file in files:
             if file.startswith('.'): continue
@@ -31,11 +46,62 @@ def scan_storage(db: Session):
             
             if ext in IMAGE_EXTENSIONS or ext in VIDEO_EXTENSIONS:
                 found_files.append(path)
+    return found_files
+
+def _walk_with_stat(root_dir: Path):
+    """Обходит дерево через scandir и отдаёт (путь, stat, inode) для медиафайлов."""
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'): continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext not in IMAGE_EXTENSIONS and ext not in VIDEO_EXTENSIONS:
+                        continue
+                    # На Windows st_ino у DirEntry.stat() пустой, поэтому берём entry.inode()
+                    yield Path(entry.path), entry.stat(), entry.inode()
+                except OSError:
+                    continue
+
+def _guess_mime_type(ext: str) -> str:
+    if ext in VIDEO_EXTENSIONS:
+        return f"video/{ext.lstrip('.')}"
+    if ext in ['.jpg', '.jpeg']: return "image/jpeg"
+    if ext == '.png': return "image/png"
+    if ext == '.webp': return "image/webp"
+    if ext in ['.heic', '.heif']: return "image/heic"
+    if ext in ['.cr2', '.nef', '.dng', '.arw']: return f"image/x-{ext.lstrip('.')}"
+    return f"image/{ext.lstrip('.')}"
+
+@_serialized
+def scan_storage(db: Session, mode: str = "incremental"):
+    if mode == "incremental":
+        return scan_incremental(db)
+    if mode == "parallel":
+        return scan_storage_parallel(db)
+
+    print("--- [Scanner] Запуск процесса сканирования ---")
+    started = time.perf_counter()
+
+    if not settings.UPLOAD_DIR.exists():
+        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    found_files = _collect_files(settings.UPLOAD_DIR)
 
     print(f"--- [Scanner] Найдено файлов на диске: {len(found_files)}")
 
     count_new = 0
     count_updated = 0
+    count_thumbs = 0
     count_errors = 0
     
     for file_path in found_files:
@@ -50,32 +116,25 @@ def scan_storage(db: Session):
             existing_media = db.query(models.Media).filter(models.Media.original_path == relative_path).first()
             
             ext = file_path.suffix.lower()
-            media_type = models.MediaType.VIDEO if ext in VIDEO_EXTENSIONS else models.MediaType.PHOTO
-            
-            mime_type = "application/octet-stream"
-            if ext in VIDEO_EXTENSIONS:
-                mime_type = f"video/{ext.lstrip('.')}"
-            elif ext in ['.jpg', '.jpeg']: mime_type = "image/jpeg"
-            elif ext == '.png': mime_type = "image/png"
-            elif ext == '.webp': mime_type = "image/webp"
-            elif ext in ['.heic', '.heif']: mime_type = "image/heic"
-            elif ext in ['.cr2', '.nef', '.dng', '.arw']: mime_type = f"image/x-{ext.lstrip('.')}"
-            else: mime_type = f"image/{ext.lstrip('.')}"
+            mime_type = _guess_mime_type(ext)
 
             if not existing_media:
                 print(f"--- [New] Новый файл: {relative_path}")
-                
-                thumb_filename = generate_thumbnail(file_path, file_path.name)
 
                 new_media = models.Media(
                     filename=file_path.name,
                     original_path=relative_path,
                     file_size=real_size,
                     media_type=mime_type,
-                    thumbnail_path=thumb_filename,
+                    taken_at=datetime.fromtimestamp(file_path.stat().st_mtime),
                     is_encrypted=False
                 )
                 db.add(new_media)
+                # Превью называется по id: сначала нужна сама строка
+                db.flush()
+                new_media.thumbnail_path = generate_thumbnail(new_media)
+                if new_media.thumbnail_path:
+                    count_thumbs += 1
                 count_new += 1
             
             else:
@@ -96,6 +155,7 @@ def scan_storage(db: Session):
                     thumb_filename = generate_thumbnail(TempMedia(), None)
                     if thumb_filename:
                         existing_media.thumbnail_path = Path(thumb_filename).name
+                        count_thumbs += 1
                         needs_save = True
                 
                 if needs_save:
@@ -111,4 +171,436 @@ def scan_storage(db: Session):
             continue
             
     db.commit()
-    print(f"--- [Scanner] Завершено. Добавлено: {count_new}, Обновлено: {count_updated}, Ошибок: {count_errors} ---")
\ No newline at end of file
+    print(f"--- [Scanner] Завершено. Добавлено: {count_new}, Обновлено: {count_updated}, Ошибок: {count_errors} ---")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "files": len(found_files),
+        "added": count_new,
+        "updated": count_updated,
+        "thumbnails": count_thumbs,
+        "errors": count_errors,
+        "elapsed_sec": elapsed,
+        "files_per_sec": len(found_files) / elapsed if elapsed > 0 else 0.0,
+    }
+
+@_serialized
+def scan_storage_parallel(db: Session, workers: int = None):
+    """Быстрый режим: обход диска, пакетная вставка строк, превью в пуле процессов."""
+    print("--- [Scanner] Запуск параллельного сканирования ---")
+    started = time.perf_counter()
+
+    if not settings.UPLOAD_DIR.exists():
+        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    found_files = _collect_files(settings.UPLOAD_DIR)
+    print(f"--- [Scanner] Найдено файлов на диске: {len(found_files)}")
+
+    # Одним запросом получаем всё, что уже есть в базе
+    existing = {
+        row.original_path: row
+        for row in db.query(models.Media.id, models.Media.original_path, models.Media.file_size,
+                            models.Media.thumbnail_path, models.Media.is_encrypted)
+    }
+
+    jobs = []
+    new_rows = []
+    size_updates = []
+
+    for file_path in found_files:
+        try:
+            relative_path = str(file_path.relative_to(settings.UPLOAD_DIR))
+            st = file_path.stat()
+            real_size = st.st_size
+        except (ValueError, OSError):
+            continue
+
+        mime_type = _guess_mime_type(file_path.suffix.lower())
+        row = existing.get(relative_path)
+
+        if row is None:
+            new_rows.append(models.Media(
+                filename=file_path.name,
+                original_path=relative_path,
+                file_size=real_size,
+                media_type=mime_type,
+                taken_at=datetime.fromtimestamp(st.st_mtime),
+                is_encrypted=False
+            ))
+            continue
+        if row.is_encrypted:
+            continue
+
+        if row.file_size != real_size:
+            size_updates.append({"id": row.id, "file_size": real_size})
+        if not row.thumbnail_path:
+            jobs.append(ThumbnailJob(row.id, relative_path, mime_type, False))
+
+    for i in range(0, len(new_rows), INSERT_BATCH_SIZE):
+        batch = new_rows[i:i + INSERT_BATCH_SIZE]
+        db.add_all(batch)
+        db.flush()
+        jobs.extend(ThumbnailJob(m.id, m.original_path, m.media_type, False) for m in batch)
+    if size_updates:
+        db.bulk_update_mappings(models.Media, size_updates)
+    db.commit()
+
+    thumbs_done, count_errors = _run_thumbnail_pool(db, jobs, workers)
+
+    elapsed = time.perf_counter() - started
+    rate = len(found_files) / elapsed if elapsed > 0 else 0.0
+    print(f"--- [Scanner] Завершено за {elapsed:.1f} c ({rate:.1f} файлов/с). "
+          f"Добавлено: {len(new_rows)}, Обновлено: {len(size_updates)}, Превью: {thumbs_done}, Ошибок: {count_errors} ---")
+
+    return {
+        "files": len(found_files),
+        "added": len(new_rows),
+        "updated": len(size_updates),
+        "thumbnails": thumbs_done,
+        "errors": count_errors,
+        "elapsed_sec": elapsed,
+        "files_per_sec": rate,
+    }
+
+def _ingest_worker(job: ThumbnailJob):
+    """Выполняется в пуле процессов: превью и метаданные за один проход по файлу."""
+    media_id, thumb_filename, phash = run_thumbnail_job(job)
+    try:
+        meta = metadata.extract_metadata(settings.UPLOAD_DIR / job.original_path, job.media_type)
+    except Exception:
+        meta = None
+    return media_id, thumb_filename, meta, phash
+
+def _thumbnail_worker(job: ThumbnailJob):
+    """Только превью, без метаданных — для пакетной перегенерации."""
+    media_id, thumb_filename, phash = run_thumbnail_job(job)
+    return media_id, thumb_filename, None, phash
+
+class _IngestResults:
+    """Копит результаты воркеров и сохраняет их пачками."""
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.media_updates = []
+        self.meta_items = []
+        self.done_count = 0
+        self.count_errors = 0
+        self.rendered = {}
+
+    def add(self, media_id: int, thumb_filename, meta, phash=None):
+        update = {"id": media_id}
+        self.rendered[media_id] = thumb_filename
+        if thumb_filename:
+            update["thumbnail_path"] = thumb_filename
+            if phash is not None:
+                update["phash"] = phash
+            self.done_count += 1
+        else:
+            self.count_errors += 1
+        if meta is not None:
+            self.meta_items.append((media_id, meta))
+            update["taken_at"] = meta["taken_at"]
+        if len(update) > 1:
+            self.media_updates.append(update)
+        if len(self.media_updates) + len(self.meta_items) >= RESULT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.media_updates:
+            self.db.bulk_update_mappings(models.Media, self.media_updates)
+        if self.meta_items:
+            metadata.store_metadata_bulk(self.db, self.meta_items)
+        if self.media_updates or self.meta_items:
+            self.db.commit()
+        self.media_updates = []
+        self.meta_items = []
+
+def _run_thumbnail_pool(db: Session, jobs, workers: int = None, worker=_ingest_worker, results: _IngestResults = None):
+    """Раздаёт задачи превью ограниченному пулу процессов и сохраняет результаты пачками."""
+    if not jobs:
+        return 0, 0
+
+    results = results or _IngestResults(db)
+
+    if len(jobs) < POOL_MIN_JOBS:
+        for job in jobs:
+            try:
+                results.add(*worker(job))
+            except Exception as e:
+                print(f"--- [Scanner] Ошибка превью {job.original_path}: {e}")
+                results.count_errors += 1
+        results.flush()
+        return results.done_count, results.count_errors
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        job_iter = iter(jobs)
+        in_flight = set()
+
+        while True:
+            while len(in_flight) < max_in_flight:
+                job = next(job_iter, None)
+                if job is None: break
+                in_flight.add(pool.submit(worker, job))
+
+            if not in_flight:
+                break
+
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    results.add(*future.result())
+                except Exception as e:
+                    print(f"--- [Scanner] Ошибка воркера превью: {e}")
+                    results.count_errors += 1
+
+    results.flush()
+    return results.done_count, results.count_errors
+
+def render_thumbnails(db: Session, ids, force: bool = False, workers: int = None):
+    """
+    Пакетная генерация превью для списка id через тот же пул процессов, что и скан.
+    force=True перерисовывает уже существующие превью. Возвращает {id: имя превью или None}.
+    """
+    rows = []
+    for chunk in _chunked(list(dict.fromkeys(ids))):
+        rows.extend(db.query(models.Media.id, models.Media.original_path, models.Media.media_type,
+                             models.Media.is_encrypted, models.Media.thumbnail_path)
+                      .filter(models.Media.id.in_(chunk)).all())
+
+    rendered = {}
+    jobs = []
+    for row in rows:
+        # Превью сейфа живут в зашифрованном хранилище, здесь их не трогаем
+        if row.is_encrypted:
+            continue
+        if force:
+            _drop_thumbnail(row.id)
+        elif row.thumbnail_path and (settings.THUMBNAIL_DIR / row.thumbnail_path).exists():
+            rendered[row.id] = row.thumbnail_path
+            continue
+        jobs.append(ThumbnailJob(row.id, row.original_path, row.media_type, False))
+
+    results = _IngestResults(db)
+    _run_thumbnail_pool(db, jobs, workers, worker=_thumbnail_worker, results=results)
+    rendered.update(results.rendered)
+    return rendered
+
+def _drop_thumbnail(media_id: int):
+    thumb = settings.THUMBNAIL_DIR / f"thumb_{media_id}.jpg"
+    try:
+        if thumb.exists(): os.remove(thumb)
+        video.remove_preview(media_id)
+    except OSError:
+        pass
+
+def _stat_paths(paths):
+    """Как _walk_with_stat, но только для переданных путей (каталоги обходятся целиком)."""
+    for raw_path in paths:
+        path = Path(raw_path)
+        if path.name.startswith('.'):
+            continue
+        try:
+            if path.is_dir():
+                yield from _walk_with_stat(path)
+                continue
+            ext = path.suffix.lower()
+            if ext not in IMAGE_EXTENSIONS and ext not in VIDEO_EXTENSIONS:
+                continue
+            st = path.stat()
+            yield path, st, st.st_ino
+        except OSError:
+            continue
+
+def _chunked(items, size: int = INSERT_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _load_index(db: Session, paths=None, inodes=None):
+    columns = (
+        models.FileIndex.id, models.FileIndex.media_id, models.FileIndex.path,
+        models.FileIndex.size, models.FileIndex.mtime_ns, models.FileIndex.inode,
+        models.Media.is_encrypted, models.Media.is_missing
+    )
+    query = db.query(*columns).join(models.Media, models.Media.id == models.FileIndex.media_id)
+    if paths is None:
+        return {row.path: row for row in query}
+
+    index = {}
+    for chunk in _chunked(paths):
+        index.update((row.path, row) for row in query.filter(models.FileIndex.path.in_(chunk)))
+    for chunk in _chunked(inodes or ()):
+        index.update((row.path, row) for row in query.filter(models.FileIndex.inode.in_(chunk)))
+    return index
+
+@_serialized
+def scan_incremental(db: Session, paths=None, workers: int = None):
+    """
+    Инкрементальное сканирование по отпечаткам (mtime, size, inode).
+    Неизменённые файлы пропускаются без обращений к базе, переименования
+    и перемещения распознаются по inode и размеру, исчезнувшие файлы помечаются.
+    Если передан paths, обрабатываются только эти файлы и каталоги.
+    """
+    partial = paths is not None
+    if not partial:
+        print("--- [Scanner] Запуск инкрементального сканирования ---")
+    started = time.perf_counter()
+
+    if not settings.UPLOAD_DIR.exists():
+        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+    if partial:
+        # Каталог и файлы в нём могут прийти одновременно — убираем повторы
+        found = {}
+        for file_path, st, inode in _stat_paths(paths):
+            try:
+                file_path.relative_to(settings.UPLOAD_DIR)
+            except ValueError:
+                continue
+            found[file_path] = (file_path, st, inode)
+        found = list(found.values())
+        requested = set()
+        for raw_path in paths:
+            try:
+                requested.add(str(Path(raw_path).relative_to(settings.UPLOAD_DIR)))
+            except ValueError:
+                continue
+        requested.update(str(p.relative_to(settings.UPLOAD_DIR)) for p, _, _ in found)
+        index = _load_index(db, requested, {inode for _, _, inode in found if inode})
+    else:
+        found = _walk_with_stat(settings.UPLOAD_DIR)
+        # Весь индекс одним запросом
+        index = _load_index(db)
+
+    seen = set()
+    unknown = []
+    index_updates = []
+    media_updates = []
+    jobs = []
+    count_files = 0
+    count_changed = 0
+
+    for file_path, st, inode in found:
+        count_files += 1
+        relative_path = str(file_path.relative_to(settings.UPLOAD_DIR))
+        entry = index.get(relative_path)
+
+        if entry is None:
+            unknown.append((file_path, relative_path, st, inode))
+            continue
+
+        seen.add(relative_path)
+        if (entry.mtime_ns, entry.size, entry.inode) == (st.st_mtime_ns, st.st_size, inode):
+            if entry.is_missing:
+                media_updates.append({"id": entry.media_id, "is_missing": False})
+            continue
+
+        # Файл изменился на месте: обновляем отпечаток и пересобираем превью
+        index_updates.append({"id": entry.id, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": inode})
+        media_updates.append({"id": entry.media_id, "file_size": st.st_size, "is_missing": False})
+        _drop_thumbnail(entry.media_id)
+        jobs.append(ThumbnailJob(entry.media_id, relative_path, _guess_mime_type(file_path.suffix.lower()), False))
+        count_changed += 1
+
+    # Записи индекса, чьих файлов больше нет по старому пути
+    vanished = {path: row for path, row in index.items() if path not in seen and not row.is_encrypted}
+    if partial:
+        vanished = {path: row for path, row in vanished.items() if not (settings.UPLOAD_DIR / path).exists()}
+    vanished_by_inode = {(row.inode, row.size): row for row in vanished.values() if row.inode}
+
+    # Строки без отпечатка (загружены через API или до появления индекса)
+    unindexed = {}
+    if unknown:
+        query = db.query(models.Media.id, models.Media.original_path, models.Media.file_size,
+                         models.Media.media_type, models.Media.thumbnail_path)\
+                  .outerjoin(models.FileIndex, models.FileIndex.media_id == models.Media.id)\
+                  .filter(models.FileIndex.id == None, models.Media.is_encrypted == False)
+        if partial:
+            for chunk in _chunked(relative_path for _, relative_path, _, _ in unknown):
+                unindexed.update((row.original_path, row) for row in query.filter(models.Media.original_path.in_(chunk)))
+        else:
+            unindexed = {row.original_path: row for row in query}
+
+    new_rows = []
+    new_fingerprints = []
+    index_inserts = []
+    count_moved = 0
+
+    for file_path, relative_path, st, inode in unknown:
+        moved = vanished_by_inode.pop((inode, st.st_size), None)
+        if moved is not None:
+            # Переименование или перемещение: тот же inode и размер
+            vanished.pop(moved.path, None)
+            index_updates.append({"id": moved.id, "path": relative_path, "mtime_ns": st.st_mtime_ns})
+            media_updates.append({"id": moved.media_id, "original_path": relative_path,
+                                  "filename": file_path.name, "is_missing": False})
+            count_moved += 1
+            continue
+
+        fingerprint = {"path": relative_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "inode": inode}
+        existing = unindexed.get(relative_path)
+        if existing is not None:
+            index_inserts.append(dict(fingerprint, media_id=existing.id))
+            # Файл снова на месте: флаг мог остаться от скана, видевшего папку без него
+            media_updates.append({"id": existing.id, "file_size": st.st_size, "is_missing": False})
+            if not existing.thumbnail_path:
+                jobs.append(ThumbnailJob(existing.id, relative_path, existing.media_type, False))
+            continue
+
+        new_rows.append(models.Media(
+            filename=file_path.name,
+            original_path=relative_path,
+            file_size=st.st_size,
+            media_type=_guess_mime_type(file_path.suffix.lower()),
+            # Пока воркер не прочитал EXIF, ставим время изменения файла
+            taken_at=datetime.fromtimestamp(st.st_mtime),
+            is_encrypted=False
+        ))
+        new_fingerprints.append(fingerprint)
+
+    for row in vanished.values():
+        if not row.is_missing:
+            media_updates.append({"id": row.media_id, "is_missing": True})
+
+    # Переименования применяем до вставок, чтобы не конфликтовать по уникальному пути
+    if index_updates:
+        db.bulk_update_mappings(models.FileIndex, index_updates)
+    if media_updates:
+        db.bulk_update_mappings(models.Media, media_updates)
+    db.flush()
+
+    for i in range(0, len(new_rows), INSERT_BATCH_SIZE):
+        batch = new_rows[i:i + INSERT_BATCH_SIZE]
+        db.add_all(batch)
+        db.flush()
+        for media, fingerprint in zip(batch, new_fingerprints[i:i + INSERT_BATCH_SIZE]):
+            index_inserts.append(dict(fingerprint, media_id=media.id))
+            jobs.append(ThumbnailJob(media.id, media.original_path, media.media_type, False))
+
+    if index_inserts:
+        db.bulk_insert_mappings(models.FileIndex, index_inserts)
+    db.commit()
+
+    thumbs_done, count_errors = _run_thumbnail_pool(db, jobs, workers)
+
+    elapsed = time.perf_counter() - started
+    rate = count_files / elapsed if elapsed > 0 else 0.0
+    count_missing = sum(1 for row in vanished.values() if not row.is_missing)
+    print(f"--- [Scanner] Завершено за {elapsed:.1f} c ({rate:.1f} файлов/с). "
+          f"Добавлено: {len(new_rows)}, Перемещено: {count_moved}, Пропало: {count_missing}, "
+          f"Превью: {thumbs_done}, Ошибок: {count_errors} ---")
+
+    return {
+        "files": count_files,
+        "added": len(new_rows),
+        "moved": count_moved,
+        "changed": count_changed,
+        "missing": count_missing,
+        "thumbnails": thumbs_done,
+        "errors": count_errors,
+        "elapsed_sec": elapsed,
+        "files_per_sec": rate,
+    }
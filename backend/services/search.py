@@ -0,0 +1,150 @@
+import re
+from sqlalchemy import text, inspect, or_, func, column
+from sqlalchemy.orm import Session
+from ..database import models
+
+# Полнотекстовый индекс по имени файла, альбому и строкам EXIF (rowid = media.id).
+# prefix='2 3' — отдельные индексы префиксов для мгновенного поиска по мере ввода.
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+    filename, album, camera, lens, software,
+    tokenize = "unicode61 remove_diacritics 2",
+    prefix = '2 3'
+)
+"""
+
+# Один SELECT собирает документ индекса для media.id = :id
+_DOCUMENT = """
+SELECT m.id, m.filename,
+       trim(coalesce(a.name, '') || ' ' || coalesce(a.description, '')),
+       trim(coalesce(mm.camera_make, '') || ' ' || coalesce(mm.camera_model, '')),
+       mm.lens, mm.software
+FROM media m
+LEFT JOIN albums a ON a.id = m.album_id
+LEFT JOIN media_metadata mm ON mm.media_id = m.id
+"""
+
+def _refresh(id_expr: str) -> str:
+    return (f"DELETE FROM media_fts WHERE rowid = {id_expr}; "
+            f"INSERT INTO media_fts(rowid, filename, album, camera, lens, software) {_DOCUMENT} WHERE m.id = {id_expr};")
+
+# Триггеры держат индекс в актуальном состоянии при любой записи: загрузка, сканер
+# (включая bulk_insert_mappings), массовые операции, правка альбомов и метаданных.
+TRIGGERS = {
+    "media_fts_ai": f"AFTER INSERT ON media BEGIN {_refresh('new.id')} END",
+    "media_fts_au": f"AFTER UPDATE OF filename, album_id ON media BEGIN {_refresh('new.id')} END",
+    "media_fts_ad": "AFTER DELETE ON media BEGIN DELETE FROM media_fts WHERE rowid = old.id; END",
+    "media_meta_fts_ai": f"AFTER INSERT ON media_metadata BEGIN {_refresh('new.media_id')} END",
+    "media_meta_fts_au": f"AFTER UPDATE ON media_metadata BEGIN {_refresh('new.media_id')} END",
+    "media_meta_fts_ad": f"AFTER DELETE ON media_metadata BEGIN {_refresh('old.media_id')} END",
+    "albums_fts_au": (
+        "AFTER UPDATE OF name, description ON albums BEGIN "
+        "DELETE FROM media_fts WHERE rowid IN (SELECT id FROM media WHERE album_id = new.id); "
+        f"INSERT INTO media_fts(rowid, filename, album, camera, lens, software) {_DOCUMENT} WHERE m.album_id = new.id; "
+        "END"
+    ),
+}
+
+MEDIA_TYPE_PREFIXES = {"photo": "image/", "video": "video/"}
+FACET_CAMERA_LIMIT = 20
+# До стольких совпадений выгоднее взять id из FTS и отсортировать их,
+# чем идти по индексу ленты и проверять каждую строку
+SELECTIVE_MATCH_LIMIT = 2000
+
+def init_index(engine):
+    """Создаёт FTS-таблицу и триггеры; при первом создании заполняет индекс из существующих строк."""
+    is_new = not inspect(engine).has_table("media_fts")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(CREATE_INDEX)
+        for name, body in TRIGGERS.items():
+            conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        if is_new:
+            conn.exec_driver_sql(f"INSERT INTO media_fts(rowid, filename, album, camera, lens, software) {_DOCUMENT}")
+            conn.exec_driver_sql("INSERT INTO media_fts(media_fts) VALUES('optimize')")
+
+def rebuild_index(db: Session):
+    db.execute(text("DELETE FROM media_fts"))
+    db.execute(text(f"INSERT INTO media_fts(rowid, filename, album, camera, lens, software) {_DOCUMENT}"))
+    db.execute(text("INSERT INTO media_fts(media_fts) VALUES('optimize')"))
+    db.commit()
+
+def build_match(query: str):
+    """Текст пользователя -> безопасный запрос FTS5: все слова обязательны, последнее — как префикс."""
+    tokens = re.findall(r"\w+", query or "", re.UNICODE)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens[:-1]]
+    terms.append(f'"{tokens[-1]}"*')
+    return " ".join(terms)
+
+def selective_ids(db: Session, match: str):
+    """id совпадений, если их немного; None — для широкого запроса (или без текста)."""
+    if not match:
+        return None
+    ids = db.execute(text("SELECT rowid FROM media_fts WHERE media_fts MATCH :match LIMIT :limit"),
+                     {"match": match, "limit": SELECTIVE_MATCH_LIMIT + 1}).scalars().all()
+    return ids if len(ids) <= SELECTIVE_MATCH_LIMIT else None
+
+def apply_filters(query, match=None, match_ids=None, media_type=None, date_from=None, date_to=None,
+                  album_id=None, camera=None, has_gps=None):
+    """Накладывает текст и фасеты на запрос по models.Media."""
+    if match_ids is not None:
+        query = query.filter(models.Media.id.in_(match_ids))
+    elif match:
+        fts_ids = text("SELECT rowid FROM media_fts WHERE media_fts MATCH :match")\
+                      .bindparams(match=match).columns(column("rowid"))
+        query = query.filter(models.Media.id.in_(fts_ids))
+    if media_type in MEDIA_TYPE_PREFIXES:
+        query = query.filter(models.Media.media_type.like(f"{MEDIA_TYPE_PREFIXES[media_type]}%"))
+    if date_from is not None:
+        query = query.filter(models.Media.taken_at >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Media.taken_at < date_to)
+    if album_id is not None:
+        query = query.filter(models.Media.album_id == album_id)
+
+    if camera is not None or has_gps is not None:
+        query = query.join(models.MediaMetadata, models.MediaMetadata.media_id == models.Media.id)
+        if camera is not None:
+            query = query.filter(or_(func.lower(models.MediaMetadata.camera_model) == camera.lower(),
+                                     func.lower(models.MediaMetadata.camera_make) == camera.lower()))
+        if has_gps is True:
+            query = query.filter(models.MediaMetadata.gps_lat != None)
+        elif has_gps is False:
+            query = query.filter(models.MediaMetadata.gps_lat == None)
+    return query
+
+def facet_counts(db: Session, is_encrypted: bool, **filters):
+    """Счётчики по фасетам для текущей выборки: тип, альбом, камера, наличие GPS."""
+    # apply_filters сам присоединяет метаданные, если фильтруют по камере или GPS
+    meta_joined = filters.get("camera") is not None or filters.get("has_gps") is not None
+
+    def base(*columns, with_meta=False):
+        query = db.query(*columns).select_from(models.Media).filter(models.Media.is_encrypted == is_encrypted)
+        query = apply_filters(query, **filters)
+        if with_meta and not meta_joined:
+            query = query.join(models.MediaMetadata, models.MediaMetadata.media_id == models.Media.id)
+        return query
+
+    kind = func.substr(models.Media.media_type, 1, func.instr(models.Media.media_type, "/") - 1)
+    types = {"photo": 0, "video": 0}
+    for value, count in base(kind, func.count()).group_by(kind):
+        if value == "image": types["photo"] += count
+        elif value == "video": types["video"] += count
+
+    albums = base(models.Media.album_id, func.count())\
+                 .filter(models.Media.album_id != None).group_by(models.Media.album_id).all()
+
+    cameras = base(models.MediaMetadata.camera_model, func.count(), with_meta=True)\
+                  .filter(models.MediaMetadata.camera_model != None)\
+                  .group_by(models.MediaMetadata.camera_model)\
+                  .order_by(func.count().desc()).limit(FACET_CAMERA_LIMIT).all()
+
+    gps = base(func.count(), with_meta=True).filter(models.MediaMetadata.gps_lat != None).scalar()
+
+    return {
+        "media_type": types,
+        "albums": {album_id: count for album_id, count in albums},
+        "cameras": {model: count for model, count in cameras},
+        "has_gps": gps,
+    }
@@ -0,0 +1,58 @@
+import os
+import threading
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Склеивает одновременные вызовы с одинаковым ключом: работу выполняет первый,
+    остальные ждут и получают его результат (или его исключение).
+    """
+
+    def __init__(self):
+        self._reset()
+        # Пул процессов превью создаётся через fork: ребёнок унаследовал бы чужие вызовы
+        # «в полёте», которые в нём никто не завершит, и ждал бы их вечно
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.event.set()
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.calls)
+
+flights = SingleFlight()
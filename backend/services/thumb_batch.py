@@ -0,0 +1,175 @@
+import json
+import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlalchemy.orm import Session
+from ..config import settings
+from ..database import models
+from ..runtime import vault_state
+from . import bulk, jobs, thumbnail, vault_thumbs, media_cache
+from .http_cache import fingerprint
+
+# Формат ответа: 4 байта (big-endian) длина JSON-оглавления, оглавление, затем превью подряд.
+# Оглавление: {"items": [{"id", "offset", "length"}], "missing": [{"id", "reason"}]},
+# offset — от начала блока данных, порядок — как в запросе. Причина "pending" — превью
+# рендерится в фоне, клиент запрашивает его позже.
+HEADER = struct.Struct(">I")
+MEDIA_TYPE = "application/vnd.homehub.thumbnails"
+
+def parse_ids(raw: str):
+    """ "3,1,2" -> [3, 1, 2] без повторов; ValueError на мусор или превышение лимита."""
+    ids = list(dict.fromkeys(int(part) for part in raw.split(",") if part.strip()))
+    if not ids or len(ids) > settings.THUMB_BATCH_MAX:
+        raise ValueError(f"Expected 1..{settings.THUMB_BATCH_MAX} ids")
+    return ids
+
+def _read(path: Path):
+    try:
+        return path.read_bytes()
+    except OSError:
+        return None
+
+# Проверка «уже в очереди» и постановка задачи не должны разойтись между запросами
+_enqueue_lock = threading.Lock()
+
+def _enqueue(db: Session, ids):
+    """Ставит фоновую rethumb для id, которых ещё нет в незавершённой rethumb."""
+    with _enqueue_lock:
+        queued = {row.media_id for row in db.query(models.JobItem.media_id)
+                  .join(models.Job, models.Job.id == models.JobItem.job_id)
+                  .filter(models.Job.kind == "rethumb", models.Job.status.in_(("queued", "running")),
+                          models.JobItem.status == "pending", models.JobItem.media_id.in_(ids))}
+        todo = [mid for mid in ids if mid not in queued]
+        if todo:
+            jobs.manager.submit(db, "rethumb", todo, {"force": False})
+
+# Превью сейфа нельзя отдать rethumb-задаче (ей нужен ключ), поэтому их догревает
+# отдельный поток; _warming — id, уже стоящие в его очереди
+_vault_warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vault-thumb-warm")
+_warming = set()
+_warming_lock = threading.Lock()
+
+def _vault_path(row) -> Path:
+    return settings.VAULT_DIR / Path(row.original_path).name
+
+def _warm_one(mid: int, vault_path: Path, media_type: str, key: bytes):
+    try:
+        # Сейф могли заблокировать, пока задача ждала очереди
+        if vault_state.get_key() == key:
+            vault_thumbs.store.get_or_create(mid, vault_path, media_type, key)
+    except Exception:
+        pass
+    finally:
+        with _warming_lock:
+            _warming.discard(mid)
+
+def _warm_vault(rows, ids, key: bytes):
+    """Ставит в фон превью сейфа для id, которых ещё нет в очереди догрева."""
+    with _warming_lock:
+        todo = [mid for mid in ids if mid not in _warming]
+        _warming.update(todo)
+    for mid in todo:
+        row = rows[mid]
+        _vault_warmer.submit(_warm_one, mid, _vault_path(row), row.media_type, key)
+
+def _render(db: Session, rows, ids, paths):
+    rendered = []
+    for mid in ids:
+        # Тот же singleflight, что у /{id}/thumbnail: одновременные запросы ждут одну генерацию
+        name, phash = thumbnail.generate_thumbnail_with_hash(rows[mid])
+        if name:
+            paths[mid] = settings.THUMBNAIL_DIR / name
+            rendered.append({"id": mid, "thumbnail_path": name, "phash": phash})
+    if rendered:
+        db.bulk_update_mappings(models.Media, rendered)
+        db.commit()
+        media_cache.cache.invalidate([item["id"] for item in rendered], orderings=False)
+
+def locate(db: Session, ids, key: bytes | None = None):
+    """Один запрос к базе. Возвращает ({id: строка}, {id: путь превью открытого файла},
+    множество id, чьи превью рендерятся в фоне). key — ключ сейфа, если он открыт."""
+    rows = bulk.load_rows(db, ids, models.Media.id, models.Media.original_path, models.Media.media_type,
+                          models.Media.thumbnail_path, models.Media.is_encrypted)
+    paths = {mid: settings.THUMBNAIL_DIR / (row.thumbnail_path or f"thumb_{mid}.jpg")
+             for mid, row in rows.items() if not row.is_encrypted}
+    missing = [mid for mid, path in paths.items() if not path.exists()]
+    # Немного превью рендерим на месте, остальные — фоновой задачей: запрос не держит
+    # поток пула на всю пачку, а повторный запрос той же сетки не ставит работу заново
+    inline = missing[:settings.THUMB_BATCH_INLINE]
+    pending = set(missing[settings.THUMB_BATCH_INLINE:])
+    if inline:
+        _render(db, rows, inline, paths)
+    if pending:
+        _enqueue(db, sorted(pending))
+    # Холодные превью сейфа делят тот же лимит: на месте их отрисует collect, остальные — фон
+    if key is not None:
+        cold = [mid for mid, row in rows.items() if row.is_encrypted
+                and not vault_thumbs.store.cached(mid) and _vault_path(row).exists()]
+        deferred = cold[max(settings.THUMB_BATCH_INLINE - len(inline), 0):]
+        if deferred:
+            pending.update(deferred)
+            _warm_vault(rows, deferred, key)
+    return rows, paths, pending
+
+def etag(ids, rows, paths, pending):
+    """Отпечаток набора открытых превью; None, если в наборе есть сейф или превью
+    в работе (такой ответ не кэшируем)."""
+    if len(paths) < len(rows) or pending:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for mid in ids:
+        try:
+            digest.update(f"{mid}:{fingerprint(paths[mid].stat())};".encode())
+        except (KeyError, OSError):
+            digest.update(f"{mid}:-;".encode())
+    return f'"{digest.hexdigest()}"'
+
+def collect(ids, rows, paths, pending, key):
+    """Читает превью параллельно. Возвращает [(id, bytes или None, причина)] в порядке ids."""
+
+    def load(mid):
+        row = rows.get(mid)
+        if row is None:
+            return mid, None, "not_found"
+        if mid in pending:
+            return mid, None, "pending"
+        if row.is_encrypted:
+            if key is None:
+                return mid, None, "locked"
+            vault_path = _vault_path(row)
+            if not vault_path.exists():
+                return mid, None, "file_missing"
+            try:
+                data = vault_thumbs.store.get_or_create(mid, vault_path, row.media_type, key)
+            except Exception:
+                data = None
+            return mid, data, None if data else "render_failed"
+        data = _read(paths[mid])
+        return mid, data, None if data else "render_failed"
+
+    with ThreadPoolExecutor(max_workers=settings.THUMB_BATCH_READERS, thread_name_prefix="thumb-batch") as executor:
+        return list(executor.map(load, ids))
+
+def pack(results) -> bytes:
+    items, missing, blobs = [], [], []
+    offset = 0
+    for mid, data, reason in results:
+        if data is None:
+            missing.append({"id": mid, "reason": reason})
+            continue
+        items.append({"id": mid, "offset": offset, "length": len(data)})
+        blobs.append(data)
+        offset += len(data)
+    index = json.dumps({"items": items, "missing": missing}, separators=(",", ":")).encode()
+    return b"".join([HEADER.pack(len(index)), index, *blobs])
+
+def unpack(payload: bytes):
+    """Обратное к pack (для клиентов на Python и бенчмарка): ({id: bytes}, missing)."""
+    (index_size,) = HEADER.unpack_from(payload)
+    index = json.loads(payload[HEADER.size:HEADER.size + index_size])
+    base = HEADER.size + index_size
+    thumbs = {item["id"]: payload[base + item["offset"]:base + item["offset"] + item["length"]]
+              for item in index["items"]}
+    return thumbs, index["missing"]
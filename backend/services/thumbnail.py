@@ -1,9 +1,12 @@
 import os
 import io
+import threading
+from collections import namedtuple
 from PIL import Image, ImageOps
-import cv2
 from pathlib import Path
 from ..config import settings
+from .singleflight import flights
+from . import video
 
 # --- Подключаем поддержку HEIC ---
 try:
@@ -22,16 +25,68 @@ except ImportError:
     HAS_RAW = False
     print("Warning: rawpy not installed. Advanced RAW support disabled.")
 
+THUMB_MAX_SIDE = 400
+RAW_EXTENSIONS = {'.cr2', '.nef', '.dng', '.arw', '.orf', '.rw2'}
+# raw.sizes.flip (LibRaw) -> поворот, если во встроенном превью нет EXIF-ориентации
+RAW_FLIP_TRANSPOSE = {3: Image.Transpose.ROTATE_180, 5: Image.Transpose.ROTATE_90, 6: Image.Transpose.ROTATE_270}
+
+def atomic_save(img, path: Path, pil_format: str, **options):
+    """Пишет во временный файл рядом и переименовывает: недописанный файл никогда не виден."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        img.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists(): os.unlink(tmp_path)
+
 def generate_thumbnail(media_item, _unused=None) -> str:
     if not media_item.original_path:
         return None
         
+    thumb_filename = f"thumb_{media_item.id}.jpg"
+    if (settings.THUMBNAIL_DIR / thumb_filename).exists():
+        return thumb_filename
+
+    # Одновременные запросы одного превью ждут единственную генерацию
+    return flights.do(("thumb", media_item.id), _render_thumbnail, media_item, thumb_filename)[0]
+
+def generate_thumbnail_with_hash(media_item):
+    """Как generate_thumbnail, но дополнительно возвращает перцептивный хэш: (имя, phash)."""
+    if not media_item.original_path:
+        return None, None
+
     thumb_filename = f"thumb_{media_item.id}.jpg"
     thumb_path = settings.THUMBNAIL_DIR / thumb_filename
-    
     if thumb_path.exists():
-        return thumb_filename
-        
+        return thumb_filename, phash_from_file(thumb_path)
+
+    return flights.do(("thumb", media_item.id), _render_thumbnail, media_item, thumb_filename)
+
+def compute_phash(img) -> int:
+    """dHash: 64 бита, знак разности соседних пикселей уменьшенной серой копии 9x8."""
+    small = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    # SQLite хранит знаковые 64-битные целые
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def phash_from_file(path: Path):
+    try:
+        with Image.open(path) as img:
+            img.draft("L", (64, 64))
+            return compute_phash(img)
+    except Exception:
+        return None
+
+def _render_thumbnail(media_item, thumb_filename: str):
+    thumb_path = settings.THUMBNAIL_DIR / thumb_filename
+    if thumb_path.exists():
+        return thumb_filename, phash_from_file(thumb_path)
+
     filename = Path(media_item.original_path).name
     if media_item.is_encrypted:
         source_path = settings.VAULT_DIR / filename
@@ -39,19 +94,19 @@ def generate_thumbnail(media_item, _unused=None) -> str:
         source_path = settings.UPLOAD_DIR / media_item.original_path
     
     if not source_path.exists():
-        return None
+        return None, None
     
     try:
         img = None
         
         if media_item.media_type and media_item.media_type.startswith('video/'):
-            img = _extract_video_frame(source_path)
+            img = video.extract_poster_frame(source_path)
 
         if img is None:
-            img = _load_image_robust(source_path)
+            img = _load_image_robust(source_path, THUMB_MAX_SIDE)
 
         if img is None:
-            return None
+            return None, None
 
         try: img = ImageOps.exif_transpose(img)
         except Exception: pass
@@ -59,29 +114,39 @@ def generate_thumbnail(media_item, _unused=None) -> str:
         if img.mode in ("RGBA", "P", "CMYK"): 
             img = img.convert("RGB")
             
-        img.thumbnail((400, 400), Image.Resampling.LANCZOS)
-        img.save(thumb_path, "JPEG", quality=85)
+        img.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE), Image.Resampling.LANCZOS)
+        # Хэш считаем по уже декодированной картинке, повторно файл не читаем
+        phash = compute_phash(img)
+        atomic_save(img, thumb_path, "JPEG", quality=85)
         
-        return thumb_filename
+        return thumb_filename, phash
 
     except Exception as e:
         print(f"Thumb error for {media_item.id}: {e}")
-        return None
+        return None, None
+
+# Лёгкое описание задачи для пула процессов (ORM-объекты не сериализуются)
+ThumbnailJob = namedtuple("ThumbnailJob", ["id", "original_path", "media_type", "is_encrypted"])
+
+def run_thumbnail_job(job: ThumbnailJob):
+    """Точка входа для воркера пула процессов: возвращает (id, имя превью, phash)."""
+    thumb_filename, phash = generate_thumbnail_with_hash(job)
+    return job.id, thumb_filename, phash
 
 def generate_memory_thumbnail(file_path: Path, media_type: str) -> bytes:
     try:
         img = None
         if media_type and media_type.startswith('video/'):
-            img = _extract_video_frame(file_path)
+            img = video.extract_poster_frame(file_path)
         else:
-            img = _load_image_robust(file_path)
+            img = _load_image_robust(file_path, THUMB_MAX_SIDE)
             
         if img:
             try: img = ImageOps.exif_transpose(img)
             except: pass
             if img.mode != "RGB": img = img.convert("RGB")
             
-            img.thumbnail((400, 400), Image.Resampling.LANCZOS)
+            img.thumbnail((THUMB_MAX_SIDE, THUMB_MAX_SIDE), Image.Resampling.LANCZOS)
             output = io.BytesIO()
             img.save(output, format="JPEG", quality=80)
             return output.getvalue()
@@ -106,40 +171,60 @@ def convert_image_to_jpeg_bytes(file_path: Path) -> bytes:
 
 # --- Helpers ---
 
-def _extract_video_frame(path: Path):
+def _load_raw_preview(path: str, max_side: int):
+    """Встроенное в RAW превью камеры вместо демозаики; None, если его нет или оно мельче max_side."""
     try:
-        cap = cv2.VideoCapture(str(path))
-        if cap.isOpened():
-            cap.set(cv2.CAP_PROP_POS_MSEC, 1000)
-            ret, frame = cap.read()
-            if not ret:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                ret, frame = cap.read()
-            cap.release()
-            if ret:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                return Image.fromarray(frame_rgb)
+        with rawpy.imread(path) as raw:
+            thumb = raw.extract_thumb()
+            flip = raw.sizes.flip
     except Exception:
-        pass
-    return None
+        return None
+
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        img = Image.open(io.BytesIO(thumb.data))
+        img.draft("RGB", (max_side, max_side))
+        img.load()
+        has_orientation = img.getexif().get(0x0112) is not None
+    elif thumb.format == rawpy.ThumbFormat.BITMAP:
+        img = Image.fromarray(thumb.data)
+        has_orientation = False
+    else:
+        return None
+
+    if max(img.size) < max_side:
+        return None
+    if not has_orientation and flip in RAW_FLIP_TRANSPOSE:
+        img = img.transpose(RAW_FLIP_TRANSPOSE[flip])
+    return img
 
-def _load_image_robust(path: Path):
+def _load_image_robust(path: Path, max_side: int = None):
+    """
+    Загружает изображение. С max_side декодирует не больше, чем нужно для картинки
+    этого размера: JPEG — через DCT-масштабирование libjpeg (draft), RAW — встроенное превью.
+    """
     str_path = str(path)
     ext = path.suffix.lower()
 
-    if HAS_RAW and ext in ['.cr2', '.nef', '.dng', '.arw', '.orf', '.rw2']:
+    if HAS_RAW and ext in RAW_EXTENSIONS:
+        if max_side:
+            img = _load_raw_preview(str_path, max_side)
+            if img is not None:
+                return img
         try:
             with rawpy.imread(str_path) as raw:
-                rgb = raw.postprocess(use_camera_wb=True)
+                rgb = raw.postprocess(use_camera_wb=True, half_size=bool(max_side))
                 return Image.fromarray(rgb)
         except Exception as e:
             print(f"Rawpy failed for {path}: {e}, trying Pillow")
 
     try:
         img = Image.open(path)
+        if max_side and img.format == "JPEG":
+            # Масштаб 1/2..1/8 при декодировании: результат не меньше max_side по обеим сторонам
+            img.draft("RGB", (max_side, max_side))
         img.load() # Force load
         return img
     except Exception as e:
         print(f"Pillow load failed for {path}: {e}")
     
-    return None
\ No newline at end of file
+    return None
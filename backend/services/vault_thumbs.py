@@ -0,0 +1,107 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from ..config import settings
+from .. import crypto_utils
+from . import thumbnail
+from .singleflight import flights
+
+class VaultThumbnailStore:
+    """
+    Превью файлов сейфа: создаются один раз, хранятся на диске зашифрованными
+    мастер-ключом (AES-GCM) и отдаются через LRU в памяти, которое стирается при блокировке.
+    """
+
+    def __init__(self, max_memory_bytes: int):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+    def _path(self, media_id: int) -> Path:
+        return settings.VAULT_THUMB_DIR / f"thumb_{media_id}.enc"
+
+    def _remember(self, media_id: int, data: bytes):
+        with self.lock:
+            old = self.memory.pop(media_id, None)
+            if old is not None:
+                self.memory_bytes -= len(old)
+            self.memory[media_id] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes and self.memory:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= len(evicted)
+
+    def get(self, media_id: int, key: bytes):
+        with self.lock:
+            data = self.memory.get(media_id)
+            if data is not None:
+                self.memory.move_to_end(media_id)
+                return data
+
+        path = self._path(media_id)
+        if not path.exists():
+            return None
+        data = crypto_utils.decrypt_data(path.read_bytes(), key)
+        if data is not None:
+            self._remember(media_id, data)
+        return data
+
+    def put(self, media_id: int, data: bytes, key: bytes):
+        settings.VAULT_THUMB_DIR.mkdir(parents=True, exist_ok=True)
+        path = self._path(media_id)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_bytes(crypto_utils.encrypt_data(data, key))
+        os.replace(tmp_path, path)
+        self._remember(media_id, data)
+
+    def cached(self, media_id: int) -> bool:
+        """Есть ли готовое превью (в памяти или на диске) — без расшифровки."""
+        with self.lock:
+            if media_id in self.memory:
+                return True
+        return self._path(media_id).exists()
+
+    def get_or_create(self, media_id: int, vault_path: Path, media_type: str, key: bytes):
+        data = self.get(media_id, key)
+        if data is not None:
+            return data
+        return flights.do(("vault_thumb", media_id), self._create, media_id, vault_path, media_type, key)
+
+    def _create(self, media_id: int, vault_path: Path, media_type: str, key: bytes):
+        data = self.get(media_id, key)
+        if data is not None:
+            return data
+
+        # Первый запрос: расшифровываем оригинал один раз и сохраняем превью
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            temp_path = Path(tmp.name)
+        try:
+            crypto_utils.decrypt_file_to_disk(vault_path, temp_path, key)
+            data = thumbnail.generate_memory_thumbnail(temp_path, media_type)
+        finally:
+            if temp_path.exists(): os.unlink(temp_path)
+
+        if data:
+            self.put(media_id, data, key)
+        return data
+
+    def remove(self, media_id: int):
+        with self.lock:
+            old = self.memory.pop(media_id, None)
+            if old is not None:
+                self.memory_bytes -= len(old)
+        path = self._path(media_id)
+        try:
+            if path.exists(): os.remove(path)
+        except OSError:
+            pass
+
+    def wipe_memory(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+
+store = VaultThumbnailStore(settings.VAULT_THUMB_CACHE_BYTES)
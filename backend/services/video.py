@@ -0,0 +1,147 @@
+import os
+from pathlib import Path
+import cv2
+import numpy as np
+from PIL import Image
+from ..config import settings
+from .singleflight import flights
+
+# Доли длительности, в которых ищем кадр для обложки (начало и конец часто чёрные)
+POSTER_POSITIONS = (0.1, 0.25, 0.4, 0.55, 0.7, 0.85)
+# Кадр с такой оценкой берём сразу, не досматривая остальные точки
+POSTER_GOOD_ENOUGH = 45.0
+SCORE_SIDE = 64
+DARK_LEVEL = 24
+BRIGHT_LEVEL = 232
+
+def _fourcc_to_codec(value) -> str:
+    code = int(value)
+    if code <= 0:
+        return None
+    chars = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    return chars.strip("\x00 ").lower() or None
+
+def probe(path: Path) -> dict:
+    """Длительность, разрешение, кодек и частота кадров — только из заголовков контейнера."""
+    cap = cv2.VideoCapture(str(path))
+    try:
+        if not cap.isOpened():
+            return {}
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+        info = {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or None,
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None,
+            "video_codec": _fourcc_to_codec(cap.get(cv2.CAP_PROP_FOURCC)),
+            "fps": round(fps, 3) if fps > 0 else None,
+            "duration": round(frames / fps, 3) if fps > 0 and frames > 0 else None,
+        }
+        return info
+    finally:
+        cap.release()
+
+def _score_frame(frame) -> float:
+    """Оценка «информативности» кадра: контраст, со штрафом за почти чёрные и засвеченные кадры."""
+    small = cv2.resize(frame, (SCORE_SIDE, SCORE_SIDE), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    mean = float(gray.mean())
+    spread = float(gray.std())
+    if mean < DARK_LEVEL or mean > BRIGHT_LEVEL:
+        return spread * 0.1
+    return spread * (1.0 - abs(mean - 128.0) / 256.0)
+
+def _read_at(cap, position_ms: float):
+    cap.set(cv2.CAP_PROP_POS_MSEC, position_ms)
+    ret, frame = cap.read()
+    return frame if ret else None
+
+def _duration_ms(cap) -> float:
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+    return frames / fps * 1000.0 if fps > 0 and frames > 0 else 0.0
+
+def extract_poster_frame(path: Path):
+    """
+    Выбирает кадр для обложки: смотрит несколько точек по длительности ролика
+    и берёт самый контрастный не чёрный кадр. Возвращает PIL.Image или None.
+    """
+    cap = cv2.VideoCapture(str(path))
+    try:
+        if not cap.isOpened():
+            return None
+        duration = _duration_ms(cap)
+        positions = [duration * p for p in POSTER_POSITIONS] if duration > 0 else [1000.0]
+
+        best, best_score = None, -1.0
+        for position in positions:
+            frame = _read_at(cap, position)
+            if frame is None:
+                continue
+            score = _score_frame(frame)
+            if score > best_score:
+                best, best_score = frame, score
+            if score >= POSTER_GOOD_ENOUGH:
+                break
+
+        if best is None:
+            # Контейнер без индекса: читаем первый кадр подряд
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, best = cap.read()
+            if not ret:
+                return None
+        return Image.fromarray(cv2.cvtColor(best, cv2.COLOR_BGR2RGB))
+    except Exception:
+        return None
+    finally:
+        cap.release()
+
+def preview_path(media_id: int) -> Path:
+    return settings.THUMBNAIL_DIR / f"preview_{media_id}.webp"
+
+def generate_preview(media_id: int, source_path: Path):
+    """Короткое анимированное WebP-превью из кадров, равномерно взятых по ролику."""
+    path = preview_path(media_id)
+    if path.exists():
+        return path
+    return flights.do(("video_preview", media_id), _render_preview, source_path, path)
+
+def _render_preview(source_path: Path, path: Path):
+    if path.exists():
+        return path
+    side = settings.VIDEO_PREVIEW_SIZE
+    count = settings.VIDEO_PREVIEW_FRAMES
+
+    cap = cv2.VideoCapture(str(source_path))
+    try:
+        if not cap.isOpened():
+            return None
+        duration = _duration_ms(cap)
+        if duration <= 0:
+            return None
+        frames = []
+        for position in np.linspace(0.05, 0.95, count) * duration:
+            frame = _read_at(cap, position)
+            if frame is None:
+                continue
+            img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            img.thumbnail((side, side), Image.Resampling.BILINEAR)
+            frames.append(img)
+    finally:
+        cap.release()
+
+    if not frames:
+        return None
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        frames[0].save(tmp_path, "WEBP", save_all=True, append_images=frames[1:],
+                       duration=settings.VIDEO_PREVIEW_FRAME_MS, loop=0, quality=70, method=4)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists(): os.unlink(tmp_path)
+    return path
+
+def remove_preview(media_id: int):
+    try:
+        preview_path(media_id).unlink()
+    except FileNotFoundError:
+        pass
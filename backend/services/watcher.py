@@ -0,0 +1,422 @@
+import os
+import sys
+import time
+import struct
+import select
+import threading
+import ctypes
+import ctypes.util
+from pathlib import Path
+from ..config import settings
+from ..database import database
+from . import scanner, media_cache
+
+# --- inotify (Linux) ---
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+class _InotifyBackend:
+    """Рекурсивное наблюдение через inotify, подключаемый через ctypes без внешних зависимостей."""
+
+    def __init__(self, root: Path, on_paths, on_overflow):
+        self.root = root
+        self.on_paths = on_paths
+        self.on_overflow = on_overflow
+        self.watches = {}
+
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._add_tree(root)
+
+    def _add_watch(self, path: Path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def _add_tree(self, path: Path):
+        self._add_watch(path)
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for d in dirs:
+                self._add_watch(Path(root) / d)
+
+    def poll(self, timeout: float):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                self.on_overflow()
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = parent / os.fsdecode(name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not path.name.startswith('.'):
+                    # Новый каталог: ставим наблюдение и забираем то, что успело в него попасть
+                    self._add_tree(path)
+                    changed.append(path)
+                elif mask & IN_MOVED_FROM:
+                    changed.append(path)
+                continue
+
+            changed.append(path)
+
+        if changed:
+            self.on_paths(changed)
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+# --- ReadDirectoryChangesW (Windows) ---
+FILE_LIST_DIRECTORY = 0x0001
+FILE_SHARE_ALL = 0x00000001 | 0x00000002 | 0x00000004
+OPEN_EXISTING = 3
+FILE_FLAG_BACKUP_SEMANTICS = 0x02000000
+NOTIFY_FILTER = 0x00000001 | 0x00000002 | 0x00000008 | 0x00000010  # имя файла, имя каталога, размер, запись
+NOTIFY_HEADER = struct.Struct("<III")  # NextEntryOffset, Action, FileNameLength; затем имя в UTF-16
+
+class _WindowsBackend:
+    """Рекурсивное наблюдение через ReadDirectoryChangesW (ctypes). Вызов блокирующий,
+    поэтому читает отдельный поток, а poll только проверяет, жив ли он."""
+
+    def __init__(self, root: Path, on_paths, on_overflow):
+        from ctypes import wintypes
+        self.root = root
+        self.on_paths = on_paths
+        self.on_overflow = on_overflow
+        self.closed = False
+        self.error = None
+
+        k32 = self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        k32.CreateFileW.restype = wintypes.HANDLE
+        k32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, ctypes.c_void_p,
+                                    wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+        k32.ReadDirectoryChangesW.restype = wintypes.BOOL
+        k32.ReadDirectoryChangesW.argtypes = [wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD, wintypes.BOOL,
+                                              wintypes.DWORD, ctypes.POINTER(wintypes.DWORD), ctypes.c_void_p, ctypes.c_void_p]
+        k32.CancelIoEx.argtypes = [wintypes.HANDLE, ctypes.c_void_p]
+        k32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+        self.handle = k32.CreateFileW(str(root), FILE_LIST_DIRECTORY, FILE_SHARE_ALL, None, OPEN_EXISTING,
+                                      FILE_FLAG_BACKUP_SEMANTICS, None)
+        if self.handle in (None, ctypes.c_void_p(-1).value):
+            raise ctypes.WinError(ctypes.get_last_error())
+        self.thread = threading.Thread(target=self._read_loop, name="media-watcher-win", daemon=True)
+        self.thread.start()
+
+    def _read_loop(self):
+        from ctypes import wintypes
+        buffer = ctypes.create_string_buffer(64 * 1024)
+        returned = wintypes.DWORD()
+        while not self.closed:
+            ok = self.kernel32.ReadDirectoryChangesW(self.handle, buffer, len(buffer), True, NOTIFY_FILTER,
+                                                     ctypes.byref(returned), None, None)
+            if not ok:
+                if not self.closed:
+                    self.error = ctypes.WinError(ctypes.get_last_error())
+                return
+            if returned.value == 0:
+                # Событий больше, чем поместилось в буфер: система их отбросила
+                self.on_overflow()
+                continue
+            paths = self._parse(buffer.raw[:returned.value])
+            if paths:
+                self.on_paths(paths)
+
+    def _parse(self, data: bytes):
+        paths = []
+        offset = 0
+        while offset + NOTIFY_HEADER.size <= len(data):
+            next_offset, _action, name_len = NOTIFY_HEADER.unpack_from(data, offset)
+            start = offset + NOTIFY_HEADER.size
+            name = data[start:start + name_len].decode("utf-16-le", errors="replace")
+            if not any(part.startswith('.') for part in Path(name).parts):
+                paths.append(self.root / name)
+            if not next_offset:
+                break
+            offset += next_offset
+        return paths
+
+    def poll(self, timeout: float):
+        if self.error is not None:
+            raise self.error
+        time.sleep(timeout)
+
+    def close(self):
+        self.closed = True
+        # Прерывает блокирующий ReadDirectoryChangesW в потоке чтения
+        self.kernel32.CancelIoEx(self.handle, None)
+        self.kernel32.CloseHandle(self.handle)
+        self.thread.join(timeout=1)
+
+# --- Опрос ---
+# Раз в столько опросов дерево читается целиком: правку файла на месте mtime каталога не видит
+FULL_POLL_EVERY = 60
+# Каталог, изменённый незадолго до чтения, читается и на следующем опросе:
+# файл, созданный в тот же тик таймера, не сдвинул бы его mtime
+DIR_SETTLE_NS = 2 * 10**9
+
+class _PollingBackend:
+    """
+    Запасной вариант: периодически сравнивает снимки (mtime, size).
+    Заново читаются только каталоги со сменившимся mtime (создание, удаление, переименование)
+    и файлы, менявшиеся на прошлом опросе (копирование ещё идёт); остальное берётся из снимка.
+    """
+
+    def __init__(self, root: Path, on_paths, on_overflow, interval: float):
+        self.root = root
+        self.on_paths = on_paths
+        self.interval = interval
+        # каталог -> (mtime_ns, время чтения, {файл: (mtime_ns, size)}, [подкаталоги])
+        self.dirs = {}
+        self.hot = set()
+        self.polls = 0
+        self._refresh(full=True)
+        self.hot = set()
+        self.next_poll = time.monotonic() + interval
+
+    def _list(self, directory: str):
+        files, subdirs = {}, []
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            return None
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'): continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext not in scanner.IMAGE_EXTENSIONS and ext not in scanner.VIDEO_EXTENSIONS:
+                        continue
+                    st = entry.stat()
+                    files[entry.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return files, subdirs
+
+    def _refresh(self, full: bool):
+        changed = []
+        seen = {}
+        relisted = set()
+        stack = [str(self.root)]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            old = self.dirs.get(directory)
+            if full or old is None or old[0] != mtime or old[1] - mtime < DIR_SETTLE_NS:
+                listed_at = time.time_ns()
+                listing = self._list(directory)
+                if listing is None:
+                    continue
+                files, subdirs = listing
+                old_files = old[2] if old else {}
+                changed.extend(p for p, fp in files.items() if old_files.get(p) != fp)
+                changed.extend(p for p in old_files if p not in files)
+                seen[directory] = (mtime, listed_at, files, subdirs)
+                relisted.add(directory)
+            else:
+                seen[directory] = old
+                subdirs = old[3]
+            stack.extend(subdirs)
+
+        # Каталог исчез вместе с файлами
+        for directory, (_, _, files, _) in self.dirs.items():
+            if directory not in seen:
+                changed.extend(files)
+
+        for path in self.hot:
+            directory = os.path.dirname(path)
+            if directory in relisted or directory not in seen:
+                continue
+            files = seen[directory][2]
+            try:
+                st = os.stat(path)
+                fingerprint = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                fingerprint = None
+            if files.get(path) != fingerprint:
+                changed.append(path)
+                if fingerprint is None:
+                    files.pop(path, None)
+                else:
+                    files[path] = fingerprint
+
+        self.dirs = seen
+        self.hot = set(changed)
+        return changed
+
+    def poll(self, timeout: float):
+        delay = self.next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            return
+        self.next_poll = time.monotonic() + self.interval
+
+        self.polls += 1
+        changed = self._refresh(full=self.polls % FULL_POLL_EVERY == 0)
+        if changed:
+            self.on_paths([Path(p) for p in changed])
+
+    def close(self):
+        pass
+
+class MediaWatcher:
+    """
+    Фоновое наблюдение за папкой загрузок.
+    События копятся и отдаются сканеру пачками после того, как файл «затих»
+    на WATCH_DEBOUNCE_SEC, поэтому большая выгрузка с камеры появляется постепенно.
+    """
+
+    def __init__(self, root: Path = None):
+        self.root = root or settings.UPLOAD_DIR
+        self.debounce = settings.WATCH_DEBOUNCE_SEC
+        self.batch_size = settings.WATCH_BATCH_SIZE
+        self.pending = {}
+        self.full_rescan = False
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.backend_name = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="media-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def _on_paths(self, paths):
+        now = time.monotonic()
+        with self.lock:
+            for path in paths:
+                self.pending[path] = now
+
+    def _on_overflow(self):
+        with self.lock:
+            self.full_rescan = True
+
+    def _create_backend(self):
+        if sys.platform.startswith("linux"):
+            try:
+                backend = _InotifyBackend(self.root, self._on_paths, self._on_overflow)
+                self.backend_name = "inotify"
+                return backend
+            except (OSError, AttributeError) as e:
+                print(f"--- [Watcher] inotify недоступен ({e}), переключаюсь на опрос")
+        if sys.platform == "win32":
+            try:
+                backend = _WindowsBackend(self.root, self._on_paths, self._on_overflow)
+                self.backend_name = "ReadDirectoryChangesW"
+                return backend
+            except (OSError, AttributeError) as e:
+                print(f"--- [Watcher] ReadDirectoryChangesW недоступен ({e}), переключаюсь на опрос")
+        self.backend_name = "polling"
+        return _PollingBackend(self.root, self._on_paths, self._on_overflow, settings.WATCH_POLL_INTERVAL_SEC)
+
+    def _run(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        backend = self._create_backend()
+        print(f"--- [Watcher] Наблюдение за {self.root} ({self.backend_name})")
+
+        # Догоняем изменения, случившиеся пока приложение было закрыто
+        self._scan(None)
+
+        try:
+            while not self.stop_event.is_set():
+                backend.poll(min(self.debounce, 0.5))
+                self._flush()
+        except Exception as e:
+            print(f"--- [Watcher] Остановлен из-за ошибки: {e}")
+        finally:
+            backend.close()
+
+    def _take_ready(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.full_rescan:
+                self.full_rescan = False
+                self.pending.clear()
+                return None
+            ready = [p for p, ts in self.pending.items() if now - ts >= self.debounce]
+            ready = ready[:self.batch_size]
+            for path in ready:
+                del self.pending[path]
+            return ready
+
+    def _flush(self):
+        while True:
+            ready = self._take_ready()
+            if ready is None:
+                self._scan(None)
+                return
+            if not ready:
+                return
+            self._scan(ready)
+
+    def _scan(self, paths):
+        db = database.SessionLocal()
+        report = None
+        try:
+            report = scanner.scan_incremental(db, paths)
+        except Exception as e:
+            db.rollback()
+            print(f"--- [Watcher] Ошибка обработки изменений: {e}")
+        finally:
+            # Скан коммитит пачками: часть строк могла измениться и при ошибке.
+            # Ленты зависят от набора строк и taken_at: перемещение и пропажа их не меняют
+            orderings = report is None or bool(report["added"] or report["changed"])
+            media_cache.cache.invalidate(orderings=orderings)
+            db.close()
+
+watcher = MediaWatcher()
+
+def start_watcher():
+    if settings.WATCH_ENABLED:
+        watcher.start()
@@ -0,0 +1,124 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..config import settings
+
+class WorkerPoolBusy(Exception):
+    """Очередь пула переполнена — запрос нужно повторить позже."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Media worker pool is busy")
+        self.retry_after = retry_after
+
+class MediaWorkerPool:
+    """
+    Ограниченный пул потоков для превью, RAW, расшифровки и EXIF.
+    Живёт отдельно от стандартного пула Starlette, чтобы тяжёлые запросы
+    не занимали потоки дешёвых (список, health). Сверх лимита очереди — отказ.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media-worker")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait_sec = 0.0
+        self.total_run_sec = 0.0
+
+    def _admit(self):
+        with self.lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise WorkerPoolBusy(self.retry_after)
+            self.queued += 1
+
+    def _wrap(self, fn, args, kwargs, submitted_at: float):
+        def task():
+            started = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.active += 1
+                self.total_wait_sec += started - submitted_at
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.total_run_sec += time.perf_counter() - started
+                    if ok: self.completed += 1
+                    else: self.failed += 1
+        return task
+
+    def submit(self, fn, *args, **kwargs):
+        """Синхронная постановка задачи (для фоновых потоков). Возвращает Future."""
+        self._admit()
+        return self.executor.submit(self._wrap(fn, args, kwargs, time.perf_counter()))
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет fn в пуле и дожидается результата, не блокируя цикл событий."""
+        self._admit()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._wrap(fn, args, kwargs, time.perf_counter()))
+
+    def stream(self, iterator):
+        """
+        Асинхронный итератор по синхронному: каждый next() выполняется в пуле, так что
+        блокирующее чтение и расшифровка не занимают ни цикл событий, ни потоки Starlette.
+        В полёте не больше одного элемента. Переполненная очередь отклоняет запрос сразу,
+        до начала ответа; элементы уже начатого ответа не отклоняются.
+        """
+        with self.lock:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise WorkerPoolBusy(self.retry_after)
+        return self._stream(iterator)
+
+    async def _stream(self, iterator):
+        loop = asyncio.get_running_loop()
+        done = object()
+        future = None
+        try:
+            while True:
+                with self.lock:
+                    self.queued += 1
+                future = loop.run_in_executor(
+                    self.executor, self._wrap(next, (iterator, done), {}, time.perf_counter()))
+                item = await future
+                if item is done:
+                    return
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                # Клиент отключился посреди next(): закрываем генератор, когда поток его отпустит
+                if future is not None and not future.done():
+                    future.add_done_callback(lambda _: close())
+                else:
+                    close()
+
+    def metrics(self):
+        with self.lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.max_workers,
+                "queue_limit": self.max_queue,
+                "active": self.active,
+                "queued": self.queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait_sec / finished * 1000, 2) if finished else 0.0,
+                "avg_run_ms": round(self.total_run_sec / finished * 1000, 2) if finished else 0.0,
+            }
+
+pool = MediaWorkerPool(settings.MEDIA_WORKERS, settings.MEDIA_QUEUE_LIMIT, settings.MEDIA_RETRY_AFTER_SEC)
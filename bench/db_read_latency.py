@@ -0,0 +1,102 @@
+"""
+Задержка чтения ленты, пока сканер пишет в базу: настройки SQLite по умолчанию против WAL и прагм.
+
+    python bench/db_read_latency.py [число файлов]
+
+Для каждого варианта создаётся отдельная база и папка с маленькими JPEG, запускается
+scan_incremental, а параллельный поток всё это время читает первую страницу ленты.
+"""
+import sys
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backend.config import settings  # noqa: E402
+
+READ_PAGE_SIZE = 200
+SEED_ROWS = 20000
+
+def _prepare(root: Path, files: int):
+    settings.DATA_DIR = root
+    settings.UPLOAD_DIR = root / "uploads"
+    settings.THUMBNAIL_DIR = root / "thumbnails"
+    settings.DATABASE_URL = f"sqlite:///{root}/homehub.db"
+    for path in (settings.UPLOAD_DIR, settings.THUMBNAIL_DIR):
+        path.mkdir(parents=True)
+    for i in range(files):
+        Image.new("RGB", (16, 16), (i % 255, 80, 160)).save(settings.UPLOAD_DIR / f"img{i}.jpg")
+
+def _engines(url: str, tuned: bool):
+    from backend.database import database
+    if tuned:
+        return database.make_engine(url), database.make_engine(url, read_only=True)
+    plain = create_engine(url, connect_args={"check_same_thread": False})
+    return plain, plain
+
+def _seed(engine):
+    from backend.database import database, models
+    from backend.services import search
+    from datetime import datetime, timedelta
+    database.Base.metadata.create_all(bind=engine)
+    search.init_index(engine)
+    session = sessionmaker(bind=engine)()
+    base = datetime(2020, 1, 1)
+    session.bulk_insert_mappings(models.Media, [
+        dict(filename=f"seed{i}.jpg", original_path=f"seed/{i}.jpg", media_type="image/jpeg",
+             is_encrypted=False, taken_at=base + timedelta(minutes=i), file_size=1)
+        for i in range(SEED_ROWS)
+    ])
+    session.commit()
+    session.close()
+
+def _read_loop(Session, stop: threading.Event, latencies: list):
+    from backend.database import models
+    while not stop.is_set():
+        session = Session()
+        started = time.perf_counter()
+        session.query(models.Media.id, models.Media.thumbnail_path, models.Media.taken_at)\
+               .filter(models.Media.is_encrypted == False)\
+               .order_by(models.Media.taken_at.desc(), models.Media.id.desc()).limit(READ_PAGE_SIZE).all()
+        latencies.append(time.perf_counter() - started)
+        session.close()
+        time.sleep(0.005)
+
+def _run(label: str, tuned: bool, files: int):
+    from backend.services import scanner
+    with tempfile.TemporaryDirectory() as tmp:
+        _prepare(Path(tmp), files)
+        write_engine, read_engine = _engines(settings.DATABASE_URL, tuned)
+        _seed(write_engine)
+
+        latencies = []
+        stop = threading.Event()
+        reader = threading.Thread(target=_read_loop, args=(sessionmaker(bind=read_engine), stop, latencies))
+        reader.start()
+
+        session = sessionmaker(bind=write_engine)()
+        started = time.perf_counter()
+        scanner.scan_incremental(session)
+        scan_sec = time.perf_counter() - started
+        session.close()
+        stop.set()
+        reader.join()
+        write_engine.dispose()
+        read_engine.dispose()
+
+    latencies.sort()
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000
+    print(f"{label:<10}{scan_sec:>8.1f}{len(latencies):>8}{pick(0.5):>9.1f}{pick(0.95):>9.1f}{pick(0.99):>9.1f}{latencies[-1] * 1000:>9.1f}")
+
+def main(files: int):
+    print(f"{'config':<10}{'scan, s':>8}{'reads':>8}{'p50, ms':>9}{'p95, ms':>9}{'p99, ms':>9}{'max, ms':>9}")
+    _run("default", False, files)
+    _run("tuned", True, files)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,114 @@
+"""
+Повторная загрузка сетки превью: полный ответ против проверки ETag (304) и ?v= (из кэша клиента).
+
+    python bench/http_cache_grid.py [число плиток]
+
+Поднимает роутер media на временной базе, готовит превью и трижды загружает сетку:
+без кэша клиента, с If-None-Match и с версионированными URL через простой кэш клиента,
+который, как браузер, отдаёт свежие ответы (max-age, immutable) без запроса в сеть.
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backend.config import settings  # noqa: E402
+
+ROUNDS = 3
+
+def _prepare(root: Path, tiles: int):
+    settings.DATA_DIR = root
+    settings.UPLOAD_DIR = root / "uploads"
+    settings.THUMBNAIL_DIR = root / "thumbnails"
+    settings.DATABASE_URL = f"sqlite:///{root}/homehub.db"
+    for path in (settings.UPLOAD_DIR, settings.THUMBNAIL_DIR):
+        path.mkdir(parents=True)
+
+    from backend.database import database, models
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    for i in range(tiles):
+        name = f"img{i}.jpg"
+        Image.new("RGB", (64, 48), (i % 255, 90, 40)).save(settings.UPLOAD_DIR / name)
+        Image.new("RGB", (400, 300), (i % 255, 90, 40)).save(settings.THUMBNAIL_DIR / f"thumb_{i + 1}.jpg", quality=80)
+        db.add(models.Media(id=i + 1, filename=name, original_path=name, media_type="image/jpeg",
+                            thumbnail_path=f"thumb_{i + 1}.jpg", file_size=1))
+    db.commit()
+    db.close()
+
+class _ClientCache:
+    """Кэш клиента по Cache-Control: свежий ответ отдаётся без запроса, no-store не хранится."""
+
+    def __init__(self, client: TestClient):
+        self.client = client
+        self.entries = {}
+
+    def get(self, url: str, headers=None):
+        entry = self.entries.get(url)
+        if entry is not None and time.monotonic() < entry[0]:
+            return "cache", entry[1]
+        response = self.client.get(url, headers=headers)
+        directives = {part.strip().split("=")[0]: part.strip() for part in
+                      response.headers.get("cache-control", "").split(",")}
+        if response.status_code == 200 and "no-store" not in directives and "max-age" in directives:
+            max_age = int(directives["max-age"].split("=")[1])
+            self.entries[url] = (time.monotonic() + max_age, response.content)
+        return response.status_code, response.content
+
+def _grid(fetch, tiles: int, url_for, headers_for=None):
+    started = time.perf_counter()
+    transferred = 0
+    statuses = {}
+    for media_id in range(1, tiles + 1):
+        status, content = fetch(url_for(media_id), headers_for(media_id) if headers_for else None)
+        if status != "cache":
+            transferred += len(content)
+        statuses[status] = statuses.get(status, 0) + 1
+    return time.perf_counter() - started, transferred, statuses
+
+def _fetch(client: TestClient):
+    def fetch(url, headers):
+        response = client.get(url, headers=headers)
+        return response.status_code, response.content
+    return fetch
+
+def main(tiles: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        _prepare(Path(tmp), tiles)
+        from backend.routers import media
+        app = FastAPI()
+        app.include_router(media.router)
+        client = TestClient(app)
+
+        etags = {}
+        for media_id in range(1, tiles + 1):
+            etags[media_id] = client.get(f"/api/media/{media_id}/thumbnail").headers["etag"]
+
+        def plain_url(mid):
+            return f"/api/media/{mid}/thumbnail"
+
+        def versioned_url(mid):
+            return f"/api/media/{mid}/thumbnail?v={etags[mid].strip(chr(34))}"
+
+        cache = _ClientCache(client)
+        # Первый проход наполняет кэш клиента, повторные меряются как обычно
+        _grid(cache.get, tiles, versioned_url)
+
+        modes = [
+            ("full", _fetch(client), plain_url, None),
+            ("revalidate", _fetch(client), plain_url, lambda mid: {"If-None-Match": etags[mid]}),
+            ("versioned", cache.get, versioned_url, None),
+        ]
+        print(f"{'mode':<12}{'ms/grid':>10}{'KiB':>10}  statuses")
+        for label, fetch, url_for, headers_for in modes:
+            best = min(_grid(fetch, tiles, url_for, headers_for) for _ in range(ROUNDS))
+            print(f"{label:<12}{best[0] * 1000:>10.1f}{best[1] / 1024:>10.1f}  {best[2]}")
+        print(f"versioned Cache-Control: {client.get(versioned_url(1)).headers['cache-control']}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
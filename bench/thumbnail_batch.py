@@ -0,0 +1,69 @@
+"""
+Загрузка экрана сетки: по запросу на плитку против одного пакетного /thumbnails/batch.
+
+    python bench/thumbnail_batch.py [число плиток]
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backend.config import settings  # noqa: E402
+
+ROUNDS = 3
+
+def _prepare(root: Path, tiles: int):
+    settings.DATA_DIR = root
+    settings.UPLOAD_DIR = root / "uploads"
+    settings.THUMBNAIL_DIR = root / "thumbnails"
+    settings.DATABASE_URL = f"sqlite:///{root}/homehub.db"
+    for path in (settings.UPLOAD_DIR, settings.THUMBNAIL_DIR):
+        path.mkdir(parents=True)
+
+    from backend.database import database, models
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    for i in range(tiles):
+        name = f"img{i}.jpg"
+        Image.new("RGB", (64, 48), (i % 255, 90, 40)).save(settings.UPLOAD_DIR / name)
+        Image.new("RGB", (400, 300), (i % 255, 90, 40)).save(settings.THUMBNAIL_DIR / f"thumb_{i + 1}.jpg", quality=80)
+        db.add(models.Media(id=i + 1, filename=name, original_path=name, media_type="image/jpeg",
+                            thumbnail_path=f"thumb_{i + 1}.jpg", file_size=1))
+    db.commit()
+    db.close()
+
+def _per_tile(client: TestClient, tiles: int):
+    return sum(len(client.get(f"/api/media/{mid}/thumbnail").content) for mid in range(1, tiles + 1))
+
+def _batched(client: TestClient, tiles: int):
+    ids = ",".join(str(mid) for mid in range(1, tiles + 1))
+    return len(client.get(f"/api/media/thumbnails/batch?ids={ids}").content)
+
+def _best(fn, *args):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        size = fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), size
+
+def main(tiles: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        _prepare(Path(tmp), tiles)
+        from backend.routers import media
+        app = FastAPI()
+        app.include_router(media.router)
+        client = TestClient(app)
+
+        print(f"{'mode':<10}{'requests':>10}{'ms/grid':>10}{'KiB':>10}")
+        for label, fn, requests in (("per-tile", _per_tile, tiles), ("batch", _batched, 1)):
+            seconds, size = _best(fn, client, tiles)
+            print(f"{label:<10}{requests:>10}{seconds * 1000:>10.1f}{size / 1024:>10.1f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,73 @@
+"""
+Сравнение полного декодирования и быстрого пути превью по форматам.
+
+    python bench/thumbnail_decode.py [файлы...]
+
+Без аргументов генерирует синтетические 24 Мп JPEG и PNG. RAW-файлы (и любые
+другие) можно передать аргументами — формат определяется по расширению.
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from backend.services import thumbnail  # noqa: E402
+
+ROUNDS = 3
+
+def _full_decode(path: Path):
+    """Старый путь: полный декод в исходном разрешении (postprocess для RAW), потом уменьшение."""
+    if thumbnail.HAS_RAW and path.suffix.lower() in thumbnail.RAW_EXTENSIONS:
+        import rawpy
+        with rawpy.imread(str(path)) as raw:
+            img = Image.fromarray(raw.postprocess(use_camera_wb=True))
+    else:
+        img = Image.open(path)
+        img.load()
+    return _finish(img)
+
+def _fast_decode(path: Path):
+    return _finish(thumbnail._load_image_robust(path, thumbnail.THUMB_MAX_SIDE))
+
+def _finish(img):
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB": img = img.convert("RGB")
+    img.thumbnail((thumbnail.THUMB_MAX_SIDE, thumbnail.THUMB_MAX_SIDE), Image.Resampling.LANCZOS)
+    return img
+
+def _best_of(fn, path: Path) -> float:
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def _synthetic_samples(root: Path):
+    # Плавный градиент с шумом: ближе к фотографии, чем однотонная заливка
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:4000, 0:6000]
+    base = np.stack([x * 255 // 6000, y * 255 // 4000, (x + y) * 255 // 10000], axis=-1)
+    noise = rng.integers(0, 24, base.shape)
+    img = Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+    samples = [root / "sample_24mp.jpg", root / "sample_24mp.png"]
+    img.save(samples[0], "JPEG", quality=90)
+    img.save(samples[1], "PNG", compress_level=1)
+    return samples
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = [Path(p) for p in paths] or _synthetic_samples(Path(tmp))
+        print(f"{'file':<28}{'full, ms':>10}{'fast, ms':>10}{'speedup':>9}")
+        for path in samples:
+            full = _best_of(_full_decode, path)
+            fast = _best_of(_fast_decode, path)
+            print(f"{path.name:<28}{full * 1000:>10.1f}{fast * 1000:>10.1f}{full / fast:>8.1f}x")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -9,8 +9,9 @@ if sys.stderr is None:
 
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-from backend.main import start_app
-
 if __name__ == "__main__":
+    # До импорта приложения: дочерний процесс замороженной сборки выходит здесь,
+    # не загружая backend.main
     multiprocessing.freeze_support()
+    from backend.main import start_app
     start_app()
\ No newline at end of file
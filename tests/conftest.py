@@ -0,0 +1,32 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from backend.config import settings
+
+# Все пути — во временный каталог до импорта database: движок создаётся при импорте
+_root = Path(tempfile.mkdtemp(prefix="homehub-tests-"))
+settings.DATA_DIR = _root
+settings.UPLOAD_DIR = _root / "uploads"
+settings.VAULT_DIR = _root / "vault_storage"
+settings.THUMBNAIL_DIR = _root / "thumbnails"
+settings.DATABASE_URL = f"sqlite:///{_root}/homehub.db"
+
+from backend.database import database, migrations  # noqa: E402
+
+@pytest.fixture(scope="session")
+def engine():
+    settings.init_directories()
+    settings.THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
+    database.Base.metadata.create_all(bind=database.engine)
+    migrations.run(database.engine, budget_sec=60)
+    return database.engine
+
+@pytest.fixture
+def db(engine):
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
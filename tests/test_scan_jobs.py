@@ -0,0 +1,52 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+from backend.config import settings
+from backend.database import models
+from backend.routers import media
+
+SCAN_MODES = ("incremental", "sequential", "parallel")
+
+def _reset_library(db):
+    db.query(models.FileIndex).delete()
+    db.query(models.MediaMetadata).delete()
+    db.query(models.Media).delete()
+    db.commit()
+    for path in settings.UPLOAD_DIR.rglob("*.jpg"):
+        path.unlink()
+    for path in settings.THUMBNAIL_DIR.glob("*.jpg"):
+        path.unlink()
+
+def _wait(db, job_id: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        db.expire_all()
+        job = db.get(models.Job, job_id)
+        if job.status in ("completed", "failed", "cancelled"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+@pytest.mark.parametrize("mode", SCAN_MODES)
+def test_scan_job_indexes_new_files(db, mode):
+    _reset_library(db)
+    (settings.UPLOAD_DIR / "trip").mkdir(parents=True, exist_ok=True)
+    for i in range(3):
+        Image.new("RGB", (64, 48), (i * 60, 90, 40)).save(settings.UPLOAD_DIR / "trip" / f"img{i}.jpg")
+
+    started = media.trigger_scan(mode, db)
+    job = _wait(db, started["job_id"])
+
+    assert job.status == "completed", job.error
+    assert job.items_total == 3
+    rows = db.query(models.Media).order_by(models.Media.original_path).all()
+    assert [row.original_path for row in rows] == [f"trip/img{i}.jpg" for i in range(3)]
+    assert all(row.thumbnail_path and (settings.THUMBNAIL_DIR / row.thumbnail_path).exists() for row in rows)
+
+def test_scan_rejects_unknown_mode(db):
+    with pytest.raises(HTTPException) as error:
+        media.trigger_scan("bogus", db)
+    assert error.value.status_code == 400